@@ -0,0 +1,149 @@
+"""
+Bootstrap Benchmark
+Runs ./src/ec2/scripts/bootstrap.py end to end against the fake S3 and IMDS endpoints in ./fake_aws.py,
+the same way terraform/user_data.sh runs it on a fresh instance, but without touching the system.
+
+A synthetic server profile is packaged with ./profile_archive.py, with an install-java.sh that sleeps to
+stand in for the Java install, and served at a limited bandwidth. The report gives the time of every
+bootstrap step, the total wall clock time and how much of the step time overlapped.
+
+Usage:
+    python benchmarks/bench_bootstrap.py [--runs 3] [--profile-mib 64] [--bandwidth-mib 100]
+        [--java-install-seconds 2] [--output FILE]
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCHMARKS_DIR, "..")
+SCRIPTS_DIR = os.path.join(ROOT_DIR, "src", "ec2", "scripts")
+sys.path.insert(0, ROOT_DIR)
+
+from fake_aws import FakeAWS  # noqa: E402
+from profile_archive import BuildProfileArchive  # noqa: E402
+
+BUCKET = "awscraft-bench"
+PROFILE_NAME = "DefaultMinecraftProfile"
+
+
+def make_profile(server_dir: str, size: int, java_install_seconds: float):
+    """
+    Writes a server profile of roughly the given size: a mix of compressible files and incompressible
+    ones standing in for the server jar and region files.
+    """
+    os.makedirs(os.path.join(server_dir, "world", "region"), exist_ok=True)
+    with open(os.path.join(server_dir, "install-java.sh"), "w") as f:
+        f.write(f"#!/bin/sh\nsleep {java_install_seconds}\n")
+    with open(os.path.join(server_dir, "start-server.sh"), "w") as f:
+        f.write("#!/bin/sh\njava -jar \"$1\" nogui\n")
+    with open(os.path.join(server_dir, "server.properties"), "w") as f:
+        f.write("enable-rcon=false\nrcon.password=\nrcon.port=25575\nmotd=Benchmark\n")
+    with open(os.path.join(server_dir, "server.jar"), "wb") as f:
+        f.write(os.urandom(size // 4))
+    region_size = 4 * 1024 * 1024
+    for index in range(max(1, size // 2 // region_size)):
+        with open(os.path.join(server_dir, "world", "region", f"r.{index}.0.mca"), "wb") as f:
+            f.write(os.urandom(region_size))
+    with open(os.path.join(server_dir, "logs.txt"), "wb") as f:
+        f.write(b"[12:00:00] [Server thread/INFO]: Benchmark log line\n" * (size // 4 // 52))
+
+
+async def bench_bootstrap(args, profile: bytes, work_dir: str) -> list[dict]:
+    reports = []
+    async with FakeAWS() as aws:
+        aws.bandwidth = args.bandwidth_mib * 1024 * 1024
+        aws.latency = args.latency_ms / 1000
+        aws.buckets[BUCKET] = {
+            f"profiles/{PROFILE_NAME}.zip": profile,
+            "services/start-minecraft.service": b"[Unit]\nDescription=Benchmark\n",
+            **{f"scripts/{name}": open(os.path.join(SCRIPTS_DIR, name), "rb").read()
+               for name in sorted(os.listdir(SCRIPTS_DIR)) if name.endswith((".py", ".sh"))},
+        }
+
+        for run in range(args.runs):
+            minecraft_dir = os.path.join(work_dir, f"run-{run}")
+            env = {
+                **os.environ,
+                "S3_BUCKET": BUCKET,
+                "MINECRAFT_DIR": minecraft_dir,
+                "SYSTEMD_DIR": os.path.join(minecraft_dir, "systemd"),
+                "BOOTSTRAP_SYSTEM": "0",
+                "IMDS_ENDPOINT": aws.url,
+                "S3_ENDPOINT": aws.url,
+                "PYTHONUNBUFFERED": "1",
+            }
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.join(SCRIPTS_DIR, "bootstrap.py"), env=env,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output, _ = await process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f"bootstrap.py exited with {process.returncode}:\n{output.decode()}")
+            with open(os.path.join(minecraft_dir, "bootstrap-timings.json")) as f:
+                reports.append(json.load(f))
+    return reports
+
+
+def summarize(reports: list[dict]) -> dict:
+    steps = {name: statistics.median(report["steps"][name]["seconds"] for report in reports)
+             for name in reports[0]["steps"]}
+    total = statistics.median(report["total_seconds"] for report in reports)
+    serial = sum(steps.values())
+    return {
+        "total_seconds": total,
+        "serial_steps_seconds": serial,
+        "overlap_saved_seconds": serial - total,
+        "steps": {f"{name}_seconds": seconds for name, seconds in steps.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--profile-mib", type=int, default=64)
+    parser.add_argument("--bandwidth-mib", type=float, default=100, help="Fake S3 bandwidth in MiB/s.")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Fake S3 and IMDS latency per request.")
+    parser.add_argument("--java-install-seconds", type=float, default=2)
+    parser.add_argument("--output", help="Write the results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        server_dir = os.path.join(work_dir, "server")
+        make_profile(server_dir, args.profile_mib * 1024 * 1024, args.java_install_seconds)
+        archive = BuildProfileArchive(server_dir, os.path.join(work_dir, "build"), PROFILE_NAME)
+        with open(archive.path, "rb") as f:
+            profile = f.read()
+        reports = asyncio.run(bench_bootstrap(args, profile, work_dir))
+
+    report = {
+        "benchmark": "bootstrap",
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "runs": args.runs,
+            "profile_bytes": len(profile),
+            "bandwidth_mib": args.bandwidth_mib,
+            "latency_ms": args.latency_ms,
+            "java_install_seconds": args.java_install_seconds,
+        },
+        "results": summarize(reports),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
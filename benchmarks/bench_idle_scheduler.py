@@ -0,0 +1,102 @@
+"""
+Idle Scheduler Benchmark
+Replays randomly generated play sessions against the idle scheduler in
+./src/ec2/scripts/idle_scheduler.py on a simulated clock, and compares the
+adaptive policy with the original fixed interval, stop on first empty sample, policy.
+
+For each policy it reports how long the instance stays running after the last
+player leaves (billed idle time), how many sessions were stopped while players
+were still coming back (false stops), and how many probes were sent.
+
+Usage:
+    python benchmarks/bench_idle_scheduler.py [--sessions N] [--seed N] [--hourly-price USD]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "ec2", "scripts"))
+
+from idle_scheduler import IdlePolicy, simulate  # noqa: E402
+
+# The policy stop-server.py used before the idle scheduler: check every 180s, stop on the first empty sample
+LEGACY_POLICY = IdlePolicy(min_interval=180, player_interval=180, max_interval=180, idle_samples=1, idle_window=0,
+                           startup_grace=180)
+ADAPTIVE_POLICY = IdlePolicy()
+
+
+def make_session(rng: random.Random) -> tuple[list[tuple[float, float]], float]:
+    """
+    Generates the time each player is online during a session.
+
+    Returns:
+        tuple[list[tuple[float, float]], float]: The (join, leave) intervals and the time the last player leaves.
+    """
+    intervals = []
+    players = rng.randint(1, 6)
+    for player in range(players):
+        # Whoever started the server joins shortly after it is up, the rest trickle in later
+        join = rng.uniform(30, 150) if player == 0 else rng.uniform(30, 30 * 60)
+        leave = join + rng.uniform(20 * 60, 4 * 60 * 60)
+        # Some players drop out briefly to reconnect part way through the session
+        if rng.random() < 0.3:
+            gap_start = rng.uniform(join, leave)
+            gap_end = gap_start + rng.uniform(10, 45)
+            intervals.append((join, gap_start))
+            intervals.append((gap_end, leave))
+        else:
+            intervals.append((join, leave))
+    return intervals, max(leave for _, leave in intervals)
+
+
+def run_policy(policy: IdlePolicy, sessions: list[tuple[list[tuple[float, float]], float]]) -> dict:
+    idle_seconds = []
+    false_stops = 0
+    probes = 0
+    for intervals, last_leave in sessions:
+        def players_at(now: float) -> int:
+            return sum(1 for join, leave in intervals if join <= now < leave)
+
+        result = simulate(policy, players_at, duration=last_leave + 24 * 60 * 60)
+        probes += result.probes
+        if result.stopped_at is None:
+            continue
+        if result.stopped_at < last_leave:
+            false_stops += 1
+        else:
+            idle_seconds.append(result.stopped_at - last_leave)
+
+    return {
+        "idle_mean": statistics.mean(idle_seconds) if idle_seconds else 0.0,
+        "idle_p95": statistics.quantiles(idle_seconds, n=20)[-1] if len(idle_seconds) > 1 else 0.0,
+        "idle_total": sum(idle_seconds),
+        "false_stops": false_stops,
+        "probes": probes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--hourly-price", type=float, default=0.10,
+                        help="On demand price of the instance type in USD per hour.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sessions = [make_session(rng) for _ in range(args.sessions)]
+
+    print(f"{args.sessions} simulated sessions, seed {args.seed}")
+    print(f"{'Policy':<10} {'Idle mean':>10} {'Idle p95':>10} {'Idle cost':>10} {'False stops':>12} {'Probes':>8}")
+    for label, policy in [("legacy", LEGACY_POLICY), ("adaptive", ADAPTIVE_POLICY)]:
+        stats = run_policy(policy, sessions)
+        cost = stats["idle_total"] / 3600 * args.hourly_price
+        print(f"{label:<10} {stats['idle_mean']:>9.0f}s {stats['idle_p95']:>9.0f}s {cost:>9.2f}$ "
+              f"{stats['false_stops']:>12} {stats['probes']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Metrics Benchmark
+Measures the cost of recording samples with ./src/ec2/scripts/metrics.py, the overhead the stop script
+pays on every ping and RCON command, and the time to render the metrics endpoint.
+
+Usage:
+    python benchmarks/bench_metrics.py [--iterations N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "ec2", "scripts"))
+
+from metrics import Counter, Gauge, Histogram, Registry  # noqa: E402
+
+
+def measure(label: str, func, iterations: int):
+    started = time.perf_counter()
+    func(iterations)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<36} {elapsed / iterations * 1e9:>8.0f} ns/op")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    registry = Registry()
+    counter = Counter("bench_total", "Counter.", registry=registry)
+    labelled = Counter("bench_labelled_total", "Labelled counter.", ("command", "result"), registry=registry)
+    gauge = Gauge("bench_gauge", "Gauge.", registry=registry)
+    histogram = Histogram("bench_seconds", "Histogram.", registry=registry)
+    values = [(i % 1000) / 100.0 for i in range(1000)]
+
+    def baseline(n):
+        for _ in range(n):
+            pass
+
+    def counter_inc(n):
+        for _ in range(n):
+            counter.inc()
+
+    def labelled_inc(n):
+        for _ in range(n):
+            labelled.labels("list", "ok").inc()
+
+    def gauge_set(n):
+        for i in range(n):
+            gauge.set(i)
+
+    def histogram_observe(n):
+        for i in range(n):
+            histogram.observe(values[i % 1000])
+
+    def timed_block(n):
+        for _ in range(n):
+            started = time.perf_counter()
+            histogram.observe(time.perf_counter() - started)
+
+    measure("loop baseline", baseline, args.iterations)
+    measure("Counter.inc", counter_inc, args.iterations)
+    measure("Counter.labels(...).inc", labelled_inc, args.iterations)
+    measure("Gauge.set", gauge_set, args.iterations)
+    measure("Histogram.observe", histogram_observe, args.iterations)
+    measure("perf_counter x2 + Histogram.observe", timed_block, args.iterations)
+
+    # The stop script exposes a couple of dozen series, render a registry of a similar size
+    for command in ["list", "save-off", "save-all", "save-on", "stop"]:
+        labelled.labels(command, "ok").inc()
+        labelled.labels(command, "error").inc()
+    renders = max(args.iterations // 1000, 1)
+    started = time.perf_counter()
+    for _ in range(renders):
+        body = registry.render()
+    elapsed = time.perf_counter() - started
+    print(f"{'Registry.render':<36} {elapsed / renders * 1e6:>8.1f} us/scrape ({len(body)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Minecraft Protocol Microbenchmark
+Compares the throughput of ./src/ec2/scripts/minecraft_protocol.py against the
+original VarInt and packet helpers that lived in stop-server.py.
+
+Usage:
+    python benchmarks/bench_minecraft_protocol.py [--iterations N]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "ec2", "scripts"))
+
+import minecraft_protocol  # noqa: E402
+
+
+# ---------------------------------------------------------
+# Original implementations, kept verbatim for the comparison
+# ---------------------------------------------------------
+SEGMENT_BITS = b'\x7F'[0]
+CONTINUE_BIT = b'\x80'[0]
+
+
+def legacy_encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        if (value & ~SEGMENT_BITS) == 0:
+            out.append(value)
+            return bytes(out)
+        else:
+            out.append((value & SEGMENT_BITS) | CONTINUE_BIT)
+            value >>= 7
+
+
+def legacy_decode_varint(data: bytes) -> int:
+    value = 0
+    shift = 0
+
+    for index in range(len(data)):
+        current_byte = data[index]
+        value |= (current_byte & SEGMENT_BITS) << shift
+
+        if (current_byte & CONTINUE_BIT) == 0:
+            return value
+
+        shift += 7
+        if shift >= 32:
+            raise ValueError("VarInt is too big")
+
+    raise ValueError("Incomplete VarInt")
+
+
+def legacy_make_handshake_packet(host: str, port: int, next_state: int) -> bytes:
+    packet_id = b'\x00'
+    protocol_version = legacy_encode_varint(4)
+    server_address = legacy_encode_varint(len(host)) + host.encode('utf-8')
+    server_port = port.to_bytes(2, byteorder='big')
+    intent = legacy_encode_varint(next_state)
+
+    packet_data = (packet_id + protocol_version + server_address + server_port + intent)
+    return legacy_encode_varint(len(packet_data)) + packet_data
+
+
+def legacy_make_status_request_packet() -> bytes:
+    packet_id = b'\x00'
+    return legacy_encode_varint(len(packet_id)) + packet_id
+
+
+async def legacy_decode_status_response(reader: asyncio.StreamReader) -> dict:
+    packet_length = legacy_decode_varint(await reader.read(3))
+    _ = legacy_decode_varint(await reader.read(2))
+    data = (await reader.read(packet_length - 3)).decode('utf-8')
+    return json.loads(data)
+
+
+# ---------
+# Workloads
+# ---------
+def make_status_payload(favicon_bytes: int, sample_size: int) -> bytes:
+    """
+    Builds a framed Status Response packet of roughly the requested size.
+    """
+    status = {
+        "version": {"name": "1.21.1", "protocol": 767},
+        "players": {
+            "max": 20,
+            "online": sample_size,
+            "sample": [{"name": f"player{i}", "id": f"00000000-0000-0000-0000-{i:012d}"} for i in range(sample_size)],
+        },
+        "description": {"text": "A Minecraft Server"},
+        "favicon": "data:image/png;base64," + "A" * favicon_bytes,
+    }
+    return minecraft_protocol.MakePacket(0x00, minecraft_protocol.encode_string(json.dumps(status)))
+
+
+def feed_reader(payload: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(payload)
+    reader.feed_eof()
+    return reader
+
+
+def bench(label: str, statement, iterations: int) -> float:
+    seconds = min(timeit.repeat(statement, number=iterations, repeat=3))
+    rate = iterations / seconds
+    print(f"  {label:<28} {rate:>14,.0f} ops/s")
+    return rate
+
+
+def run_encode_benchmarks(iterations: int):
+    print("VarInt encode (values 0..2^28):")
+    values = [0, 1, 127, 128, 300, 16383, 16384, 2097151, 268435455]
+    legacy = bench("legacy encode_varint", lambda: [legacy_encode_varint(v) for v in values], iterations)
+    new = bench("minecraft_protocol", lambda: [minecraft_protocol.encode_varint(v) for v in values], iterations)
+    print(f"  speedup: {new / legacy:.2f}x")
+
+    print("VarInt decode:")
+    encoded = [legacy_encode_varint(v) for v in values]
+    # The legacy decoder cannot report how many bytes it consumed, so it is given pre split input
+    stream = b"".join(encoded)
+
+    def read_all():
+        buffer = minecraft_protocol.PacketBuffer(stream)
+        return [buffer.read_varint() for _ in values]
+
+    legacy = bench("legacy decode_varint", lambda: [legacy_decode_varint(e) for e in encoded], iterations)
+    new = bench("PacketBuffer.read_varint", read_all, iterations)
+    print(f"  speedup: {new / legacy:.2f}x")
+
+    print("Handshake + status request packets:")
+    legacy = bench("legacy builders",
+                   lambda: legacy_make_handshake_packet("localhost", 25565, 1) + legacy_make_status_request_packet(),
+                   iterations)
+    new = bench("minecraft_protocol",
+                lambda: minecraft_protocol.MakeHandShakePacket("localhost", 25565, 1)
+                + minecraft_protocol.STATUS_REQUEST_PACKET,
+                iterations)
+    print(f"  speedup: {new / legacy:.2f}x")
+
+
+def run_decode_benchmarks(iterations: int):
+    loop = asyncio.new_event_loop()
+    try:
+        for label, favicon_bytes, sample_size in [("small", 0, 0), ("modded", 48 * 1024, 12)]:
+            payload = make_status_payload(favicon_bytes, sample_size)
+            print(f"Status response decode ({label}, {len(payload):,} bytes):")
+
+            async def legacy_decode():
+                return await legacy_decode_status_response(feed_reader(payload))
+
+            async def new_decode():
+                return (await minecraft_protocol.decode_status_response(feed_reader(payload))).players_online
+
+            try:
+                loop.run_until_complete(legacy_decode())
+                legacy = bench("legacy decode_status_response",
+                               lambda: loop.run_until_complete(legacy_decode()), iterations // 10)
+            except (ValueError, UnicodeDecodeError) as e:
+                legacy = None
+                print(f"  legacy decode_status_response failed: {type(e).__name__}: {e}")
+            new = bench("minecraft_protocol", lambda: loop.run_until_complete(new_decode()), iterations // 10)
+            if legacy:
+                print(f"  speedup: {new / legacy:.2f}x")
+    finally:
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    run_encode_benchmarks(args.iterations)
+    run_decode_benchmarks(args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+Stop Server Benchmark
+End to end benchmarks for ./src/ec2/scripts/stop-server.py and the modules it uses, run against the
+fake Minecraft server in ./fake_minecraft_server.py and the fake AWS endpoints in ./fake_aws.py.
+
+    ping        Server list pings per second and their latency, for status responses of different sizes.
+    query       Query basic and full stats per second and their latency, next to a Server List Ping of the
+                same server with 12 players online.
+    rcon        RCON round trip time, throughput with commands from concurrent tasks and multi-packet replies.
+    shutdown    Wall time from the last player leaving to the StopInstances call, running the real
+                stop-server.py in a subprocess with a short idle policy.
+    shutdown_log
+                The same with IDLE_DETECTOR=log, following the fake server's log instead of polling it.
+    log_tail    CPU used by the log tail while the server writes lines and stop-server.py is busy elsewhere,
+                probing players or saving the world, instead of waiting for lines. It should be none, a
+                share above LOG_TAIL_MAX_CPU_SHARE counts as a regression even without a baseline.
+
+Results are written as JSON. Passing a baseline from an earlier run compares every metric with it and
+exits with status 1 if any regressed by more than the tolerance.
+
+Usage:
+    python benchmarks/bench_stop_server.py [--only ping,query,rcon,shutdown,shutdown_log,log_tail]
+        [--output FILE] [--baseline FILE] [--tolerance 0.25]
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(BENCHMARKS_DIR, "..", "src", "ec2", "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+from fake_aws import FakeAWS  # noqa: E402
+from fake_minecraft_server import FakeMinecraftServer  # noqa: E402
+from log_watch import LogTail  # noqa: E402
+from minecraft_protocol import query_status  # noqa: E402
+from query_client import QueryClient  # noqa: E402
+from rcon_client import RconClient  # noqa: E402
+
+# (name, players listed in the sample, favicon bytes)
+PING_PROFILES = [
+    ("minimal", 0, 0),
+    ("sample_12", 12, 0),
+    ("favicon_16k", 0, 16 * 1024),
+]
+# Short enough to finish in seconds, still probing several times before the server counts as idle
+SHUTDOWN_POLICY = {
+    "PLAYER_CHECK_INTERVAL": "1",
+    "PLAYER_CHECK_MIN_INTERVAL": "0.25",
+    "IDLE_SAMPLES": "3",
+    "IDLE_WINDOW": "0.5",
+    "STARTUP_GRACE_PERIOD": "0.5",
+}
+# Only measurements are compared with the baseline, their unit says which direction is better
+HIGHER_IS_BETTER_SUFFIXES = ("_per_second",)
+LOWER_IS_BETTER_SUFFIXES = ("_ms", "_seconds")
+LOG_TAIL_STALL_SECONDS = 2.0
+LOG_TAIL_MAX_CPU_SHARE = 0.1
+
+
+def percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def summarize_latencies(latencies: list[float]) -> dict:
+    return {
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "latency_mean_ms": statistics.mean(latencies) * 1000,
+    }
+
+
+async def bench_ping(iterations: int, concurrency: int) -> dict:
+    results = {}
+    for name, sample_size, favicon_size in PING_PROFILES:
+        async with FakeMinecraftServer(sample_size=sample_size, favicon_size=favicon_size) as server:
+            response_bytes = len(server.status_json())
+            for _ in range(10):
+                await query_status(server.host, server.port)
+
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(iterations):
+                ping_started = time.perf_counter()
+                await query_status(server.host, server.port)
+                latencies.append(time.perf_counter() - ping_started)
+            sequential = time.perf_counter() - started
+
+            async def worker(count: int):
+                for _ in range(count):
+                    await query_status(server.host, server.port)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(iterations // concurrency) for _ in range(concurrency)))
+            concurrent = time.perf_counter() - started
+
+        results[name] = {
+            "response_bytes": response_bytes,
+            "pings_per_second": iterations / sequential,
+            "concurrent_pings_per_second": iterations // concurrency * concurrency / concurrent,
+            "decoded_mib_per_second": response_bytes * iterations / sequential / 1024 / 1024,
+            **summarize_latencies(latencies),
+        }
+    return results
+
+
+async def bench_query(iterations: int) -> dict:
+    results = {}
+    async with FakeMinecraftServer(query_port=0, players_online=12, sample_size=12) as server:
+        async with QueryClient(server.host, server.query_port) as client:
+            probes = {
+                "basic_stat": client.basic_stat,
+                "full_stat": client.full_stat,
+                "status_ping": lambda: query_status(server.host, server.port),
+            }
+            for name, probe in probes.items():
+                for _ in range(10):
+                    await probe()
+
+                latencies = []
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    probe_started = time.perf_counter()
+                    await probe()
+                    latencies.append(time.perf_counter() - probe_started)
+                elapsed = time.perf_counter() - started
+                results[name] = {
+                    "requests_per_second": iterations / elapsed,
+                    **summarize_latencies(latencies),
+                }
+
+            stat = await client.full_stat()
+            if stat.players != server.player_names():
+                raise RuntimeError(f"Full stat listed {stat.players}, expected {server.player_names()}")
+    return results
+
+
+async def bench_rcon(iterations: int, concurrency: int) -> dict:
+    async with FakeMinecraftServer() as server:
+        # Three full packets and a partial one
+        server.responses["help"] = "x" * (4096 * 3 + 1000)
+        async with RconClient(server.host, server.rcon_port, server.password) as client:
+            for _ in range(10):
+                await client.command("list")
+
+            latencies = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                await client.command("list")
+                latencies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            for _ in range(iterations // concurrency):
+                await asyncio.gather(*(client.command("list") for _ in range(concurrency)))
+            concurrent = time.perf_counter() - started
+
+            multi_packet = []
+            for _ in range(max(iterations // 10, 10)):
+                started = time.perf_counter()
+                response = await client.command("help")
+                multi_packet.append(time.perf_counter() - started)
+            expected = len(server.responses["help"])
+            if len(response) != expected:
+                raise RuntimeError(f"Multi-packet reply was {len(response)} bytes, expected {expected}")
+
+        # Connecting and authenticating, the cost the persistent client avoids on every command
+        connects = []
+        for _ in range(max(iterations // 10, 10)):
+            started = time.perf_counter()
+            async with RconClient(server.host, server.rcon_port, server.password) as client:
+                await client.command("list")
+            connects.append(time.perf_counter() - started)
+
+    return {
+        **summarize_latencies(latencies),
+        "concurrent_commands_per_second": iterations // concurrency * concurrency / concurrent,
+        "multi_packet_latency_p50_ms": percentile(multi_packet, 50) * 1000,
+        "connect_and_command_p50_ms": percentile(connects, 50) * 1000,
+    }
+
+
+async def bench_shutdown(runs: int, server_exit_delay: float, detector: str = "poll") -> dict:
+    stop_command, server_exit, stop_instances = [], [], []
+    for _ in range(runs):
+        servers_dir = tempfile.TemporaryDirectory()
+        log_path = os.path.join(servers_dir.name, "DefaultMinecraftProfile", "logs", "latest.log")
+        async with FakeMinecraftServer(players_online=1, log_path=log_path) as server, FakeAWS() as aws:
+            # Stands in for the Minecraft server process that the stop script waits on
+            placeholder = await asyncio.create_subprocess_exec(
+                sys.executable, "-c", "import time; time.sleep(600)")
+            env = {key: value for key, value in os.environ.items() if key != "S3_BUCKET"}
+            env.update(SHUTDOWN_POLICY)
+            env.update({
+                "SERVER_PID": str(placeholder.pid),
+                "SERVER_PORT": str(server.port),
+                "RCON_PORT": str(server.rcon_port),
+                "RCON_SECRET": server.password,
+                "INSTANCE_ID": aws.instance_id,
+                "IMDS_ENDPOINT": aws.url,
+                "EC2_ENDPOINT": aws.url,
+                "MINECRAFT_DIR": servers_dir.name,
+                "MINECRAFT_SERVERS_DIR": servers_dir.name,
+                "IDLE_DETECTOR": detector,
+                "PYTHONUNBUFFERED": "1",
+            })
+            script = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.join(SCRIPTS_DIR, "stop-server.py"), env=env,
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            try:
+                # The last player leaves once the stop script is up and has seen them online
+                while server.status_requests == 0:
+                    await asyncio.sleep(0.01)
+                left_at = time.monotonic()
+                server.players_online = 0
+
+                await asyncio.wait_for(server.stopped.wait(), 60)
+                stopped_at = time.monotonic()
+                await asyncio.sleep(server_exit_delay)
+                placeholder.kill()
+                await placeholder.wait()
+                exited_at = time.monotonic()
+
+                await asyncio.wait_for(aws.stopped_instances.wait(), 60)
+                await asyncio.wait_for(script.wait(), 30)
+            finally:
+                for process in (placeholder, script):
+                    if process.returncode is None:
+                        process.kill()
+                        await process.wait()
+                servers_dir.cleanup()
+            if script.returncode != 0:
+                raise RuntimeError(f"stop-server.py exited with {script.returncode}: "
+                                   f"{(await script.stderr.read()).decode()}")
+
+        stop_command.append(stopped_at - left_at)
+        server_exit.append(exited_at - left_at)
+        stop_instances.append(aws.stop_instances_at - left_at)
+
+    return {
+        "stop_command_after_seconds": statistics.median(stop_command),
+        "server_exit_after_seconds": statistics.median(server_exit),
+        "stop_instances_after_seconds": statistics.median(stop_instances),
+        "exit_to_stop_instances_seconds": statistics.median(
+            stop - exit for stop, exit in zip(stop_instances, server_exit)),
+    }
+
+
+async def bench_log_tail(stall_seconds: float) -> dict:
+    with tempfile.TemporaryDirectory() as logs_dir:
+        log_path = os.path.join(logs_dir, "latest.log")
+        with open(log_path, "w") as log:
+            async with LogTail(log_path) as tail:
+                if not tail.uses_inotify:
+                    return {}
+                await tail.read_lines(0)
+                loop = asyncio.get_running_loop()
+
+                def write_line():
+                    log.write("[12:00:00] [Server thread/INFO]: Saved the game\n")
+                    log.flush()
+
+                # One line before the stall and one during it, neither read until it is over
+                write_line()
+                loop.call_later(stall_seconds / 2, write_line)
+                started = time.process_time()
+                await asyncio.sleep(stall_seconds)
+                cpu_seconds = time.process_time() - started
+                lines = await tail.read_lines(1.0)
+    return {"cpu_share": cpu_seconds / stall_seconds, "lines_read": len(lines)}
+
+
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns:
+        list[str]: A description of every metric that regressed by more than the tolerance.
+    """
+    regressions = []
+    current = flatten(results)
+    for name, old in flatten(baseline).items():
+        new = current.get(name)
+        if new is None or old == 0:
+            continue
+        change = (new - old) / old
+        if name.endswith(HIGHER_IS_BETTER_SUFFIXES):
+            worse = -change
+        elif name.endswith(LOWER_IS_BETTER_SUFFIXES):
+            worse = change
+        else:
+            continue
+        if worse > tolerance:
+            regressions.append(f"{name}: {old:.3f} -> {new:.3f} ({change:+.0%})")
+    return regressions
+
+
+async def run(args) -> dict:
+    results = {}
+    if "ping" in args.only:
+        results["ping"] = await bench_ping(args.iterations, args.concurrency)
+    if "query" in args.only:
+        results["query"] = await bench_query(args.iterations)
+    if "rcon" in args.only:
+        results["rcon"] = await bench_rcon(args.iterations, args.concurrency)
+    if "shutdown" in args.only:
+        results["shutdown"] = await bench_shutdown(args.shutdown_runs, args.server_exit_delay)
+    if "shutdown_log" in args.only:
+        results["shutdown_log"] = await bench_shutdown(args.shutdown_runs, args.server_exit_delay, "log")
+    if "log_tail" in args.only:
+        results["log_tail"] = await bench_log_tail(LOG_TAIL_STALL_SECONDS)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", default="ping,query,rcon,shutdown,shutdown_log,log_tail", type=lambda value: set(value.split(",")))
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--shutdown-runs", type=int, default=3)
+    parser.add_argument("--server-exit-delay", type=float, default=0.5,
+                        help="Seconds the fake server process takes to exit after the stop command.")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout.")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Fraction a metric may get worse by before it counts as a regression.")
+    args = parser.parse_args()
+
+    report = {
+        "benchmark": "stop_server",
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "shutdown_runs": args.shutdown_runs,
+            "server_exit_delay": args.server_exit_delay,
+            "shutdown_policy": SHUTDOWN_POLICY,
+        },
+        "results": asyncio.run(run(args)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    regressions = []
+    log_tail = report["results"].get("log_tail", {})
+    if log_tail.get("cpu_share", 0) > LOG_TAIL_MAX_CPU_SHARE:
+        regressions.append(f"log_tail.cpu_share: {log_tail['cpu_share']:.2f} while waiting for nothing")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions += compare(report["results"], json.load(f)["results"], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
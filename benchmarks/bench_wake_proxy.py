@@ -0,0 +1,301 @@
+"""
+Wake Proxy Benchmark
+Measures what putting ./src/ec2/scripts/wake_proxy.py in front of a server costs, next to connecting to the
+server directly. The proxy runs in its own process, as it does on the instance, relaying with splice and
+with the buffered copy it falls back to.
+
+    ping        Latency of a status ping on a new connection, direct and through the proxy, against the
+                fake Minecraft server in ./fake_minecraft_server.py.
+    starting    Latency of the "starting" status the proxy answers with while nothing listens behind it.
+    throughput  MiB per second echoed through a single connection, client to server and back.
+    backpressure
+                CPU the proxy uses while a server sends to a player that stops reading, which should be
+                none once the socket buffers are full.
+
+Usage:
+    python benchmarks/bench_wake_proxy.py [--only ping,starting,throughput,backpressure] [--iterations N]
+        [--mib N] [--stall-seconds N] [--output FILE]
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(BENCHMARKS_DIR, "..", "src", "ec2", "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+from fake_minecraft_server import FakeMinecraftServer  # noqa: E402
+from minecraft_protocol import MakeHandShakePacket, query_status  # noqa: E402
+import wake_proxy  # noqa: E402
+
+RELAY_MODES = {"splice": "1", "copy": "0"}
+ECHO_CHUNK = 1024 * 1024
+
+
+def percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def summarize_latencies(latencies: list[float]) -> dict:
+    return {
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "latency_mean_ms": statistics.mean(latencies) * 1000,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ProxyProcess:
+    """
+    Runs a wake proxy in a subprocess, started with this script's --serve-proxy option.
+    """
+    def __init__(self, backend_port: int, mode: str):
+        self.backend_port = backend_port
+        self.mode = mode
+        self.port = free_port()
+        self.process: subprocess.Popen | None = None
+
+    def __enter__(self) -> "ProxyProcess":
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve-proxy", f"{self.port}:{self.backend_port}"],
+            env={**os.environ, "WAKE_PROXY_SPLICE": RELAY_MODES[self.mode]}, stdout=subprocess.PIPE, text=True)
+        # Printed once the proxy listens
+        self.process.stdout.readline()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait()
+
+    def cpu_seconds(self) -> float:
+        """
+        Returns:
+            float: The user and system CPU time the proxy process used so far.
+        """
+        with open(f"/proc/{self.process.pid}/stat") as f:
+            # The fields after the command name, which may contain spaces
+            fields = f.read().rpartition(")")[2].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def time_pings(port: int, iterations: int) -> list[float]:
+    for _ in range(10):
+        await query_status("127.0.0.1", port)
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await query_status("127.0.0.1", port)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def bench_ping(iterations: int) -> dict:
+    results = {}
+    async with FakeMinecraftServer(sample_size=12) as server:
+        results["direct"] = summarize_latencies(await time_pings(server.port, iterations))
+        for mode in RELAY_MODES:
+            with ProxyProcess(server.port, mode) as proxy:
+                results[f"proxy_{mode}"] = summarize_latencies(await time_pings(proxy.port, iterations))
+    direct = results["direct"]["latency_p50_ms"]
+    for mode in RELAY_MODES:
+        results[f"proxy_{mode}"]["added_latency_p50_ms"] = results[f"proxy_{mode}"]["latency_p50_ms"] - direct
+    return results
+
+
+async def bench_starting(iterations: int) -> dict:
+    # Nothing listens on the backend port, so every ping is answered by the proxy itself
+    with ProxyProcess(free_port(), "splice") as proxy:
+        latencies = await time_pings(proxy.port, iterations)
+    return summarize_latencies(latencies)
+
+
+class EchoServer:
+    """
+    Echoes every connection back on its own thread with blocking sockets, so the proxy and not an event
+    loop in this process is what limits throughput.
+    """
+    def __init__(self):
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._echo, args=(connection,), daemon=True).start()
+
+    @staticmethod
+    def _echo(connection: socket.socket):
+        buffer = bytearray(ECHO_CHUNK)
+        with connection:
+            while size := connection.recv_into(buffer):
+                connection.sendall(memoryview(buffer)[:size])
+
+    def close(self):
+        self.listener.close()
+
+
+def time_echo(port: int, size: int) -> float:
+    chunk = os.urandom(ECHO_CHUNK)
+    received = 0
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        def receive():
+            nonlocal received
+            buffer = bytearray(ECHO_CHUNK)
+            while count := sock.recv_into(buffer):
+                received += count
+
+        receiver = threading.Thread(target=receive)
+        started = time.perf_counter()
+        receiver.start()
+        for _ in range(size // ECHO_CHUNK):
+            sock.sendall(chunk)
+        sock.shutdown(socket.SHUT_WR)
+        receiver.join()
+        elapsed = time.perf_counter() - started
+    if received != size // ECHO_CHUNK * ECHO_CHUNK:
+        raise RuntimeError(f"Echoed {received} of {size} bytes")
+    return elapsed
+
+
+async def bench_throughput(mib: int) -> dict:
+    size = mib * 1024 * 1024
+    server = EchoServer()
+    results = {}
+    try:
+        results["direct"] = {"mib_per_second": mib / await asyncio.to_thread(time_echo, server.port, size)}
+        for mode in RELAY_MODES:
+            with ProxyProcess(server.port, mode) as proxy:
+                elapsed = await asyncio.to_thread(time_echo, proxy.port, size)
+                results[f"proxy_{mode}"] = {"mib_per_second": mib / elapsed}
+    finally:
+        server.close()
+    return results
+
+
+class FloodServer:
+    """
+    Sends to every connection without ever reading, until the connection is closed.
+    """
+    def __init__(self):
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._flood, args=(connection,), daemon=True).start()
+
+    @staticmethod
+    def _flood(connection: socket.socket):
+        chunk = bytes(ECHO_CHUNK)
+        with connection:
+            try:
+                while True:
+                    connection.sendall(chunk)
+            except OSError:
+                pass
+
+    def close(self):
+        self.listener.close()
+
+
+async def bench_backpressure(stall_seconds: float) -> dict:
+    server = FloodServer()
+    results = {}
+    try:
+        for mode in RELAY_MODES:
+            with ProxyProcess(server.port, mode) as proxy:
+                with socket.create_connection(("127.0.0.1", proxy.port)) as client:
+                    client.sendall(MakeHandShakePacket("127.0.0.1", proxy.port, 2))
+                    # Lets the relay fill the socket buffers, the client never reads
+                    await asyncio.sleep(1.0)
+                    before = proxy.cpu_seconds()
+                    await asyncio.sleep(stall_seconds)
+                    results[f"proxy_{mode}"] = {"cpu_share": (proxy.cpu_seconds() - before) / stall_seconds}
+    finally:
+        server.close()
+    return results
+
+
+async def serve_proxy(ports: str):
+    public_port, backend_port = (int(port) for port in ports.split(":"))
+    proxy = wake_proxy.WakeProxy(public_port, backend_port, listen_host="127.0.0.1")
+    await proxy.start()
+    print("ready", flush=True)
+    await proxy.serve()
+
+
+async def run(args) -> dict:
+    results = {}
+    if "ping" in args.only:
+        results["ping"] = await bench_ping(args.iterations)
+    if "starting" in args.only:
+        results["starting"] = await bench_starting(args.iterations)
+    if "throughput" in args.only:
+        results["throughput"] = await bench_throughput(args.mib)
+    if "backpressure" in args.only:
+        results["backpressure"] = await bench_backpressure(args.stall_seconds)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", default="ping,starting,throughput,backpressure", type=lambda value: set(value.split(",")))
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--mib", type=int, default=256, help="MiB echoed through each connection.")
+    parser.add_argument("--stall-seconds", type=float, default=3.0,
+                        help="Seconds the proxy's CPU use is measured for while the player does not read.")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout.")
+    parser.add_argument("--serve-proxy", metavar="PUBLIC:BACKEND", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_proxy:
+        try:
+            asyncio.run(serve_proxy(args.serve_proxy))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    report = {
+        "benchmark": "wake_proxy",
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"iterations": args.iterations, "mib": args.mib, "stall_seconds": args.stall_seconds, "splice": hasattr(os, "splice")},
+        "results": asyncio.run(run(args)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+Fake AWS
+Asyncio stand-in for the AWS endpoints the scripts in ./src/ec2/scripts call: the instance metadata
+service (IMDSv2), the EC2 query API and S3 with path style addressing. Point IMDS_ENDPOINT, EC2_ENDPOINT
+and S3_ENDPOINT at its url to use it.
+
+Requests are not signature checked, they are only recorded, along with the time they arrived.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+import json
+import time
+import urllib.parse
+from xml.sax.saxutils import escape
+
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+# Responses are written in chunks of this size, so a bandwidth limit can be applied between them
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class FakeRequest:
+    method: str
+    path: str
+    headers: dict[str, str]
+    body: bytes
+    received: float
+    query: dict[str, str] = field(default_factory=dict)
+
+
+class FakeAWS:
+    """
+    Fake IMDS, EC2 and S3 endpoint on a single port.
+
+    Attributes:
+        requests (list[FakeRequest]): Every request received, in order.
+        stopped_instances (asyncio.Event): Set once a StopInstances call has been received.
+        buckets (dict[str, dict[str, bytes]]): The objects in each bucket by key. Requests for other
+            buckets are answered with NoSuchBucket.
+        latency (float): Seconds to wait before answering every request.
+        bandwidth (float | None): Bytes per second to send response bodies at, unlimited if None.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, region: str = "us-east-1",
+                 instance_id: str = "i-0123456789abcdef0", role_name: str = "FakeRole"):
+        self.host = host
+        self.port = port
+        self.region = region
+        self.instance_id = instance_id
+        self.role_name = role_name
+        self.requests: list[FakeRequest] = []
+        self.stopped_instances = asyncio.Event()
+        self.stop_instances_at: float | None = None
+        self.buckets: dict[str, dict[str, bytes]] = {}
+        self.latency = 0.0
+        self.bandwidth: float | None = None
+        self._server: asyncio.Server | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "FakeAWS":
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self) -> "FakeAWS":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def route(self, request: FakeRequest) -> tuple[int, bytes]:
+        """
+        Returns:
+            tuple[int, bytes]: The status and body of the response to a request.
+        """
+        metadata = {
+            "/latest/meta-data/instance-id": self.instance_id,
+            "/latest/meta-data/placement/region": self.region,
+            "/latest/meta-data/iam/security-credentials/": self.role_name,
+            f"/latest/meta-data/iam/security-credentials/{self.role_name}": json.dumps({
+                "AccessKeyId": "AKIAFAKE", "SecretAccessKey": "fake", "Token": "fake"}),
+        }
+        if request.method == "PUT" and request.path == "/latest/api/token":
+            return 200, b"fake-token"
+        if request.method == "GET" and request.path in metadata:
+            return 200, metadata[request.path].encode("utf-8")
+        bucket, _, key = request.path.lstrip("/").partition("/")
+        if bucket in self.buckets:
+            return self.route_s3(request, self.buckets[bucket], urllib.parse.unquote(key))
+        if request.method == "POST" and request.path == "/":
+            params = urllib.parse.parse_qs(request.body.decode("utf-8"))
+            if params.get("Action") == ["StopInstances"]:
+                self.stop_instances_at = request.received
+                self.stopped_instances.set()
+                return 200, b"<StopInstancesResponse><return>true</return></StopInstancesResponse>"
+        return 404, b"<Error><Code>NotFound</Code></Error>"
+
+    def route_s3(self, request: FakeRequest, objects: dict[str, bytes], key: str) -> tuple[int, bytes]:
+        if request.method == "GET" and not key and request.query.get("list-type") == "2":
+            prefix = request.query.get("prefix", "")
+            contents = "".join(f"<Contents><Key>{escape(name)}</Key><Size>{len(data)}</Size></Contents>"
+                               for name, data in sorted(objects.items()) if name.startswith(prefix))
+            return 200, f"<ListBucketResult>{contents}</ListBucketResult>".encode("utf-8")
+        if request.method == "GET" and key in objects:
+            return 200, objects[key]
+        if request.method == "PUT" and key:
+            objects[key] = request.body
+            return 200, b""
+        if request.method == "DELETE" and key:
+            objects.pop(key, None)
+            return 204, b""
+        return 404, b"<Error><Code>NoSuchKey</Code></Error>"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            method, target, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                name, separator, value = line.partition(":")
+                if separator:
+                    headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", "0"))
+            if length > MAX_REQUEST_SIZE:
+                return
+            body = await reader.readexactly(length)
+            url = urllib.parse.urlsplit(target)
+            request = FakeRequest(method, url.path, headers, body, time.monotonic(),
+                                  dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True)))
+            self.requests.append(request)
+            status, response = self.route(request)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            writer.write(f"HTTP/1.1 {status} Fake\r\nContent-Length: {len(response)}\r\nConnection: close\r\n\r\n"
+                         .encode("latin-1"))
+            for offset in range(0, len(response), RESPONSE_CHUNK_SIZE):
+                writer.write(response[offset:offset + RESPONSE_CHUNK_SIZE])
+                await writer.drain()
+                if self.bandwidth:
+                    await asyncio.sleep(RESPONSE_CHUNK_SIZE / self.bandwidth)
+            await writer.drain()
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
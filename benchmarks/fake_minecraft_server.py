@@ -0,0 +1,358 @@
+"""
+Fake Minecraft Server
+Asyncio stand-in for a Minecraft server that answers Server List Ping, Source RCON and optionally the UDP
+Query protocol, so the scripts in ./src/ec2/scripts can be exercised without a real server or an EC2
+instance.
+
+The player count, the size of the status response and the latency of every reply are configurable and can
+be changed while the server runs. RCON supports authentication and splits long replies over several
+packets like a real server. Like a vanilla server, it reads each RCON request with a single read and drops
+the connection if that read does not hold exactly one packet. The "stop" command shuts the fake down and sets the stopped event.
+Given a log path, the fake writes startup, join and leave lines to it like a vanilla server's
+logs/latest.log, whenever the player count changes.
+
+Usage:
+    python benchmarks/fake_minecraft_server.py [--port N] [--rcon-port N] [--query-port N] [--password S]
+        [--players N] [--sample-size N] [--favicon-size BYTES] [--latency SECONDS] [--log FILE]
+
+Run standalone it serves until it receives "stop" over RCON. The extra RCON command "players <n>"
+changes the player count.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import struct
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "ec2", "scripts"))
+
+from minecraft_protocol import MakePacket, encode_string, read_packet  # noqa: E402
+from query_client import (  # noqa: E402
+    FULL_STAT_HEADER, FULL_STAT_PLAYERS_HEADER, MAGIC, TYPE_HANDSHAKE, TYPE_STAT)
+from rcon_client import (  # noqa: E402
+    MAX_RCON_REQUEST_SIZE, SERVERDATA_AUTH, SERVERDATA_AUTH_RESPONSE, SERVERDATA_EXECCOMMAND,
+    SERVERDATA_RESPONSE_VALUE, EncodeRconPacket)
+
+# Minecraft splits RCON replies into packets of at most this many bytes of payload
+MAX_RCON_REPLY_PAYLOAD = 4096
+STATUS_STATE = 1
+
+
+class FakeMinecraftServer:
+    """
+    Fake server answering Server List Ping on one port and RCON on another.
+
+    Attributes:
+        players_online (int): Players reported by the status response, can be changed at any time. Players
+            are named Player0, Player1, ... and join and leave from the end of the list.
+        latency (float): Seconds every reply is delayed by.
+        status_requests (int): The number of status requests answered.
+        query_requests (int): The number of Query stat requests answered.
+        commands (list[str]): Every RCON command received, in order.
+        stopped (asyncio.Event): Set once a "stop" command has been handled.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, rcon_port: int = 0, password: str = "123456",
+                 query_port: int | None = None, players_online: int = 0, players_max: int = 20,
+                 sample_size: int = 0, favicon_size: int = 0, latency: float = 0.0, version: str = "1.21.4",
+                 protocol: int = 769, log_path: str | None = None):
+        self.host = host
+        self.port = port
+        self.rcon_port = rcon_port
+        # None leaves Query turned off, like enable-query=false
+        self.query_port = query_port
+        self.password = password
+        self.log_path = log_path
+        self._players_online = players_online
+        self.players_max = players_max
+        self.sample_size = sample_size
+        self.favicon_size = favicon_size
+        self.latency = latency
+        self.version = version
+        self.protocol = protocol
+        self.status_requests = 0
+        self.query_requests = 0
+        self.query_token = 9513307
+        self.commands: list[str] = []
+        self.stopped = asyncio.Event()
+        # Replies for commands that have nothing to do with the fake itself, e.g. "help"
+        self.responses: dict[str, str] = {}
+        self._servers: list[asyncio.Server] = []
+        self._connections: dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._query_transport: asyncio.DatagramTransport | None = None
+
+    async def start(self) -> "FakeMinecraftServer":
+        """
+        Starts listening. Ports given as 0 are assigned by the OS and written back to port, rcon_port and
+        query_port.
+        """
+        status_server = await asyncio.start_server(self._handle_status, self.host, self.port)
+        rcon_server = await asyncio.start_server(self._handle_rcon, self.host, self.rcon_port)
+        self._servers = [status_server, rcon_server]
+        self.port = status_server.sockets[0].getsockname()[1]
+        if self.log_path is not None:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(self.log_path, "w"):
+                pass
+            self.log(f"Starting minecraft server version {self.version}")
+            for name in self.player_names():
+                self.log(f"{name} joined the game")
+            self.log('Done (1.000s)! For help, type "help"')
+        self.rcon_port = rcon_server.sockets[0].getsockname()[1]
+        if self.query_port is not None:
+            loop = asyncio.get_running_loop()
+            self._query_transport, _ = await loop.create_datagram_endpoint(
+                lambda: _FakeQueryProtocol(self), local_addr=(self.host, self.query_port))
+            self.query_port = self._query_transport.get_extra_info("sockname")[1]
+        return self
+
+    async def close(self):
+        if self._query_transport is not None:
+            self._query_transport.close()
+            self._query_transport = None
+        for server in self._servers:
+            server.close()
+        for writer in list(self._connections):
+            writer.close()
+        # Let the handlers see their connections close, so none are left pending when the loop shuts down
+        await asyncio.gather(*self._connections.values(), return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+
+    async def __aenter__(self) -> "FakeMinecraftServer":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def status_json(self) -> str:
+        """
+        Returns:
+            str: The status response for the current settings.
+        """
+        status = {
+            "version": {"name": self.version, "protocol": self.protocol},
+            "players": {"max": self.players_max, "online": self.players_online},
+            "description": {"text": "A fake Minecraft server"},
+        }
+        if self.sample_size:
+            status["players"]["sample"] = [
+                {"name": f"Player{index}", "id": str(uuid.UUID(int=index))} for index in range(self.sample_size)]
+        if self.favicon_size:
+            # Random bytes do not compress, like a real PNG
+            status["favicon"] = "data:image/png;base64," + base64.b64encode(os.urandom(self.favicon_size)).decode()
+        return json.dumps(status)
+
+    @property
+    def players_online(self) -> int:
+        return self._players_online
+
+    @players_online.setter
+    def players_online(self, players: int):
+        for index in range(self._players_online, players):
+            self.log(f"Player{index} joined the game")
+        for index in reversed(range(players, self._players_online)):
+            self.log(f"Player{index} lost connection: Disconnected")
+            self.log(f"Player{index} left the game")
+        self._players_online = players
+
+    def log(self, message: str):
+        """
+        Appends a server thread line to the log, if the fake has one.
+        """
+        if self.log_path is None:
+            return
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(f"[{time.strftime('%H:%M:%S')}] [Server thread/INFO]: {message}\n")
+
+    def player_names(self) -> list[str]:
+        return [f"Player{index}" for index in range(self.players_online)]
+
+    def query_reply(self, data: bytes) -> bytes | None:
+        """
+        Answers a Query request like a vanilla server, requests with a bad token get no reply.
+
+        Returns:
+            bytes | None: The response datagram, or None if the request is ignored.
+        """
+        if len(data) < 7 or not data.startswith(MAGIC):
+            return None
+        packet_type, session = data[2], data[3:7]
+        if packet_type == TYPE_HANDSHAKE:
+            return bytes([TYPE_HANDSHAKE]) + session + str(self.query_token).encode() + b"\x00"
+        if packet_type != TYPE_STAT or data[7:11] != struct.pack(">i", self.query_token):
+            return None
+
+        self.query_requests += 1
+        motd = b"A fake Minecraft server"
+        if len(data) < 15:
+            return (bytes([TYPE_STAT]) + session + motd + b"\x00SMP\x00world\x00"
+                    + f"{self.players_online}\x00{self.players_max}\x00".encode()
+                    + struct.pack("<H", self.port) + self.host.encode() + b"\x00")
+        info = {
+            "hostname": motd.decode(), "gametype": "SMP", "game_id": "MINECRAFT", "version": self.version,
+            "plugins": "", "map": "world", "numplayers": str(self.players_online),
+            "maxplayers": str(self.players_max), "hostport": str(self.port), "hostip": self.host,
+        }
+        return (bytes([TYPE_STAT]) + session + FULL_STAT_HEADER
+                + b"".join(f"{key}\x00{value}\x00".encode() for key, value in info.items())
+                + b"\x00" + FULL_STAT_PLAYERS_HEADER
+                + b"".join(f"{name}\x00".encode() for name in self.player_names()) + b"\x00")
+
+    async def _reply(self, writer: asyncio.StreamWriter, data: bytes):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write(data)
+        await writer.drain()
+
+    async def _handle_status(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            packet_id, handshake = await read_packet(reader)
+            handshake.read_varint()
+            handshake.read_string()
+            handshake.read_bytes(2)
+            if packet_id != 0 or handshake.read_varint() != STATUS_STATE:
+                return
+            while True:
+                packet_id, packet = await read_packet(reader)
+                if packet_id == 0:
+                    self.status_requests += 1
+                    await self._reply(writer, MakePacket(0, encode_string(self.status_json())))
+                elif packet_id == 1:
+                    # Ping, echo the payload back as the pong
+                    await self._reply(writer, MakePacket(1, bytes(packet.read_bytes(8))))
+                    return
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _handle_rcon(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[writer] = asyncio.current_task()
+        authenticated = False
+        try:
+            while True:
+                request_id, packet_type, payload = await self._read_rcon_request(reader)
+                if packet_type == SERVERDATA_AUTH:
+                    authenticated = payload == self.password
+                    await self._reply(writer, EncodeRconPacket(
+                        request_id if authenticated else -1, SERVERDATA_AUTH_RESPONSE, ""))
+                elif not authenticated:
+                    return
+                elif packet_type == SERVERDATA_EXECCOMMAND:
+                    await self._reply(writer, self._encode_reply(request_id, self.run_command(payload)))
+                    if self.stopped.is_set():
+                        return
+                else:
+                    # Like Minecraft, any other packet type gets a single packet naming the unknown type
+                    await self._reply(writer, EncodeRconPacket(
+                        request_id, SERVERDATA_RESPONSE_VALUE, f"Unknown request {packet_type:x}"))
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    @staticmethod
+    async def _read_rcon_request(reader: asyncio.StreamReader) -> tuple[int, int, str]:
+        # Vanilla reads a request into a single MAX_RCON_REQUEST_SIZE buffer with one read, and closes the
+        # connection unless the length prefix accounts for exactly the bytes read
+        data = await reader.read(MAX_RCON_REQUEST_SIZE)
+        if len(data) < 14:
+            raise asyncio.IncompleteReadError(data, 14)
+        (size,) = struct.unpack_from("<i", data)
+        if size != len(data) - 4:
+            raise ValueError(f"RCON read held {len(data)} bytes, the packet declared {size + 4}")
+        request_id, packet_type = struct.unpack_from("<ii", data, 4)
+        payload = data[12:data.find(b"\x00", 12)].decode("utf-8", errors="replace")
+        return request_id, packet_type, payload
+
+    def _encode_reply(self, request_id: int, reply: str) -> bytes:
+        data = reply.encode("utf-8")
+        chunks = [data[offset:offset + MAX_RCON_REPLY_PAYLOAD]
+                  for offset in range(0, len(data), MAX_RCON_REPLY_PAYLOAD)] or [b""]
+        return b"".join(
+            struct.pack("<iii", len(chunk) + 10, request_id, SERVERDATA_RESPONSE_VALUE) + chunk + b"\x00\x00"
+            for chunk in chunks)
+
+    def run_command(self, command: str) -> str:
+        """
+        Runs an RCON command against the fake.
+
+        Returns:
+            str: The reply a vanilla server would give.
+        """
+        self.commands.append(command)
+        name, _, argument = command.partition(" ")
+        if command in self.responses:
+            return self.responses[command]
+        if name == "list":
+            return f"There are {self.players_online} of a max of {self.players_max} players online: "
+        if name == "players" and argument.isdigit():
+            self.players_online = int(argument)
+            return f"Set the player count to {self.players_online}"
+        if name == "save-off":
+            return "Automatic saving is now disabled"
+        if name == "save-on":
+            return "Automatic saving is now enabled"
+        if name == "save-all":
+            return "Saving the game (this may take a moment!)Saved the game"
+        if name == "stop":
+            self.log("Stopping server")
+            self.stopped.set()
+            return "Stopping the server"
+        return f"Unknown or incomplete command, see below for error{command}<--[HERE]"
+
+
+class _FakeQueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: FakeMinecraftServer):
+        self.server = server
+        self.transport: asyncio.DatagramTransport | None = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address):
+        reply = self.server.query_reply(data)
+        if reply is None:
+            return
+        if self.server.latency:
+            asyncio.get_running_loop().call_later(self.server.latency, self.transport.sendto, reply, address)
+        else:
+            self.transport.sendto(reply, address)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=25565)
+    parser.add_argument("--rcon-port", type=int, default=25575)
+    parser.add_argument("--query-port", type=int, help="Answer Query requests on this UDP port.")
+    parser.add_argument("--password", default="123456")
+    parser.add_argument("--players", type=int, default=0)
+    parser.add_argument("--sample-size", type=int, default=0, help="Players listed in the status sample.")
+    parser.add_argument("--favicon-size", type=int, default=0, help="Bytes of favicon in the status response.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every reply is delayed by.")
+    parser.add_argument("--log", help="Write server log lines to this file, like logs/latest.log.")
+    args = parser.parse_args()
+
+    server = FakeMinecraftServer(
+        args.host, args.port, args.rcon_port, args.password, args.query_port, players_online=args.players,
+        sample_size=args.sample_size, favicon_size=args.favicon_size, latency=args.latency,
+        log_path=args.log)
+    async with server:
+        print(f"Serving status on {server.host}:{server.port} and RCON on {server.host}:{server.rcon_port}"
+              + (f" and Query on {server.host}:{server.query_port}" if server.query_port is not None else ""))
+        await server.stopped.wait()
+    print("Stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,19 +1,48 @@
+import argparse
 from datetime import datetime
+from fnmatch import fnmatch
+from functools import partial
+import hashlib
+import json
 import os
 import shutil
 import subprocess
 
+from pipeline import Pipeline, StageLogger
+from profile_archive import (BuildProfileArchive, FingerprintProfileSources, ListProfileFiles,
+                             LoadProfileArchiveManifest)
+from region_pruner import AnalyzeWorld
 from utils import Check_Command_Availability, Prompt_AWS_Login
 
 BUILD_DIR = "./build"
 SERVER_DIR = "./server"
+# NOTE: terraform.tf reads the profile archive manifest from this directory
+PROFILE_BUILD_DIR = os.path.join(BUILD_DIR, "minecraft_server_profiles")
+PROFILE_NAME = "DefaultMinecraftProfile"
+# An npm workspace with a directory for each lambda function, their dependencies are resolved together
 LAMBDA_DIR = "./src/lambda"
+# NOTE: terraform.tf packages the lambda layer from this directory
+LAMBDA_LAYER_DIR = os.path.join(BUILD_DIR, "lambda_layer")
 TERRAFORM_DIR = "./terraform"
 TERRAFORM_PLAN_NAME = "terraform.tfplan"
+# Fingerprint of the inputs the saved plan was built from, stored alongside the plan
+TERRAFORM_FINGERPRINT_FILE = os.path.join(TERRAFORM_DIR, f"{TERRAFORM_PLAN_NAME}.fingerprint")
+# Files in TERRAFORM_DIR that are inputs to the plan (state and the .terraform dir are excluded)
+TERRAFORM_INPUT_PATTERNS = ["*.tf", ".tfvars", "*.sh", ".terraform.lock.hcl"]
+EC2_SOURCE_DIR = "./src/ec2"
+LAMBDA_BUILD_CACHE_FILE = os.path.join(BUILD_DIR, "lambda_build_cache.json")
+# Files that determine the output of a lambda build, changes to any of these invalidate the cache
+LAMBDA_SOURCE_FILES = ["index.ts", "package.json", "tsconfig.json"]
+# Files in LAMBDA_DIR shared by every function, the build tools and dependency versions are resolved in them
+LAMBDA_WORKSPACE_FILES = ["package.json", "package-lock.json"]
+# Cache entry of the shared dependencies and layer, the functions are cached by their directory name
+LAMBDA_DEPENDENCIES_CACHE_KEY = "@dependencies"
 # NOTE: Ensure that the BACKUP_DIR is changed in the ./destroy.py file as well
 BACKUP_DIR = "./backup"
+# npm is a .cmd script on Windows so it must be started through the shell there
+NPM_SHELL = os.name == "nt"
 
-def main():
+def main(force: bool = False, prune_world: bool = False):
     print("Running preliminary checks and setup...")
 
     # Ensure build and server directories exist
@@ -76,50 +105,77 @@ def main():
     if not Prompt_AWS_Login():
         return
 
-    # Build all of the lambda functions
-    print("Building lambda functions...")
-    for lambda_function_path in os.listdir(LAMBDA_DIR):
+    # Build the lambda functions and the terraform plan.
+    # Stages that do not depend on each other run in parallel.
+    print("Building lambda functions and terraform plan...")
+    build_cache = LoadLambdaBuildCache()
+    pipeline = Pipeline()
+    # Dependencies are installed once for every function, and the ones they share at runtime become a layer
+    lambda_stages = {
+        LAMBDA_DEPENDENCIES_CACHE_KEY: pipeline.add(
+            "lambda-dependencies",
+            partial(BuildCachedLambdaDependencies, build_cache.get(LAMBDA_DEPENDENCIES_CACHE_KEY))).name,
+    }
+    for lambda_function_path in ListLambdaFunctions():
         full_path = os.path.abspath(os.path.join(LAMBDA_DIR, lambda_function_path))
-        print(f"Building lambda function at {full_path}...")
-        try:
-            BuildLambdaFunction(full_path)
-        except subprocess.CalledProcessError as e:
-            print(f"Error building lambda function at {full_path}: {e}")
-            print("Aborting deployment process.")
-            return 
+        stage = pipeline.add(f"lambda:{lambda_function_path}",
+                             partial(BuildCachedLambdaFunction, full_path, build_cache.get(lambda_function_path)),
+                             depends_on=["lambda-dependencies"])
+        lambda_stages[lambda_function_path] = stage.name
+    pipeline.add("world-regions", partial(AnalyzeServerWorlds, prune_world))
+    pipeline.add("profile-archive", BuildServerProfileArchive, depends_on=["world-regions"])
+    pipeline.add("terraform-init", RunTerraformInit)
+    pipeline.add("terraform-plan", partial(RunTerraformPlan, force),
+                 depends_on=[*lambda_stages.values(), "profile-archive", "terraform-init"])
+    pipeline_succeeded = pipeline.run()
 
-    print("All lambda functions built successfully.")
+    # Record every lambda that built, even if another stage failed
+    cache_hits = 0
+    cache_misses = 0
+    for lambda_function_path, stage_name in lambda_stages.items():
+        stage = pipeline.stages[stage_name]
+        if stage.error is not None or stage.result is None:
+            continue
+        cache_hit, source_hash = stage.result
+        if cache_hit:
+            cache_hits += 1
+        else:
+            cache_misses += 1
+        build_cache[lambda_function_path] = source_hash
+    SaveLambdaBuildCache(build_cache)
 
-    print("Building terraform plan...")
-
-    print("Initializing terraform...")
-    try:
-        subprocess.run(["terraform", "init"], cwd=TERRAFORM_DIR, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error initializing terraform: {e}")
-        print("Aborting deployment process.")
-        return
-    print("Planning terraform deployment...")
-    try:
-        subprocess.run(["terraform", "plan", "-var-file=.tfvars", f"-out={TERRAFORM_PLAN_NAME}"], 
-                       cwd=TERRAFORM_DIR, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error planning terraform deployment: {e}")
+    print(f"Lambda build cache: {cache_hits} hit(s), {cache_misses} miss(es).")
+    pipeline.PrintTimingReport()
+    if not pipeline_succeeded:
         print("Aborting deployment process.")
         return
-    print("Terraform plan built successfully.")
+    plan_status = pipeline.stages["terraform-plan"].result
+    if plan_status == PLAN_UP_TO_DATE:
+        print("No changes. Your infrastructure matches the last deployment.")
+        print("Re-run with --force to refresh the terraform state and plan again.")
+        do_deployment = "n"
+    elif plan_status == PLAN_REUSED:
+        print("Terraform inputs are unchanged, reusing the existing terraform plan.")
+        do_deployment = input("Do you want to deploy now? (y/n): ")
+    else:
+        print("Terraform plan built successfully.")
+        do_deployment = input("Do you want to deploy now? (y/n): ")
 
-    do_deployment = input("Do you want to deploy now? (y/n): ")
     if do_deployment.lower() == 'y' or do_deployment.lower() == 'yes':
         print("Deploying with terraform...")
         try:
            subprocess.run(["terraform", "apply", "-var-file=.tfvars", TERRAFORM_PLAN_NAME], cwd=TERRAFORM_DIR, check=True)
         except subprocess.CalledProcessError as e:
             print(f"Error during terraform deployment: {e}")
+            # The saved plan may be partially applied, force a fresh plan on the next run
+            if os.path.exists(TERRAFORM_FINGERPRINT_FILE):
+                os.remove(TERRAFORM_FINGERPRINT_FILE)
             print("Aborting deployment process.")
             return
+        # A saved plan can only be applied once, later runs with the same inputs have nothing to do
+        SavePlanFingerprint(LoadPlanFingerprint().get("fingerprint"), applied=True)
         print("Deployment complete.")
-    else:
+    elif plan_status != PLAN_UP_TO_DATE:
         print("Deployment canceled.")
 
     print("Do you wish to make a backup of your terraform files?")
@@ -139,18 +195,341 @@ def main():
         print("Backup skipped.")
 
 
-def BuildLambdaFunction(path: str):
+def ListLambdaFunctions() -> list[str]:
+    """
+    Returns:
+        list[str]: The directory name of every lambda function in the LAMBDA_DIR workspace.
+    """
+    return sorted(name for name in os.listdir(LAMBDA_DIR)
+                  if os.path.isfile(os.path.join(LAMBDA_DIR, name, "index.ts")))
+
+
+def HashFiles(digest, path: str, file_names: list[str]):
+    """
+    Feeds the given files in a directory into a digest, missing files are hashed as empty.
+    """
+    for file_name in file_names:
+        file_path = os.path.join(path, file_name)
+        # Include the file name so that a file moving between slots changes the hash
+        digest.update(file_name.encode("utf-8") + b"\x00")
+        if os.path.exists(file_path):
+            with open(file_path, "rb") as f:
+                digest.update(f.read())
+        digest.update(b"\x00")
+
+
+def HashLambdaSources(path: str) -> str:
+    """
+    Hashes the files that determine the output of a lambda build, including the shared workspace files.
+
+    Args:
+        path (str): The path to the lambda function directory.
+
+    Returns:
+        str: The hex digest of the lambda sources.
+    """
+    digest = hashlib.sha256()
+    HashFiles(digest, path, LAMBDA_SOURCE_FILES)
+    HashFiles(digest, LAMBDA_DIR, LAMBDA_WORKSPACE_FILES)
+    return digest.hexdigest()
+
+
+def HashLambdaDependencies() -> str:
+    """
+    Hashes the files that determine which dependencies the workspace installs.
+
+    Returns:
+        str: The hex digest of the workspace and function package files.
+    """
+    digest = hashlib.sha256()
+    HashFiles(digest, LAMBDA_DIR, LAMBDA_WORKSPACE_FILES)
+    for lambda_function_path in ListLambdaFunctions():
+        HashFiles(digest, os.path.join(LAMBDA_DIR, lambda_function_path), ["package.json"])
+    return digest.hexdigest()
+
+
+def LoadLambdaBuildCache() -> dict[str, str]:
+    """
+    Loads the lambda build cache, mapping each function directory to the hash of its last build.
+    """
+    try:
+        with open(LAMBDA_BUILD_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def SaveLambdaBuildCache(cache: dict[str, str]):
+    with open(LAMBDA_BUILD_CACHE_FILE, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+
+def BuildCachedLambdaFunction(path: str, cached_hash: str | None, log: StageLogger) -> tuple[bool, str]:
+    """
+    Builds a lambda function unless its sources match the hash of its last build.
+
+    Args:
+        path (str): The path to the lambda function directory.
+        cached_hash (str | None): The source hash recorded for the last successful build.
+        log (StageLogger): The logger for the build stage.
+
+    Returns:
+        tuple[bool, str]: Whether the build was skipped as a cache hit, and the current source hash.
+    """
+    source_hash = HashLambdaSources(path)
+    if cached_hash == source_hash and os.path.exists(os.path.join(path, "dist", "index.js")):
+        log.print(f"Lambda function at {path} is unchanged, skipping build (cache hit).")
+        return True, source_hash
+
+    log.print(f"Building lambda function at {path} (cache miss)...")
+    try:
+        BuildLambdaFunction(path, log)
+    except subprocess.CalledProcessError as e:
+        log.print(f"Error building lambda function at {path}: {e}")
+        raise
+    return False, source_hash
+
+
+def BuildLambdaFunction(path: str, log: StageLogger):
     # Cleanup the old build dir
     if os.path.exists(os.path.join(path, "dist")):
         shutil.rmtree(os.path.join(path, "dist"))
 
-    # Runs npm commands with shell=True for Windows compatibility
-    print("Installing npm dependencies...")
-    subprocess.run(["npm", "install"], check=True, cwd=path, shell=True)
+    # The dependencies are installed in the workspace by the lambda-dependencies stage, and left out of the
+    # bundle, so only the handler itself is built here
+    log.print("Building the lambda function...")
+    log.run(["npm", "run", "build"], cwd=path, shell=NPM_SHELL)
+
+
+def BuildCachedLambdaDependencies(cached_hash: str | None, log: StageLogger) -> tuple[bool, str]:
+    """
+    Installs the workspace dependencies and builds the lambda layer, unless the package files match the
+    hash of the last build.
+
+    Args:
+        cached_hash (str | None): The dependency hash recorded for the last successful build.
+        log (StageLogger): The logger for the build stage.
+
+    Returns:
+        tuple[bool, str]: Whether the build was skipped as a cache hit, and the current dependency hash.
+    """
+    dependencies_hash = HashLambdaDependencies()
+    if (cached_hash == dependencies_hash and os.path.isdir(os.path.join(LAMBDA_DIR, "node_modules"))
+            and os.path.isdir(LAMBDA_LAYER_DIR)):
+        log.print("Lambda dependencies are unchanged, skipping install (cache hit).")
+        return True, dependencies_hash
+
+    log.print("Installing npm dependencies for every lambda function (cache miss)...")
+    try:
+        # Installs exactly what the lock file pins, and fails if it is out of step with a package.json
+        log.run(["npm", "ci"], cwd=LAMBDA_DIR, shell=NPM_SHELL)
+    except subprocess.CalledProcessError as e:
+        log.print(f"Error installing lambda dependencies: {e}")
+        log.print(f"If a package.json changed, run npm install in {LAMBDA_DIR} and commit package-lock.json.")
+        raise
+    BuildLambdaLayer(log)
+    return False, dependencies_hash
+
+
+def BuildLambdaLayer(log: StageLogger):
+    """
+    Copies the runtime dependencies of the lambda functions out of the workspace into a lambda layer.
+    Lambda adds the layer's nodejs/node_modules directory to the module search path of every function.
+
+    Raises:
+        ValueError: If a function needs a version of a dependency that differs from the shared one, or
+            one of its dependencies is missing from the lock file.
+    """
+    with open(os.path.join(LAMBDA_DIR, "package-lock.json"), "r") as f:
+        packages = json.load(f)["packages"]
+
+    # The layer is built from the lock file, so a dependency it does not resolve would be left out silently
+    for lambda_function_path in ListLambdaFunctions():
+        with open(os.path.join(LAMBDA_DIR, lambda_function_path, "package.json"), "r") as f:
+            dependencies = json.load(f).get("dependencies", {})
+        for name in sorted(dependencies):
+            if f"node_modules/{name}" not in packages:
+                raise ValueError(f"{name}, a dependency of {lambda_function_path}, is not in "
+                                 f"{LAMBDA_DIR}/package-lock.json. Run npm install in {LAMBDA_DIR} and commit "
+                                 "the updated lock file.")
+
+    if os.path.exists(LAMBDA_LAYER_DIR):
+        shutil.rmtree(LAMBDA_LAYER_DIR)
+    layer_modules_dir = os.path.join(LAMBDA_LAYER_DIR, "nodejs")
+    copied = 0
+    for package_path, package in sorted(packages.items()):
+        if package.get("dev") or package.get("link") or not package_path:
+            continue
+        if not package_path.startswith("node_modules/"):
+            if "/node_modules/" in package_path:
+                # npm only nests a dependency inside a function when the functions disagree on its version
+                raise ValueError(f"{package_path} is not shared with the other lambda functions, "
+                                 "align its version in every package.json.")
+            continue
+        # Nested dependencies are copied along with the package they belong to
+        if "/node_modules/" in package_path:
+            continue
+        source = os.path.join(LAMBDA_DIR, package_path)
+        if package.get("optional") and not os.path.isdir(source):
+            continue
+        shutil.copytree(source, os.path.join(layer_modules_dir, package_path), symlinks=True)
+        copied += 1
+    log.print(f"Built the lambda layer in {LAMBDA_LAYER_DIR} with {copied} packages.")
+
+
+def AnalyzeServerWorlds(prune: bool, log: StageLogger):
+    """
+    Reports the chunks of the worlds in the server directory that nobody has spent time in, and removes them
+    if prune is set, see ./region_pruner.py. Skipped if the server directory is unchanged since the last
+    profile archive, unless pruning.
+    """
+    previous = LoadProfileArchiveManifest(PROFILE_BUILD_DIR, PROFILE_NAME)
+    if (not prune and previous is not None
+            and previous.source_fingerprint == FingerprintProfileSources(ListProfileFiles(SERVER_DIR))):
+        log.print("Server profile is unchanged, skipping the world analysis.")
+        return
+    log.print(f"{'Pruning' if prune else 'Analyzing'} the worlds in {SERVER_DIR}...")
+    report = AnalyzeWorld(SERVER_DIR, prune=prune)
+    log.print(report.summary())
+    if not prune and report.unvisited:
+        log.print("Re-run with --prune-world to remove these chunks before the profile is packaged.")
+
+
+def BuildServerProfileArchive(log: StageLogger):
+    """
+    Packages the server directory as a reproducible, content addressed zip for terraform to upload.
+    Nothing is rebuilt if the files in the server directory are unchanged since the last build.
+    """
+    log.print(f"Packaging the server profile in {SERVER_DIR}...")
+    archive = BuildProfileArchive(SERVER_DIR, PROFILE_BUILD_DIR, PROFILE_NAME)
+    if archive.reused:
+        log.print(f"Server profile is unchanged, reusing {archive.path}.")
+    else:
+        log.print(f"Built {archive.path}: {archive.files} files, {archive.size / 1024 / 1024:.1f} MiB.")
+
+
+def RunTerraformInit(log: StageLogger):
+    log.print("Initializing terraform...")
+    try:
+        log.run(["terraform", "init", "-input=false"], cwd=TERRAFORM_DIR)
+    except subprocess.CalledProcessError as e:
+        log.print(f"Error initializing terraform: {e}")
+        raise
+
+
+# Results of the terraform plan stage
+PLAN_CREATED = "created"
+PLAN_REUSED = "reused"
+PLAN_UP_TO_DATE = "up-to-date"
+
+
+def RunTerraformPlan(force: bool, log: StageLogger) -> str:
+    """
+    Plans the terraform deployment, unless the inputs are unchanged since the last plan.
+
+    Args:
+        force (bool): Always run a full plan, even if the inputs are unchanged.
+        log (StageLogger): The logger for the plan stage.
+
+    Returns:
+        str: PLAN_CREATED, PLAN_REUSED if the saved plan is still valid, or PLAN_UP_TO_DATE
+        if the last plan with these inputs has already been applied.
+    """
+    log.print("Fingerprinting terraform inputs...")
+    fingerprint = FingerprintTerraformInputs()
+    previous = LoadPlanFingerprint()
+    if not force and previous.get("fingerprint") == fingerprint:
+        if previous.get("applied"):
+            log.print("Terraform inputs are unchanged since the last deployment, skipping plan.")
+            return PLAN_UP_TO_DATE
+        if os.path.exists(os.path.join(TERRAFORM_DIR, TERRAFORM_PLAN_NAME)):
+            log.print("Terraform inputs are unchanged, skipping plan.")
+            return PLAN_REUSED
+
+    log.print("Planning terraform deployment...")
+    try:
+        log.run(["terraform", "plan", "-input=false", "-var-file=.tfvars", f"-out={TERRAFORM_PLAN_NAME}"],
+                cwd=TERRAFORM_DIR)
+    except subprocess.CalledProcessError as e:
+        log.print(f"Error planning terraform deployment: {e}")
+        raise
+    SavePlanFingerprint(fingerprint, applied=False)
+    return PLAN_CREATED
+
+
+def HashTree(digest, root: str, patterns: list[str] | None = None, exclude_dirs: list[str] | None = None):
+    """
+    Feeds the relative path and contents of every file under a directory into a digest, in a stable order.
+
+    Args:
+        digest: The hashlib digest to update.
+        root (str): The directory to hash.
+        patterns (list[str] | None): Only include file names matching one of these patterns.
+        exclude_dirs (list[str] | None): Directory names to skip.
+    """
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(name for name in dir_names if name not in (exclude_dirs or []))
+        for file_name in sorted(file_names):
+            if patterns and not any(fnmatch(file_name, pattern) for pattern in patterns):
+                continue
+            file_path = os.path.join(dir_path, file_name)
+            digest.update(os.path.relpath(file_path, root).replace(os.sep, "/").encode("utf-8") + b"\x00")
+            with open(file_path, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    digest.update(chunk)
+            digest.update(b"\x00")
+
+
+def FingerprintTerraformInputs() -> str:
+    """
+    Hashes everything the terraform plan is built from: the terraform configuration and variables,
+    the built lambda artifacts and dependencies, the EC2 scripts and the server profile archive.
+
+    Returns:
+        str: The hex digest of the terraform inputs.
+    """
+    digest = hashlib.sha256()
+    sources = [
+        (TERRAFORM_DIR, TERRAFORM_INPUT_PATTERNS, [".terraform"]),
+        (EC2_SOURCE_DIR, None, ["__pycache__"]),
+    ]
+    lambda_functions = ListLambdaFunctions()
+    for lambda_function_path in lambda_functions:
+        sources.append((os.path.join(LAMBDA_DIR, lambda_function_path, "dist"), None, None))
+    # The layer holds exactly the packages in the lock file, so it is not read again
+    sources.append((LAMBDA_DIR, LAMBDA_WORKSPACE_FILES, ["node_modules", *lambda_functions]))
+
+    for root, patterns, exclude_dirs in sources:
+        digest.update(f"[{root}]".encode("utf-8"))
+        HashTree(digest, root, patterns, exclude_dirs)
+    # The archive is named by its hash, so there is no need to read the whole server directory again
+    archive = LoadProfileArchiveManifest(PROFILE_BUILD_DIR, PROFILE_NAME)
+    digest.update(f"[{PROFILE_NAME}]{archive.sha256 if archive else ''}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def LoadPlanFingerprint() -> dict:
+    """
+    Loads the fingerprint of the inputs the saved terraform plan was built from.
+    """
+    try:
+        with open(TERRAFORM_FINGERPRINT_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
 
-    print("Building the lambda function...")
-    subprocess.run(["npm", "run", "build"], check=True, cwd=path, shell=True)
+def SavePlanFingerprint(fingerprint: str | None, applied: bool):
+    with open(TERRAFORM_FINGERPRINT_FILE, "w") as f:
+        json.dump({"fingerprint": fingerprint, "applied": applied}, f, indent=2)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build and deploy the AWSCraft infrastructure.")
+    parser.add_argument("--force", action="store_true",
+                        help="Run a full terraform plan even if the inputs are unchanged since the last plan.")
+    parser.add_argument("--prune-world", action="store_true",
+                        help="Remove the chunks nobody has spent time in from the worlds in the server directory "
+                             "before packaging it. They are generated again if a player goes there.")
+    args = parser.parse_args()
+    main(force=args.force, prune_world=args.prune_world)
\ No newline at end of file
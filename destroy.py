@@ -1,14 +1,25 @@
+import asyncio
 import random
+import re
 import subprocess
 import os
 import shutil
+import sys
 import tempfile
 
 from utils import Check_Command_Availability, Prompt_AWS_Login
 
 TERRAFORM_DIR = "./terraform"
 TERRAFORM_PLAN_FILE = "terraform.tfplan"
+# NOTE: Must match the fingerprint file written next to the plan by ./deploy.py
+TERRAFORM_FINGERPRINT_FILE = f"{TERRAFORM_PLAN_FILE}.fingerprint"
 TF_VARS_FILE = ".tfvars"
+# NOTE: Must match the BACKUP_DIR in ./deploy.py
+BACKUP_DIR = "./backup"
+SERVER_DIR = "./server"
+EC2_SCRIPTS_DIR = "./src/ec2/scripts"
+# NOTE: Must match the prefix stop-server.py syncs each profile's world below
+WORLDS_PREFIX = "worlds/"
 
 
 def main():
@@ -28,7 +39,9 @@ def main():
         "ALL DATA WILL BE LOST PERMANENTLY. Do you wish to backup your Minecraft server data " \
         "before destruction? (Y/n): ").lower()
         if do_minecraft_backup in ["y", "yes"]:
-            ...
+            if not Backup_Minecraft_Server(os.path.join(BACKUP_DIR, "minecraft")):
+                print("Aborting destroy process.")
+                return
         elif do_minecraft_backup in ["n", "no"]:
             print("Proceeding without backup. All data will be lost permanently.") 
         
@@ -71,11 +84,110 @@ def Run_Terraform_Destroy(terraform_dir: str):
         print(f"Error during terraform destroy: {e}")
         print("Aborting destroy process.")
         return
+    # The last deployment no longer exists, so the next deploy must plan from scratch
+    fingerprint_path = os.path.join(terraform_dir, TERRAFORM_FINGERPRINT_FILE)
+    if os.path.exists(fingerprint_path):
+        os.remove(fingerprint_path)
     print("Confirmation received. Proceeding with Terraform destroy...")
 
 
-def Backup_Minecraft_Server(output_dir: str):
-    ...
+def Backup_Minecraft_Server(output_dir: str) -> bool:
+    """
+    Backs up the Minecraft worlds with the deduplicating engine in ./src/ec2/scripts/world_backup.py.
+    By default the worlds are taken from the worlds/ prefix of the data bucket, where the instance syncs them,
+    a local directory can be given instead. Chunks already stored by an earlier backup to the same
+    destination are not stored again.
+
+    Args:
+        output_dir (str): The default backup destination.
+
+    Returns:
+        bool: True if the backup completed, False otherwise.
+    """
+    sys.path.insert(0, EC2_SCRIPTS_DIR)
+    from aws_client import AWSRequestError
+    from world_backup import BackupWorld, FormatSize, OpenChunkStore
+
+    bucket = Read_TF_Var("BucketName")
+    default_source = f"s3://{bucket}/{WORLDS_PREFIX}" if bucket else None
+    source = None
+    while not source:
+        source = input("Enter the worlds to back up, s3://bucket/prefix or a local directory"
+                       + (f" ({default_source}): " if default_source else ": ")) or default_source
+        if source and not source.startswith("s3://") and not os.path.isdir(source):
+            print("Invalid directory path. Please try again.")
+            source = None
+
+    print("NOTE: The AWSCraft bucket is destroyed along with the rest of the infrastructure, "
+          "back up to a local directory or a bucket that is not managed by this project.")
+    destination = input(f"Enter the backup destination, a directory or s3://bucket/prefix ({output_dir}): ") \
+        or output_dir
+
+    region = Read_TF_Var("Region")
+    try:
+        store = OpenChunkStore(destination, region)
+        if source.startswith("s3://"):
+            result = asyncio.run(Backup_Bucket_Worlds(source, store, region))
+        else:
+            result = asyncio.run(BackupWorld(source, store))
+    except (AWSRequestError, OSError, ValueError) as e:
+        print(f"Error during Minecraft server backup: {e}")
+        return False
+
+    print(f"Backed up {result.files} files ({FormatSize(result.total_bytes)}) in {result.elapsed:.1f}s, "
+          f"stored {result.new_chunks} new chunks ({FormatSize(result.uploaded_bytes)}).")
+    print(f"Backup manifest: {os.path.join(destination, result.manifest_key)}")
+    return True
+
+
+async def Backup_Bucket_Worlds(source: str, store, region: str | None):
+    """
+    Backs up every world synced below an S3 prefix together, each profile's world in a directory named after
+    the profile. The files are streamed from the bucket into the backup, nothing is written to local disk.
+
+    Args:
+        source (str): The s3://bucket/prefix the worlds are synced below.
+        store (LocalChunkStore | S3ChunkStore): Where to store the backup.
+        region (str | None): The region of the bucket, defaults to AWS_REGION.
+
+    Returns:
+        BackupResult: The manifest key and statistics about the backup.
+
+    Raises:
+        ValueError: If no worlds were found, or a region is not known.
+    """
+    from aws_client import S3Client, cli_credentials
+    from world_backup import BackupWorld
+    from world_sync import ListSyncedWorlds
+
+    bucket, _, prefix = source[len("s3://"):].partition("/")
+    region = region or os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION")
+    if not region:
+        raise ValueError("A region is required to read the worlds from S3, set Region in the .tfvars file")
+    client = S3Client(bucket, region, cli_credentials)
+
+    files = await ListSyncedWorlds(client, prefix)
+    if not files:
+        raise ValueError(f"No worlds found below {source}")
+    profiles = sorted({file.path.split("/")[0] for file in files})
+    print(f"Backing up the {', '.join(profiles)} worlds from {source}.")
+    print("NOTE: The bucket holds each world as of its last sync, stop the servers first so nothing is missed.")
+    return await BackupWorld(files, store)
+
+
+def Read_TF_Var(name: str, terraform_dir: str = TERRAFORM_DIR) -> str | None:
+    """
+    Reads a string variable from the .tfvars file.
+
+    Returns:
+        str | None: The value of the variable, or None if it is not set.
+    """
+    try:
+        with open(os.path.join(terraform_dir, TF_VARS_FILE)) as f:
+            match = re.search(rf'^\s*{re.escape(name)}\s*=\s*"([^"]*)"', f.read(), re.MULTILINE)
+    except OSError:
+        return None
+    return match.group(1) if match else None
 
 
 def Restore_Terraform_From_Backup() -> str:
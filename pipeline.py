@@ -0,0 +1,203 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+import os
+import subprocess
+import threading
+import time
+from typing import Any, Callable
+
+# Serializes output from stages running on different threads so lines never interleave mid line
+_print_lock = threading.Lock()
+
+
+class StageLogger:
+    """
+    Prints output for a single stage, prefixing every line with the stage name.
+    """
+    def __init__(self, label: str):
+        self.label = label
+
+    def print(self, message: str):
+        with _print_lock:
+            for line in message.splitlines() or [""]:
+                print(f"[{self.label}] {line}", flush=True)
+
+    def run(self, args: list[str], cwd: str | None = None, shell: bool = False):
+        """
+        Runs a command, streaming its combined stdout and stderr through the logger.
+
+        Args:
+            args (list[str]): The command to run.
+            cwd (str | None): The working directory to run the command in.
+            shell (bool): Whether to run the command through the shell.
+
+        Raises:
+            subprocess.CalledProcessError: If the command exits with a non-zero code.
+        """
+        with subprocess.Popen(args,
+                              cwd=cwd,
+                              shell=shell,
+                              stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT,
+                              text=True,
+                              errors="replace") as process:
+            for line in process.stdout:
+                self.print(line.rstrip("\n"))
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, args)
+
+
+@dataclass
+class Stage:
+    """
+    A single unit of work in a pipeline.
+    """
+    name: str
+    func: Callable[[StageLogger], Any]
+    depends_on: list[str] = field(default_factory=list)
+    result: Any = None
+    error: BaseException | None = None
+    start: float | None = None
+    end: float | None = None
+
+    @property
+    def duration(self) -> float:
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+
+class Pipeline:
+    """
+    Runs stages on a worker pool as soon as all of the stages they depend on have finished.
+    """
+    def __init__(self, max_workers: int | None = None):
+        # Stages mostly wait on subprocesses, so the pool is sized like ThreadPoolExecutor's default
+        # rather than by the number of cores
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.stages: dict[str, Stage] = {}
+        self.start: float | None = None
+        self.end: float | None = None
+
+    def add(self, name: str, func: Callable[[StageLogger], Any], depends_on: list[str] | None = None) -> Stage:
+        """
+        Adds a stage to the pipeline.
+
+        Args:
+            name (str): The unique name of the stage, also used to label its output.
+            func (Callable[[StageLogger], Any]): The work to run, its return value is stored on the stage.
+            depends_on (list[str] | None): The names of stages that must succeed before this one runs.
+
+        Returns:
+            Stage: The added stage.
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage {name} already exists")
+        stage = Stage(name, func, list(depends_on or []))
+        self.stages[name] = stage
+        return stage
+
+    def run(self) -> bool:
+        """
+        Runs every stage. Once a stage fails no new stages are started, but running stages are allowed to finish.
+
+        Returns:
+            bool: True if every stage succeeded.
+        """
+        for stage in self.stages.values():
+            for dependency in stage.depends_on:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dependency}")
+
+        pending = dict(self.stages)
+        completed: set[str] = set()
+        running: dict[Future, Stage] = {}
+        failed = False
+        self.start = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if not failed:
+                    for name, stage in list(pending.items()):
+                        if all(dependency in completed for dependency in stage.depends_on):
+                            del pending[name]
+                            running[executor.submit(self._run_stage, stage)] = stage
+
+                if not running:
+                    if pending and not failed:
+                        raise ValueError(f"Dependency cycle between stages: {', '.join(pending)}")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    if stage.error is None:
+                        completed.add(stage.name)
+                    else:
+                        failed = True
+
+        self.end = time.monotonic()
+        return not failed and not pending
+
+    def _run_stage(self, stage: Stage):
+        logger = StageLogger(stage.name)
+        stage.start = time.monotonic()
+        try:
+            stage.result = stage.func(logger)
+        except BaseException as e:
+            stage.error = e
+            logger.print(f"Stage failed: {e}")
+        finally:
+            stage.end = time.monotonic()
+
+    def CriticalPath(self) -> list[Stage]:
+        """
+        Finds the chain of stages that determined the total run time.
+        Starting from the stage that finished last, it repeatedly follows the dependency that finished last.
+
+        Returns:
+            list[Stage]: The stages on the critical path, in the order they ran.
+        """
+        finished = [stage for stage in self.stages.values() if stage.end is not None]
+        if not finished:
+            return []
+
+        path = [max(finished, key=lambda stage: stage.end)]
+        while True:
+            dependencies = [self.stages[name] for name in path[-1].depends_on if self.stages[name].end is not None]
+            if not dependencies:
+                break
+            path.append(max(dependencies, key=lambda stage: stage.end))
+        path.reverse()
+        return path
+
+    def PrintTimingReport(self):
+        """
+        Prints when each stage ran, followed by a breakdown of the critical path.
+        """
+        if self.start is None or self.end is None:
+            return
+
+        total = self.end - self.start
+        name_width = max([len(name) for name in self.stages] + [5])
+        print("-" * (name_width + 36))
+        print(f"{'Stage':<{name_width}} {'Start':>8} {'End':>8} {'Time':>8}  Status")
+        print("-" * (name_width + 36))
+        ran = sorted((stage for stage in self.stages.values() if stage.start is not None), key=lambda s: s.start)
+        for stage in ran:
+            status = "ok" if stage.error is None else "failed"
+            print(f"{stage.name:<{name_width}} {stage.start - self.start:>7.1f}s "
+                  f"{stage.end - self.start:>7.1f}s {stage.duration:>7.1f}s  {status}")
+        for stage in self.stages.values():
+            if stage.start is None:
+                print(f"{stage.name:<{name_width}} {'-':>8} {'-':>8} {'-':>8}  skipped")
+        print("-" * (name_width + 36))
+
+        busy = sum(stage.duration for stage in ran)
+        print(f"Wall clock: {total:.1f}s, stage time: {busy:.1f}s "
+              f"({busy / total if total > 0 else 0:.1f}x parallelism)")
+        print("Critical path:")
+        for stage in self.CriticalPath():
+            share = stage.duration / total * 100 if total > 0 else 0
+            print(f"  {stage.name:<{name_width}} {stage.duration:>7.1f}s ({share:.0f}%)")
@@ -0,0 +1,353 @@
+"""
+Profile Archive
+Packages a server profile directory as a reproducible zip, named by the hash of its contents.
+
+The same files always produce a byte for byte identical archive: entries are sorted by path, every entry
+has the same fixed timestamp and only the executable bit of each file's mode is kept. The archive is
+named <profile>-<sha256 prefix>.zip, and a small <profile>.json manifest next to it records the name and
+hashes for terraform, so the profile is only uploaded again when its contents actually change.
+
+Files are compressed in parallel on a thread pool, zlib releases the GIL while it compresses so this uses
+every core. Files that are already compressed, such as jars and region files, are stored as they are.
+
+Usage:
+    python profile_archive.py <source_dir> <output_dir> [--name DefaultMinecraftProfile] [--force]
+"""
+
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+import glob
+import hashlib
+import json
+import os
+import stat
+import struct
+import tempfile
+from typing import BinaryIO
+import zlib
+
+# Formats that are already compressed, deflating them again costs time and saves almost nothing
+STORED_EXTENSIONS = {".jar", ".zip", ".mca", ".mcc", ".dat", ".dat_old", ".gz", ".xz", ".png", ".jpg", ".ogg"}
+DEFAULT_COMPRESS_LEVEL = 6
+CHUNK_SIZE = 1024 * 1024
+# Compressed data is kept in memory up to this size, larger files spill to a temporary file
+SPOOL_SIZE = 8 * 1024 * 1024
+
+# Every entry gets the earliest time a zip can hold, 1980-01-01 00:00:00, in MS-DOS format
+DOS_TIME = 0
+DOS_DATE = (1 << 5) | 1
+# Created on unix, so unzip restores the permission bits in the external attributes
+VERSION_MADE_BY = (3 << 8) | 45
+VERSION_DEFLATE = 20
+VERSION_ZIP64 = 45
+FLAG_UTF8 = 0x800
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+
+@dataclass
+class ProfileArchive:
+    """
+    Attributes:
+        name (str): The profile name.
+        path (str): The path of the archive.
+        sha256 (str): The hex sha256 of the archive.
+        md5 (str): The hex md5 of the archive, which S3 reports as the etag of a single part upload.
+        size (int): The size of the archive in bytes.
+        files (int): The number of files in the archive.
+        source_fingerprint (str): The hash of the paths, sizes, modes and modification times of the
+            source files, used to skip rebuilding an unchanged profile.
+        reused (bool): Whether the archive from the last build was reused.
+    """
+    name: str
+    path: str
+    sha256: str
+    md5: str
+    size: int
+    files: int
+    source_fingerprint: str
+    reused: bool = False
+
+
+@dataclass
+class _Entry:
+    name: str
+    path: str
+    mode: int
+    method: int
+    crc: int
+    size: int
+    compressed_size: int
+    # The deflated data, None when the file is stored and copied straight from the source
+    data: BinaryIO | None
+
+
+def ListProfileFiles(source_dir: str) -> list[tuple[str, str, os.stat_result]]:
+    """
+    Lists every file under a profile directory.
+
+    Returns:
+        list[tuple[str, str, os.stat_result]]: The archive name, path and stat of each file, sorted by name.
+    """
+    files = []
+    for dir_path, dir_names, file_names in os.walk(source_dir):
+        dir_names.sort()
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            name = os.path.relpath(path, source_dir).replace(os.sep, "/")
+            files.append((name, path, os.stat(path)))
+    files.sort(key=lambda file: file[0])
+    return files
+
+
+def FingerprintProfileSources(files: list[tuple[str, str, os.stat_result]]) -> str:
+    """
+    Hashes the listing of a profile directory without reading the files.
+
+    Returns:
+        str: The hex digest of the name, size, mode and modification time of every file.
+    """
+    digest = hashlib.sha256()
+    for name, _, file_stat in files:
+        digest.update(f"{name}\x00{file_stat.st_size}\x00{file_stat.st_mode}\x00{file_stat.st_mtime_ns}\x00"
+                      .encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _entry_mode(file_stat: os.stat_result) -> int:
+    # Only the executable bit is kept so that umask and ownership differences do not change the archive
+    return stat.S_IFREG | (0o755 if file_stat.st_mode & stat.S_IXUSR else 0o644)
+
+
+def _compress_file(name: str, path: str, mode: int, level: int) -> _Entry:
+    """
+    Deflates a file into a spooled temporary file, or only checksums it if it is stored.
+    """
+    crc = 0
+    size = 0
+    if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        return _Entry(name, path, mode, METHOD_STORED, crc, size, size, None)
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                data.write(compressor.compress(chunk))
+        data.write(compressor.flush())
+    except BaseException:
+        data.close()
+        raise
+
+    compressed_size = data.tell()
+    if compressed_size >= size:
+        # Incompressible, storing it is smaller and faster to extract
+        data.close()
+        return _Entry(name, path, mode, METHOD_STORED, crc, size, size, None)
+    data.seek(0)
+    return _Entry(name, path, mode, METHOD_DEFLATED, crc, size, compressed_size, data)
+
+
+class _HashingWriter:
+    """
+    Writes to a file while hashing everything written.
+    """
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.offset = 0
+        self.sha256 = hashlib.sha256()
+        self.md5 = hashlib.md5()
+
+    def write(self, data: bytes):
+        self.f.write(data)
+        self.sha256.update(data)
+        self.md5.update(data)
+        self.offset += len(data)
+
+
+class _ZipWriter:
+    """
+    Writes zip entries whose data and checksums are already known, with zip64 records where needed.
+    """
+    def __init__(self, f: BinaryIO):
+        self.out = _HashingWriter(f)
+        self.central_directory: list[bytes] = []
+
+    def write_entry(self, entry: _Entry):
+        offset = self.out.offset
+        name = entry.name.encode("utf-8")
+        zip64 = entry.size >= ZIP64_LIMIT or entry.compressed_size >= ZIP64_LIMIT
+        version = VERSION_ZIP64 if zip64 else VERSION_DEFLATE
+
+        local_extra = struct.pack("<HHQQ", 1, 16, entry.size, entry.compressed_size) if zip64 else b""
+        sizes = (ZIP64_LIMIT, ZIP64_LIMIT) if zip64 else (entry.compressed_size, entry.size)
+        self.out.write(struct.pack("<IHHHHHI", 0x04034B50, version, FLAG_UTF8, entry.method, DOS_TIME, DOS_DATE,
+                                   entry.crc) +
+                       struct.pack("<IIHH", *sizes, len(name), len(local_extra)) + name + local_extra)
+
+        written = 0
+        if entry.data is not None:
+            while chunk := entry.data.read(CHUNK_SIZE):
+                self.out.write(chunk)
+                written += len(chunk)
+        else:
+            with open(entry.path, "rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    self.out.write(chunk)
+                    written += len(chunk)
+        if written != entry.compressed_size:
+            raise RuntimeError(f"{entry.path} changed while it was being archived")
+
+        # The central directory only moves the fields that overflow into the zip64 extra field
+        overflow = [value for value in (entry.size, entry.compressed_size, offset) if value >= ZIP64_LIMIT]
+        central_extra = struct.pack(f"<HH{len(overflow)}Q", 1, 8 * len(overflow), *overflow) if overflow else b""
+        if overflow:
+            version = VERSION_ZIP64
+        self.central_directory.append(
+            struct.pack("<IHHHHHHI", 0x02014B50, VERSION_MADE_BY, version, FLAG_UTF8, entry.method, DOS_TIME,
+                        DOS_DATE, entry.crc) +
+            struct.pack("<IIHHHHHII",
+                        min(entry.compressed_size, ZIP64_LIMIT), min(entry.size, ZIP64_LIMIT),
+                        len(name), len(central_extra), 0, 0, 0, entry.mode << 16, min(offset, ZIP64_LIMIT)) +
+            name + central_extra)
+
+    def close(self):
+        start = self.out.offset
+        for record in self.central_directory:
+            self.out.write(record)
+        size = self.out.offset - start
+        count = len(self.central_directory)
+
+        if count >= ZIP64_COUNT_LIMIT or start >= ZIP64_LIMIT or size >= ZIP64_LIMIT:
+            end64 = self.out.offset
+            self.out.write(struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, VERSION_MADE_BY, VERSION_ZIP64, 0, 0,
+                                       count, count, size, start))
+            self.out.write(struct.pack("<IIQI", 0x07064B50, 0, end64, 1))
+        self.out.write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, min(count, ZIP64_COUNT_LIMIT),
+                                   min(count, ZIP64_COUNT_LIMIT), min(size, ZIP64_LIMIT),
+                                   min(start, ZIP64_LIMIT), 0))
+
+
+def LoadProfileArchiveManifest(output_dir: str, name: str) -> ProfileArchive | None:
+    """
+    Loads the manifest written by the last build of a profile.
+
+    Returns:
+        ProfileArchive | None: The last build, or None if there is none or its archive is missing.
+    """
+    try:
+        with open(os.path.join(output_dir, f"{name}.json"), "r") as f:
+            manifest = json.load(f)
+        archive = ProfileArchive(path=os.path.join(output_dir, manifest.pop("file")), **manifest)
+    except (OSError, ValueError, TypeError, KeyError):
+        return None
+    if not os.path.exists(archive.path):
+        return None
+    return archive
+
+
+def _save_manifest(output_dir: str, archive: ProfileArchive):
+    manifest = asdict(archive)
+    del manifest["reused"]
+    # Stored relative to the manifest, terraform reads it from a different working directory
+    manifest["file"] = os.path.basename(manifest.pop("path"))
+    manifest_path = os.path.join(output_dir, f"{archive.name}.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def BuildProfileArchive(source_dir: str, output_dir: str, name: str, workers: int | None = None,
+                        level: int = DEFAULT_COMPRESS_LEVEL, force: bool = False) -> ProfileArchive:
+    """
+    Builds the archive of a profile, unless the source files are unchanged since the last build.
+
+    Args:
+        source_dir (str): The profile directory to package.
+        output_dir (str): The directory to write the archive and its manifest to.
+        name (str): The profile name, used to name the archive.
+        workers (int | None): The number of files to compress at once, defaults to the number of cores.
+        level (int): The zlib compression level.
+        force (bool): Rebuild even if the source files look unchanged.
+
+    Returns:
+        ProfileArchive: The archive, with reused set if the last build was kept.
+    """
+    files = ListProfileFiles(source_dir)
+    source_fingerprint = FingerprintProfileSources(files)
+    previous = LoadProfileArchiveManifest(output_dir, name)
+    if not force and previous is not None and previous.source_fingerprint == source_fingerprint:
+        previous.reused = True
+        return previous
+
+    os.makedirs(output_dir, exist_ok=True)
+    temp_path = os.path.join(output_dir, f"{name}.zip.tmp")
+    workers = workers or os.cpu_count() or 1
+    with open(temp_path, "wb") as f, ThreadPoolExecutor(max_workers=workers) as executor:
+        writer = _ZipWriter(f)
+        # Later files are compressed while earlier ones are written in order. Only a few files per worker
+        # are compressed ahead, which bounds the memory held by finished but unwritten entries.
+        pending = deque()
+        remaining = iter(files)
+        try:
+            while True:
+                while len(pending) < workers * 2 and (file := next(remaining, None)) is not None:
+                    pending.append(executor.submit(_compress_file, file[0], file[1], _entry_mode(file[2]), level))
+                if not pending:
+                    break
+                entry = pending.popleft().result()
+                try:
+                    writer.write_entry(entry)
+                finally:
+                    if entry.data is not None:
+                        entry.data.close()
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            for future in pending:
+                if not future.cancelled() and future.exception() is None and future.result().data is not None:
+                    future.result().data.close()
+            raise
+        writer.close()
+
+    sha256 = writer.out.sha256.hexdigest()
+    path = os.path.join(output_dir, f"{name}-{sha256[:16]}.zip")
+    os.replace(temp_path, path)
+    # Older archives of this profile are superseded
+    for old_path in glob.glob(os.path.join(glob.escape(output_dir), f"{glob.escape(name)}-*.zip")):
+        if os.path.abspath(old_path) != os.path.abspath(path):
+            os.remove(old_path)
+
+    archive = ProfileArchive(name=name, path=path, sha256=sha256, md5=writer.out.md5.hexdigest(),
+                             size=writer.out.offset, files=len(files), source_fingerprint=source_fingerprint)
+    _save_manifest(output_dir, archive)
+    return archive
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--name", default="DefaultMinecraftProfile")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--level", type=int, default=DEFAULT_COMPRESS_LEVEL)
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the source files look unchanged.")
+    args = parser.parse_args()
+
+    archive = BuildProfileArchive(args.source_dir, args.output_dir, args.name, args.workers, args.level, args.force)
+    state = "unchanged" if archive.reused else "built"
+    print(f"{archive.path} {state}: {archive.files} files, {archive.size} bytes, sha256 {archive.sha256}")
+
+
+if __name__ == "__main__":
+    main()
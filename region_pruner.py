@@ -0,0 +1,395 @@
+"""
+Region Pruner
+Finds the chunks of a Minecraft world that nobody has spent time in, and optionally removes them, so the
+world uploads, backs up and unzips faster. Pruned chunks are generated again, from the world seed, if a
+player ever goes there.
+
+Region files (.mca) are memory mapped. The 8 KiB header gives the sectors of every chunk without reading
+the rest of the file, and each chunk is decompressed only until its InhabitedTime is found: the NBT is
+scanned tag by tag and everything else is skipped over without being decoded. InhabitedTime counts the
+ticks players spent near the chunk, so chunks that were only generated as someone flew past stay close
+to 0. Chunks stored in a format that can not be read here, e.g. LZ4 or an external .mcc file, are kept.
+
+Pruning rewrites each region file with only the chunks that are kept, packed together, and removes the
+same chunks from the entities/ and poi/ region files next to it. Regions with no chunks left are deleted.
+Region files are processed in parallel, one per core. The server must not be running.
+
+Usage:
+    python region_pruner.py <world or server dir> [--min-inhabited-seconds 15] [--prune] [--workers N]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import partial
+import json
+import mmap
+import os
+import struct
+import zlib
+
+SECTOR_SIZE = 4096
+HEADER_SIZE = 2 * SECTOR_SIZE
+CHUNKS_PER_REGION = 1024
+TICKS_PER_SECOND = 20
+DEFAULT_MIN_INHABITED_SECONDS = 15.0
+# Compressed data fed to the decompressor at a time, most chunks reach InhabitedTime in the first few
+INFLATE_STEP = 4096
+# Region files whose chunks are removed along with the terrain in region/
+SIBLING_REGION_DIRS = ("entities", "poi")
+
+COMPRESSION_GZIP = 1
+COMPRESSION_ZLIB = 2
+COMPRESSION_NONE = 3
+# Set on the compression type when the chunk is too large for the region file and lives in c.<x>.<z>.mcc
+COMPRESSION_EXTERNAL = 0x80
+
+TAG_END = 0
+TAG_LONG = 4
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+TAG_LONG_ARRAY = 12
+# Payload sizes of the tags that have no length prefix
+FIXED_TAG_SIZES = {1: 1, 2: 2, 3: 4, 4: 8, 5: 4, 6: 8}
+
+
+@dataclass
+class RegionReport:
+    """
+    Attributes:
+        path (str): The region file.
+        chunks (int): The chunks stored in the region.
+        unvisited (int): Chunks with less InhabitedTime than the threshold.
+        unreadable (int): Chunks whose InhabitedTime could not be read, they are always kept.
+        size (int): The size of the region file before pruning.
+        unvisited_size (int): The bytes the unvisited chunks take up in the region file.
+        pruned_size (int): The size of the region file and its siblings that pruning removed.
+        error (str | None): Why the region could not be read at all.
+    """
+    path: str
+    chunks: int = 0
+    unvisited: int = 0
+    unreadable: int = 0
+    size: int = 0
+    unvisited_size: int = 0
+    pruned_size: int = 0
+    error: str | None = None
+
+
+@dataclass
+class WorldReport:
+    root: str
+    min_inhabited_ticks: int
+    pruned: bool
+    regions: list[RegionReport] = field(default_factory=list)
+
+    @property
+    def chunks(self) -> int:
+        return sum(region.chunks for region in self.regions)
+
+    @property
+    def unvisited(self) -> int:
+        return sum(region.unvisited for region in self.regions)
+
+    @property
+    def size(self) -> int:
+        return sum(region.size for region in self.regions)
+
+    @property
+    def unvisited_size(self) -> int:
+        return sum(region.unvisited_size for region in self.regions)
+
+    @property
+    def pruned_size(self) -> int:
+        return sum(region.pruned_size for region in self.regions)
+
+    def summary(self) -> str:
+        unreadable = sum(region.unreadable for region in self.regions)
+        errors = sum(region.error is not None for region in self.regions)
+        action = (f"pruned, {self.pruned_size / 2**20:.1f} MiB freed" if self.pruned
+                  else f"{self.unvisited_size / 2**20:.1f} MiB could be pruned")
+        return (f"{len(self.regions)} region files, {self.size / 2**20:.1f} MiB: {self.unvisited} of {self.chunks} "
+                f"chunks have less than {self.min_inhabited_ticks / TICKS_PER_SECOND:g}s of InhabitedTime, "
+                f"{action}. {unreadable} chunks and {errors} region files could not be read and were kept.")
+
+
+class _NbtStream:
+    """
+    Reads a chunk's NBT from its compressed data, decompressing only as far as the reads reach.
+    """
+    def __init__(self, data: memoryview, compression: int):
+        self._data = data
+        self._consumed = 0
+        self._offset = 0
+        if compression == COMPRESSION_NONE:
+            self._decompressor = None
+            self._buffer = data
+            self._consumed = len(data)
+        else:
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS if compression == COMPRESSION_GZIP
+                                                    else zlib.MAX_WBITS)
+            self._buffer = b""
+
+    def _inflate(self):
+        if self._decompressor is None or self._consumed >= len(self._data):
+            raise EOFError("Chunk data ended inside a tag")
+        step = self._data[self._consumed:self._consumed + INFLATE_STEP]
+        self._consumed += len(step)
+        self._buffer = bytes(self._buffer[self._offset:]) + self._decompressor.decompress(step)
+        self._offset = 0
+
+    def read(self, size: int) -> bytes:
+        while len(self._buffer) - self._offset < size:
+            self._inflate()
+        value = bytes(self._buffer[self._offset:self._offset + size])
+        self._offset += size
+        return value
+
+    def skip(self, size: int):
+        if size < 0:
+            raise ValueError("Negative NBT length")
+        while len(self._buffer) - self._offset < size:
+            size -= len(self._buffer) - self._offset
+            self._buffer = b""
+            self._offset = 0
+            self._inflate()
+        self._offset += size
+
+
+def _read_name(stream: _NbtStream) -> bytes:
+    return stream.read(struct.unpack(">H", stream.read(2))[0])
+
+
+def _skip_payload(stream: _NbtStream, tag: int):
+    if tag in FIXED_TAG_SIZES:
+        stream.skip(FIXED_TAG_SIZES[tag])
+    elif tag == TAG_BYTE_ARRAY:
+        stream.skip(struct.unpack(">i", stream.read(4))[0])
+    elif tag == TAG_STRING:
+        stream.skip(struct.unpack(">H", stream.read(2))[0])
+    elif tag == TAG_LIST:
+        element, length = struct.unpack(">bi", stream.read(5))
+        if element in FIXED_TAG_SIZES:
+            stream.skip(FIXED_TAG_SIZES[element] * length)
+        else:
+            for _ in range(length):
+                _skip_payload(stream, element)
+    elif tag == TAG_COMPOUND:
+        while (child := stream.read(1)[0]) != TAG_END:
+            stream.skip(struct.unpack(">H", stream.read(2))[0])
+            _skip_payload(stream, child)
+    elif tag == TAG_INT_ARRAY:
+        stream.skip(4 * struct.unpack(">i", stream.read(4))[0])
+    elif tag == TAG_LONG_ARRAY:
+        stream.skip(8 * struct.unpack(">i", stream.read(4))[0])
+    else:
+        raise ValueError(f"Unknown NBT tag {tag}")
+
+
+def _find_inhabited_time(stream: _NbtStream) -> int | None:
+    # Scans the fields of the compound the stream is in, until its end tag
+    while (tag := stream.read(1)[0]) != TAG_END:
+        name = _read_name(stream)
+        if tag == TAG_LONG and name == b"InhabitedTime":
+            return struct.unpack(">q", stream.read(8))[0]
+        if tag == TAG_COMPOUND and name == b"Level":
+            # Before 1.18 the chunk's fields are nested in a Level compound
+            inhabited_time = _find_inhabited_time(stream)
+            if inhabited_time is not None:
+                return inhabited_time
+        else:
+            _skip_payload(stream, tag)
+    return None
+
+
+def ReadInhabitedTime(chunk: memoryview) -> int | None:
+    """
+    Reads InhabitedTime from a chunk stored in a region file.
+
+    Args:
+        chunk (memoryview): The chunk's sectors, starting with its length and compression type.
+
+    Returns:
+        int | None: The ticks players spent near the chunk, None if the chunk can not be read here.
+    """
+    if len(chunk) < 5:
+        return None
+    length, compression = struct.unpack_from(">IB", chunk)
+    if compression not in (COMPRESSION_GZIP, COMPRESSION_ZLIB, COMPRESSION_NONE) or not 1 < length <= len(chunk) - 4:
+        return None
+    stream = _NbtStream(chunk[5:4 + length], compression)
+    try:
+        if stream.read(1)[0] != TAG_COMPOUND:
+            return None
+        _read_name(stream)
+        return _find_inhabited_time(stream)
+    except (EOFError, ValueError, IndexError, struct.error, zlib.error):
+        return None
+
+
+def ReadRegionHeader(data: bytes | mmap.mmap) -> dict[int, tuple[int, int, int]]:
+    """
+    Args:
+        data: The region file, at least HEADER_SIZE bytes.
+
+    Returns:
+        dict[int, tuple[int, int, int]]: The first sector, sector count and timestamp of every chunk in the
+            region, by its index x + 32 * z within the region.
+    """
+    locations = struct.unpack_from(f">{CHUNKS_PER_REGION}I", data, 0)
+    timestamps = struct.unpack_from(f">{CHUNKS_PER_REGION}I", data, SECTOR_SIZE)
+    chunks = {}
+    for index, location in enumerate(locations):
+        sector, count = location >> 8, location & 0xFF
+        if sector >= 2 and count:
+            chunks[index] = (sector, count, timestamps[index])
+    return chunks
+
+
+def PruneRegionFile(path: str, drop: set[int]) -> int:
+    """
+    Rewrites a region file without some of its chunks, packing the rest together. The file is deleted if
+    no chunks are left.
+
+    Args:
+        path (str): The region file.
+        drop (set[int]): The indexes of the chunks to remove.
+
+    Returns:
+        int: The bytes the file shrank by.
+    """
+    size = os.path.getsize(path)
+    if size < HEADER_SIZE:
+        return 0
+    temp_path = f"{path}.prune-tmp"
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        chunks = ReadRegionHeader(data)
+        kept = {index: chunk for index, chunk in chunks.items() if index not in drop}
+        if len(kept) == len(chunks):
+            return 0
+        if kept:
+            header = bytearray(HEADER_SIZE)
+            with open(temp_path, "wb") as out:
+                out.write(header)
+                next_sector = 2
+                # In file order, so the copy reads the mapping front to back
+                for index, (sector, count, timestamp) in sorted(kept.items(), key=lambda item: item[1][0]):
+                    block = data[sector * SECTOR_SIZE:(sector + count) * SECTOR_SIZE]
+                    # A chunk at the end of a truncated file is padded, so the chunks after it stay aligned
+                    out.write(block + bytes(count * SECTOR_SIZE - len(block)))
+                    struct.pack_into(">I", header, 4 * index, (next_sector << 8) | count)
+                    struct.pack_into(">I", header, SECTOR_SIZE + 4 * index, timestamp)
+                    next_sector += count
+                out.seek(0)
+                out.write(header)
+    if not kept:
+        os.remove(path)
+        return size
+    os.replace(temp_path, path)
+    return size - os.path.getsize(path)
+
+
+def AnalyzeRegion(path: str, min_inhabited_ticks: int, prune: bool = False) -> RegionReport:
+    """
+    Finds the chunks of a region with less InhabitedTime than the threshold, and removes them if prune is set.
+
+    Returns:
+        RegionReport: What the region holds, and what was pruned.
+    """
+    report = RegionReport(path)
+    unvisited = set()
+    try:
+        report.size = os.path.getsize(path)
+        if report.size < HEADER_SIZE:
+            # Servers create empty region files that are never written to
+            return report
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            view = memoryview(data)
+            try:
+                for index, (sector, count, _) in ReadRegionHeader(data).items():
+                    report.chunks += 1
+                    inhabited_time = ReadInhabitedTime(view[sector * SECTOR_SIZE:(sector + count) * SECTOR_SIZE])
+                    if inhabited_time is None:
+                        report.unreadable += 1
+                    elif inhabited_time < min_inhabited_ticks:
+                        unvisited.add(index)
+                        report.unvisited_size += count * SECTOR_SIZE
+            finally:
+                view.release()
+        report.unvisited = len(unvisited)
+
+        if prune and unvisited:
+            report.pruned_size = PruneRegionFile(path, unvisited)
+            region_dir = os.path.dirname(path)
+            for sibling in SIBLING_REGION_DIRS:
+                sibling_path = os.path.join(os.path.dirname(region_dir), sibling, os.path.basename(path))
+                if os.path.exists(sibling_path):
+                    report.pruned_size += PruneRegionFile(sibling_path, unvisited)
+    except (OSError, ValueError) as e:
+        report.error = str(e)
+    return report
+
+
+def FindRegionFiles(root: str) -> list[str]:
+    """
+    Lists the terrain region files of every world and dimension under root.
+    """
+    paths = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        if os.path.basename(dir_path) == "region":
+            paths += [os.path.join(dir_path, name) for name in sorted(file_names) if name.endswith(".mca")]
+    return paths
+
+
+def AnalyzeWorld(root: str, min_inhabited_seconds: float = DEFAULT_MIN_INHABITED_SECONDS, prune: bool = False,
+                 workers: int | None = None) -> WorldReport:
+    """
+    Analyzes, and optionally prunes, every region file under root in parallel.
+
+    Args:
+        root (str): A world, or a directory of worlds such as a server directory.
+        min_inhabited_seconds (float): Chunks with less InhabitedTime than this are unvisited.
+        prune (bool): Remove the unvisited chunks.
+        workers (int | None): Processes to use, one per core by default.
+
+    Returns:
+        WorldReport: The report of every region file.
+    """
+    report = WorldReport(root, int(min_inhabited_seconds * TICKS_PER_SECOND), prune)
+    paths = FindRegionFiles(root)
+    analyze = partial(AnalyzeRegion, min_inhabited_ticks=report.min_inhabited_ticks, prune=prune)
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        report.regions = [analyze(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            report.regions = list(executor.map(analyze, paths, chunksize=max(1, len(paths) // (workers * 4))))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="A world, or a server directory with one or more worlds.")
+    parser.add_argument("--min-inhabited-seconds", type=float, default=DEFAULT_MIN_INHABITED_SECONDS,
+                        help="Chunks players spent less time near than this are unvisited.")
+    parser.add_argument("--prune", action="store_true", help="Remove the unvisited chunks.")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--json", metavar="PATH", help="Write the report of every region file to PATH.")
+    args = parser.parse_args()
+
+    report = AnalyzeWorld(args.root, args.min_inhabited_seconds, args.prune, args.workers)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(asdict(report), f, indent=2)
+    for region in report.regions:
+        if region.error is not None:
+            print(f"{region.path}: {region.error}")
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
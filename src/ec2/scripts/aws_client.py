@@ -0,0 +1,508 @@
+"""
+AWS Client
+Minimal in-process clients for the EC2 and S3 APIs, so the EC2 scripts do not have to start the AWS CLI
+for time sensitive work, and bulk transfers can run concurrently.
+
+On the instance, credentials and the region come from the instance role through IMDSv2.
+Requests are signed with SigV4, and blocking HTTP calls run on worker threads so the event loop stays responsive.
+
+Please refer to docs found here for API details:
+    - https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/instancedata-data-retrieval.html
+    - https://docs.aws.amazon.com/IAM/latest/UserGuide/reference_sigv-create-signed-request.html
+    - https://docs.aws.amazon.com/AWSEC2/latest/APIReference/API_StopInstances.html
+    - https://docs.aws.amazon.com/AmazonS3/latest/userguide/mpuoverview.html
+    - https://docs.aws.amazon.com/AmazonS3/latest/API/API_ListObjectsV2.html
+"""
+
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+from typing import Awaitable, BinaryIO, Callable, TypeVar
+import urllib.error
+import urllib.parse
+import urllib.request
+from xml.etree import ElementTree
+
+# Endpoints can be overridden to point at a local stub for testing
+IMDS_ENDPOINT = os.getenv("IMDS_ENDPOINT", "http://169.254.169.254")
+EC2_ENDPOINT = os.getenv("EC2_ENDPOINT")
+S3_ENDPOINT = os.getenv("S3_ENDPOINT")
+EC2_API_VERSION = "2016-11-15"
+
+IMDS_TOKEN_TTL_SECONDS = 21600
+REQUEST_TIMEOUT = 5.0
+# Uploads of large parts need longer than a metadata lookup
+TRANSFER_TIMEOUT = 120.0
+MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.25
+RETRY_MAX_DELAY = 4.0
+# Error codes EC2 and S3 return for requests that are safe to retry
+RETRYABLE_ERROR_CODES = {
+    "RequestLimitExceeded", "Throttling", "ThrottlingException", "InternalError", "Unavailable", "SlowDown",
+    "RequestTimeout",
+}
+
+
+class AWSRequestError(Exception):
+    """
+    Raised when an IMDS, EC2 or S3 request fails.
+    """
+    def __init__(self, message: str, status: int | None = None, retryable: bool = False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+@dataclass(frozen=True)
+class Credentials:
+    access_key_id: str
+    secret_access_key: str
+    session_token: str | None = None
+
+
+CredentialsProvider = Callable[[], Awaitable[Credentials]]
+T = TypeVar("T")
+
+
+def _http_request(method: str, url: str, headers: dict[str, str], body: bytes | None,
+                  timeout: float) -> tuple[int, dict[str, str], bytes]:
+    """
+    Sends a blocking HTTP request. Only ever called from a worker thread.
+
+    Returns:
+        tuple[int, dict[str, str], bytes]: The status code, headers and body of the response.
+    """
+    request = urllib.request.Request(url, data=body, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, {k.lower(): v for k, v in response.headers.items()}, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, {k.lower(): v for k, v in e.headers.items()}, e.read()
+    except (urllib.error.URLError, OSError) as e:
+        raise AWSRequestError(f"{method} {url} failed: {e}", retryable=True) from e
+
+
+def _http_stream(url: str, headers: dict[str, str], consume: Callable[[BinaryIO], T], timeout: float,
+                 description: str) -> T:
+    """
+    Sends a blocking GET request and passes the response body to consume as it arrives.
+    Only ever called from a worker thread.
+
+    Raises:
+        AWSRequestError: If the request fails or the connection drops while consume is reading.
+    """
+    request = urllib.request.Request(url, headers=headers, method="GET")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return consume(response)
+    except urllib.error.HTTPError as e:
+        _raise_for_status(description, e.code, e.read())
+    except (urllib.error.URLError, http.client.HTTPException, ConnectionError, TimeoutError) as e:
+        raise AWSRequestError(f"{description} failed: {e}", retryable=True) from e
+
+
+async def http_request(method: str, url: str, headers: dict[str, str], body: bytes | None = None,
+                       timeout: float = REQUEST_TIMEOUT) -> tuple[int, dict[str, str], bytes]:
+    return await asyncio.to_thread(_http_request, method, url, headers, body, timeout)
+
+
+async def with_retries(func, attempts: int = MAX_ATTEMPTS):
+    """
+    Calls an async function, retrying retryable failures with full jitter exponential backoff.
+
+    Args:
+        func: The async function to call.
+        attempts (int): The maximum number of calls.
+
+    Returns:
+        The result of the first successful call.
+    """
+    for attempt in range(attempts):
+        try:
+            return await func()
+        except AWSRequestError as e:
+            if not e.retryable or attempt == attempts - 1:
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            print(f"{e}, retrying in {delay:.2f}s...")
+            await asyncio.sleep(delay)
+
+
+def _error_code(body: bytes) -> str:
+    if b"<Code>" not in body:
+        return ""
+    return body.split(b"<Code>", 1)[1].split(b"</Code>", 1)[0].decode("utf-8", "replace")
+
+
+def _raise_for_status(description: str, status: int, body: bytes):
+    error_code = _error_code(body)
+    raise AWSRequestError(
+        f"{description} failed with status {status} {error_code}".rstrip(),
+        status,
+        retryable=status >= 500 or error_code in RETRYABLE_ERROR_CODES)
+
+
+class InstanceMetadata:
+    """
+    IMDSv2 client. The session token is fetched once and reused until it expires.
+    """
+    def __init__(self, endpoint: str = IMDS_ENDPOINT):
+        self.endpoint = endpoint.rstrip("/")
+        self._token: str | None = None
+        self._token_expires = 0.0
+
+    async def _get_token(self) -> str:
+        loop = asyncio.get_running_loop()
+        if self._token is None or loop.time() >= self._token_expires:
+            status, _, body = await http_request(
+                "PUT", f"{self.endpoint}/latest/api/token",
+                {"X-aws-ec2-metadata-token-ttl-seconds": str(IMDS_TOKEN_TTL_SECONDS)})
+            if status != 200:
+                raise AWSRequestError(f"IMDS token request failed with status {status}", status, status >= 500)
+            self._token = body.decode("utf-8")
+            # Refresh a minute early so the token never expires mid request
+            self._token_expires = loop.time() + IMDS_TOKEN_TTL_SECONDS - 60
+        return self._token
+
+    async def get(self, path: str) -> str:
+        """
+        Reads a metadata value.
+
+        Args:
+            path (str): The path below /latest/, e.g. "meta-data/instance-id".
+
+        Returns:
+            str: The value.
+        """
+        token = await self._get_token()
+        status, _, body = await http_request(
+            "GET", f"{self.endpoint}/latest/{path}", {"X-aws-ec2-metadata-token": token})
+        if status == 401:
+            # The token was rejected, fetch a new one on the next attempt
+            self._token = None
+            raise AWSRequestError("IMDS token was rejected", status, retryable=True)
+        if status != 200:
+            raise AWSRequestError(f"IMDS request for {path} failed with status {status}", status, status >= 500)
+        return body.decode("utf-8")
+
+    async def get_region(self) -> str:
+        return await self.get("meta-data/placement/region")
+
+    async def get_credentials(self) -> Credentials:
+        """
+        Reads the temporary credentials of the instance role.
+        """
+        role_name = (await self.get("meta-data/iam/security-credentials/")).splitlines()[0].strip()
+        data = json.loads(await self.get(f"meta-data/iam/security-credentials/{role_name}"))
+        return Credentials(data["AccessKeyId"], data["SecretAccessKey"], data.get("Token"))
+
+
+_cli_credentials: Credentials | None = None
+
+
+async def cli_credentials() -> Credentials:
+    """
+    Reads credentials from the AWS_* environment variables, or from the AWS CLI's login session.
+    Used when running off the instance, e.g. from ./destroy.py.
+
+    Raises:
+        AWSRequestError: If no credentials are available.
+    """
+    global _cli_credentials
+    if os.getenv("AWS_ACCESS_KEY_ID") and os.getenv("AWS_SECRET_ACCESS_KEY"):
+        return Credentials(os.environ["AWS_ACCESS_KEY_ID"], os.environ["AWS_SECRET_ACCESS_KEY"],
+                           os.getenv("AWS_SESSION_TOKEN"))
+
+    if _cli_credentials is None:
+        if shutil.which("aws") is None:
+            raise AWSRequestError("No AWS credentials found, the AWS CLI is not installed")
+        try:
+            result = await asyncio.to_thread(
+                subprocess.run, ["aws", "configure", "export-credentials", "--format", "process"],
+                capture_output=True, text=True, check=True)
+        except subprocess.CalledProcessError as e:
+            raise AWSRequestError(f"Could not export AWS CLI credentials: {e.stderr.strip()}") from e
+        data = json.loads(result.stdout)
+        _cli_credentials = Credentials(data["AccessKeyId"], data["SecretAccessKey"], data.get("SessionToken"))
+    return _cli_credentials
+
+
+def _hmac_sha256(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()
+
+
+def SignRequest(method: str, url: str, headers: dict[str, str], body: bytes, credentials: Credentials,
+                region: str, service: str, now: datetime | None = None) -> dict[str, str]:
+    """
+    Signs a request with AWS Signature Version 4.
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The full request URL, with the path already URI encoded.
+        headers (dict[str, str]): Headers to sign, in addition to host and x-amz-date.
+        body (bytes): The request body.
+        credentials (Credentials): The credentials to sign with.
+        region (str): The region of the endpoint.
+        service (str): The signing name of the service, e.g. "ec2".
+        now (datetime | None): The signing time, defaults to the current time.
+
+    Returns:
+        dict[str, str]: The headers to send, including the Authorization header.
+    """
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    date_stamp = now.strftime("%Y%m%d")
+    parsed = urllib.parse.urlsplit(url)
+
+    signed_headers = {key.lower(): value.strip() for key, value in headers.items()}
+    signed_headers["host"] = parsed.netloc
+    signed_headers["x-amz-date"] = amz_date
+    if credentials.session_token:
+        signed_headers["x-amz-security-token"] = credentials.session_token
+
+    query = urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)
+    canonical_query = "&".join(
+        f"{urllib.parse.quote(key, safe='-_.~')}={urllib.parse.quote(value, safe='-_.~')}"
+        for key, value in sorted(query))
+    header_names = sorted(signed_headers)
+    canonical_request = "\n".join([
+        method,
+        parsed.path or "/",
+        canonical_query,
+        "".join(f"{name}:{signed_headers[name]}\n" for name in header_names),
+        ";".join(header_names),
+        signed_headers.get("x-amz-content-sha256") or hashlib.sha256(body).hexdigest(),
+    ])
+
+    scope = f"{date_stamp}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256",
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+    ])
+
+    signing_key = _hmac_sha256(("AWS4" + credentials.secret_access_key).encode("utf-8"), date_stamp)
+    for part in (region, service, "aws4_request"):
+        signing_key = _hmac_sha256(signing_key, part)
+    signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    signed_headers["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={credentials.access_key_id}/{scope}, "
+        f"SignedHeaders={';'.join(header_names)}, Signature={signature}")
+    # urllib sets the Host header itself
+    del signed_headers["host"]
+    return signed_headers
+
+
+class EC2Client:
+    """
+    Calls the EC2 query API using the instance role's credentials.
+    """
+    def __init__(self, metadata: InstanceMetadata | None = None, endpoint: str | None = EC2_ENDPOINT):
+        self.metadata = metadata or InstanceMetadata()
+        self.endpoint = endpoint
+
+    async def call(self, action: str, params: dict[str, str]) -> bytes:
+        """
+        Calls an EC2 API action, retrying throttling and server errors.
+
+        Args:
+            action (str): The API action, e.g. "StopInstances".
+            params (dict[str, str]): The query parameters for the action.
+
+        Returns:
+            bytes: The XML response body.
+
+        Raises:
+            AWSRequestError: If the call fails.
+        """
+        region = os.getenv("AWS_REGION") or await with_retries(self.metadata.get_region)
+        endpoint = (self.endpoint or f"https://ec2.{region}.amazonaws.com").rstrip("/") + "/"
+        body = urllib.parse.urlencode({"Action": action, "Version": EC2_API_VERSION, **params}).encode("utf-8")
+
+        async def attempt() -> bytes:
+            # Role credentials rotate, so they are read fresh for every attempt
+            credentials = await self.metadata.get_credentials()
+            headers = SignRequest(
+                "POST", endpoint,
+                {"Content-Type": "application/x-www-form-urlencoded; charset=utf-8"},
+                body, credentials, region, "ec2")
+            status, _, response = await http_request("POST", endpoint, headers, body)
+            if status != 200:
+                _raise_for_status(f"EC2 {action}", status, response)
+            return response
+
+        return await with_retries(attempt)
+
+    async def stop_instances(self, instance_ids: list[str]) -> bytes:
+        return await self.call(
+            "StopInstances", {f"InstanceId.{index}": instance_id for index, instance_id in enumerate(instance_ids, 1)})
+
+
+class S3Client:
+    """
+    Calls the S3 REST API for a single bucket.
+    """
+    def __init__(self, bucket: str, region: str, credentials: CredentialsProvider,
+                 endpoint: str | None = S3_ENDPOINT):
+        self.bucket = bucket
+        self.region = region
+        self.credentials = credentials
+        # Custom endpoints (local stubs, S3 compatible stores) use path style addressing
+        if endpoint:
+            self.base_url = f"{endpoint.rstrip('/')}/{bucket}"
+        else:
+            self.base_url = f"https://{bucket}.s3.{region}.amazonaws.com"
+
+    def _url(self, key: str, query: dict[str, str] | None = None) -> str:
+        url = f"{self.base_url}/{urllib.parse.quote(key, safe='/-_.~')}"
+        if query:
+            url += "?" + urllib.parse.urlencode(query, quote_via=urllib.parse.quote)
+        return url
+
+    async def request(self, method: str, key: str, query: dict[str, str] | None = None, body: bytes = b"",
+                      headers: dict[str, str] | None = None, ok: tuple[int, ...] = (200,),
+                      ) -> tuple[int, dict[str, str], bytes]:
+        """
+        Sends a signed request for an object, retrying throttling and server errors.
+
+        Args:
+            method (str): The HTTP method.
+            key (str): The object key.
+            query (dict[str, str] | None): Query parameters.
+            body (bytes): The request body.
+            headers (dict[str, str] | None): Extra headers to send.
+            ok (tuple[int, ...]): Status codes that count as success.
+
+        Returns:
+            tuple[int, dict[str, str], bytes]: The status, headers and body of the response.
+
+        Raises:
+            AWSRequestError: If the request fails.
+        """
+        url = self._url(key, query)
+        payload_hash = hashlib.sha256(body).hexdigest()
+
+        async def attempt():
+            credentials = await self.credentials()
+            signed = SignRequest(method, url, {**(headers or {}), "x-amz-content-sha256": payload_hash},
+                                 body, credentials, self.region, "s3")
+            status, response_headers, response = await http_request(
+                method, url, signed, body if method in ("PUT", "POST") else None, TRANSFER_TIMEOUT)
+            if status not in ok:
+                _raise_for_status(f"S3 {method} {key}", status, response)
+            return status, response_headers, response
+
+        return await with_retries(attempt)
+
+    async def put_object(self, key: str, body: bytes):
+        await self.request("PUT", key, body=body)
+
+    async def get_object(self, key: str, byte_range: tuple[int, int] | None = None) -> bytes | None:
+        """
+        Reads an object, or part of one.
+
+        Args:
+            key (str): The object key.
+            byte_range (tuple[int, int] | None): The (offset, length) to read, defaults to the whole object.
+
+        Returns:
+            bytes | None: The object data, or None if the object does not exist.
+        """
+        headers = {}
+        if byte_range is not None:
+            offset, length = byte_range
+            headers["Range"] = f"bytes={offset}-{offset + length - 1}"
+        status, _, body = await self.request("GET", key, headers=headers, ok=(200, 206, 404))
+        return None if status == 404 else body
+
+    async def stream_object(self, key: str, consume: Callable[[BinaryIO], T]) -> T:
+        """
+        Reads an object without holding it in memory. consume runs on a worker thread and reads the
+        body from the response as it arrives. If the download fails it is retried from the start,
+        so consume is called again with a fresh response.
+
+        Args:
+            key (str): The object key.
+            consume (Callable[[BinaryIO], T]): Reads the object data.
+
+        Returns:
+            T: The result of consume.
+
+        Raises:
+            AWSRequestError: If the object does not exist or the download fails.
+        """
+        url = self._url(key)
+
+        async def attempt():
+            credentials = await self.credentials()
+            signed = SignRequest("GET", url, {"x-amz-content-sha256": hashlib.sha256(b"").hexdigest()}, b"",
+                                 credentials, self.region, "s3")
+            return await asyncio.to_thread(_http_stream, url, signed, consume, TRANSFER_TIMEOUT, f"S3 GET {key}")
+
+        return await with_retries(attempt)
+
+    async def list_objects(self, prefix: str) -> list[str]:
+        """
+        Lists the keys of every object below a prefix.
+        """
+        keys = []
+        query = {"list-type": "2", "prefix": prefix}
+        while True:
+            # The bucket itself is addressed with an empty key
+            _, _, body = await self.request("GET", "", query=query)
+            root = ElementTree.fromstring(body)
+            for element in root.iter():
+                if element.tag == "Key" or element.tag.endswith("}Key"):
+                    keys.append(element.text or "")
+            token = [element.text for element in root.iter() if element.tag.endswith("NextContinuationToken")]
+            if not token:
+                return keys
+            query["continuation-token"] = token[0]
+
+    async def delete_object(self, key: str):
+        await self.request("DELETE", key, ok=(200, 204, 404))
+
+    async def create_multipart_upload(self, key: str) -> str:
+        _, _, body = await self.request("POST", key, query={"uploads": ""})
+        return _find_xml_text(body, "UploadId")
+
+    async def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        """
+        Uploads one part of a multipart upload.
+
+        Returns:
+            str: The ETag of the part, needed to complete the upload.
+        """
+        _, headers, _ = await self.request(
+            "PUT", key, query={"partNumber": str(part_number), "uploadId": upload_id}, body=data)
+        return headers.get("etag", "")
+
+    async def complete_multipart_upload(self, key: str, upload_id: str, etags: list[str]):
+        parts = "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+            for number, etag in enumerate(etags, 1))
+        body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode("utf-8")
+        _, _, response = await self.request("POST", key, query={"uploadId": upload_id}, body=body)
+        # S3 can report a failure in the body of a 200 response
+        if b"<Error>" in response:
+            _raise_for_status(f"S3 complete multipart upload {key}", 500, response)
+
+    async def abort_multipart_upload(self, key: str, upload_id: str):
+        await self.request("DELETE", key, query={"uploadId": upload_id}, ok=(200, 204, 404))
+
+
+def _find_xml_text(body: bytes, tag: str) -> str:
+    for element in ElementTree.fromstring(body).iter():
+        if element.tag == tag or element.tag.endswith("}" + tag):
+            return element.text or ""
+    raise AWSRequestError(f"Response is missing {tag}")
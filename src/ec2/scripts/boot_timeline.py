@@ -0,0 +1,191 @@
+"""
+Boot Timeline
+Records how long each step between the instance booting and players being able to join took, so changes
+to the AMI, JVM flags or instance type can be measured.
+
+Every time is in seconds since the kernel booted (CLOCK_BOOTTIME, the clock behind /proc/uptime, which
+./start-server.sh reads), so the times taken by the shell script and by the stop script line up, and
+everything before the service started is the instance boot. The phases of each server are:
+    spawned: ./start-server.sh started the server.
+    first_accept: The game port first accepted a TCP connection.
+    first_status: The server first answered a status ping.
+    done: The server logged "Done (Xs)!", X is kept as the startup time the server reported.
+
+The timeline of each session is appended as one JSON line to a history file, and can be published with the
+status snapshot, see ./status_snapshot.py.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import json
+import os
+import time
+
+from log_watch import LogTail, PlayerTracker
+from minecraft_protocol import query_status
+
+TIMELINE_VERSION = 1
+PROBE_INTERVAL = 0.25
+PROBE_TIMEOUT = 2.0
+# Servers that are not up after this long are left to the idle detector, their timeline stays incomplete
+STARTUP_TIMEOUT = 900.0
+
+
+def BootClock() -> float:
+    """
+    Returns:
+        float: Seconds since the kernel booted.
+    """
+    return time.clock_gettime(time.CLOCK_BOOTTIME)
+
+
+def ParseBootTimes(value: str) -> dict[str, float]:
+    """
+    Parses the spawn times ./start-server.sh passes as "<name>=<seconds> <name>=<seconds> ...".
+    """
+    times = {}
+    for item in value.split():
+        name, separator, seconds = item.partition("=")
+        try:
+            if separator:
+                times[name] = float(seconds)
+        except ValueError:
+            pass
+    return times
+
+
+@dataclass
+class ServerTimeline:
+    spawned: float | None = None
+    first_accept: float | None = None
+    first_status: float | None = None
+    done: float | None = None
+    # The startup time in the server's "Done (Xs)!" line
+    reported_startup: float | None = None
+
+
+class BootTimeline:
+    """
+    The timeline of one session on the instance, see the module docstring.
+    """
+    def __init__(self, service_start: float | None = None, spawn_times: dict[str, float] | None = None):
+        self.booted_at = time.time() - BootClock()
+        self.service_start = service_start
+        self.monitor_start = BootClock()
+        self.servers: dict[str, ServerTimeline] = {}
+        for name, spawned in (spawn_times or {}).items():
+            self.servers[name] = ServerTimeline(spawned=spawned)
+
+    def mark(self, profile: str, phase: str, at: float | None = None) -> bool:
+        """
+        Records when a server reached a phase. Only the first time is kept.
+
+        Returns:
+            bool: True if the phase was not recorded before.
+        """
+        server = self.servers.setdefault(profile, ServerTimeline())
+        if getattr(server, phase) is not None:
+            return False
+        setattr(server, phase, BootClock() if at is None else at)
+        return True
+
+    def to_dict(self) -> dict:
+        """
+        Returns:
+            dict: The timeline, keys are camel case to match the status snapshot.
+        """
+        return {
+            "version": TIMELINE_VERSION,
+            "bootedAt": self.booted_at,
+            "serviceStart": self.service_start,
+            "monitorStart": self.monitor_start,
+            "servers": {
+                name: {
+                    "spawned": server.spawned,
+                    "firstAccept": server.first_accept,
+                    "firstStatus": server.first_status,
+                    "done": server.done,
+                    "reportedStartup": server.reported_startup,
+                }
+                for name, server in sorted(self.servers.items())
+            },
+        }
+
+
+async def _probe_port(timeline: BootTimeline, profile: str, host: str, port: int, probe_interval: float):
+    server = timeline.servers.setdefault(profile, ServerTimeline())
+    while server.first_accept is None:
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), PROBE_TIMEOUT)
+        except (OSError, asyncio.TimeoutError):
+            await asyncio.sleep(probe_interval)
+            continue
+        timeline.mark(profile, "first_accept")
+        writer.close()
+        await writer.wait_closed()
+
+    while server.first_status is None:
+        try:
+            await query_status(host, port, PROBE_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            await asyncio.sleep(probe_interval)
+            continue
+        timeline.mark(profile, "first_status")
+
+
+async def _follow_log(timeline: BootTimeline, profile: str, log_path: str, not_before: float):
+    tracker = PlayerTracker()
+    async with LogTail(log_path) as tail:
+        lines = tail.read_available()
+        try:
+            # The log left by the last session is only rotated once the server starts logging
+            stale = os.stat(log_path).st_mtime < not_before
+        except FileNotFoundError:
+            stale = False
+        if stale:
+            lines = []
+        while True:
+            for line in lines:
+                if tracker.feed(line) == ("started", "") and timeline.mark(profile, "done"):
+                    timeline.servers[profile].reported_startup = tracker.startup_seconds
+                    return
+            lines = await tail.read_lines(60.0)
+
+
+async def WatchServerStartup(timeline: BootTimeline, profile: str, host: str, port: int, log_path: str,
+                             timeout: float = STARTUP_TIMEOUT, probe_interval: float = PROBE_INTERVAL) -> bool:
+    """
+    Records when a server first accepts connections, answers status pings and logs that it is done.
+
+    Args:
+        timeline (BootTimeline): The timeline to record to.
+        profile (str): The profile name of the server.
+        host (str): The host to probe.
+        port (int): The game port.
+        log_path (str): The server's logs/latest.log.
+        timeout (float): Seconds to wait for the server to start.
+        probe_interval (float): Seconds between connection attempts.
+
+    Returns:
+        bool: True if every phase was recorded in time.
+    """
+    spawned = timeline.servers.setdefault(profile, ServerTimeline()).spawned
+    not_before = timeline.booted_at + (spawned if spawned is not None else timeline.monitor_start)
+    watchers = [asyncio.create_task(_probe_port(timeline, profile, host, port, probe_interval)),
+                asyncio.create_task(_follow_log(timeline, profile, log_path, not_before))]
+    try:
+        _, pending = await asyncio.wait(watchers, timeout=timeout)
+    finally:
+        for watcher in watchers:
+            watcher.cancel()
+        await asyncio.gather(*watchers, return_exceptions=True)
+    return not pending
+
+
+def AppendTimelineHistory(path: str, record: dict):
+    """
+    Appends a timeline to the history file, one compact JSON document per line.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record, separators=(",", ":")) + "\n")
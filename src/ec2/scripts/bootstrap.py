@@ -0,0 +1,446 @@
+"""
+Minecraft Instance Bootstrap
+Sets up a fresh instance on its first boot, run by terraform/user_data.sh.
+
+The EC2 scripts, the systemd unit that starts the server and the server profile are all fetched from
+S3_BUCKET at once, while apt-get refreshes the package index of the fresh AMI. The profile zip is extracted
+as it downloads, without writing a copy of it to disk, and its ./install-java.sh is started as soon as it has
+been extracted and the package index is ready, so Java installs while the rest of the profile is still
+arriving. The service is only started once the install succeeded.
+
+The time every step took is printed at the end and written to bootstrap-timings.json in MINECRAFT_DIR.
+Like the other scripts, the endpoints can be pointed at a local stand-in with IMDS_ENDPOINT and S3_ENDPOINT,
+and BOOTSTRAP_SYSTEM=0 skips the steps that change the system (the user account, ownership and systemd),
+see ./benchmarks/bench_bootstrap.py.
+"""
+
+import asyncio
+from contextlib import contextmanager
+import json
+import os
+import secrets
+import struct
+import subprocess
+import time
+from typing import BinaryIO, Callable
+import zlib
+
+from aws_client import InstanceMetadata, S3Client, with_retries
+
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+MINECRAFT_DIR = os.getenv("MINECRAFT_DIR", "/opt/minecraft")
+PROFILE_NAME = os.getenv("DEFAULT_PROFILE_NAME", "DefaultMinecraftProfile")
+SYSTEMD_DIR = os.getenv("SYSTEMD_DIR", "/etc/systemd/system")
+USERNAME = os.getenv("MINECRAFT_USER", "minecraft")
+# Set to 1 by the WorldRamDisk terraform variable, passed on to ./start-server.sh
+WORLD_RAM_DISK = os.getenv("WORLD_RAM_DISK", "0")
+# Set to 1 by the WakeProxy terraform variable, the server moves WAKE_PROXY_PORT_OFFSET above its public port
+# so the proxy can take it, see wake_proxy.py
+WAKE_PROXY = os.getenv("WAKE_PROXY", "0")
+WAKE_PROXY_PORT_OFFSET = int(os.getenv("WAKE_PROXY_PORT_OFFSET", "10000"))
+DEFAULT_SERVER_PORT = 25565
+# Set to 0 to only fetch and configure the files, e.g. when testing against a local stand-in
+BOOTSTRAP_SYSTEM = os.getenv("BOOTSTRAP_SYSTEM", "1") != "0"
+SERVICE_NAME = "start-minecraft.service"
+RCON_PORT = 25575
+DOWNLOAD_CONCURRENCY = 8
+CHUNK_SIZE = 1024 * 1024
+
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+CENTRAL_DIRECTORY_SIGNATURE = b"PK\x01\x02"
+END_OF_CENTRAL_DIRECTORY_SIGNATURE = b"PK\x05\x06"
+FLAG_ENCRYPTED = 0x1
+FLAG_DATA_DESCRIPTOR = 0x8
+FLAG_UTF8 = 0x800
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+
+
+class StepTimer:
+    """
+    Records when each bootstrap step started and finished. Steps can overlap and can be timed from
+    worker threads.
+    """
+    def __init__(self):
+        self.start = time.monotonic()
+        self.steps: dict[str, list[float | None]] = {}
+
+    def begin(self, name: str):
+        self.steps[name] = [time.monotonic() - self.start, None]
+        print(f"[{name}] started", flush=True)
+
+    def end(self, name: str):
+        self.steps[name][1] = time.monotonic() - self.start
+        print(f"[{name}] finished in {self.steps[name][1] - self.steps[name][0]:.2f}s", flush=True)
+
+    @contextmanager
+    def step(self, name: str):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def report(self) -> dict:
+        """
+        Returns:
+            dict: The total wall clock time, and the start, end and duration of every step in seconds.
+        """
+        return {
+            "total_seconds": time.monotonic() - self.start,
+            "steps": {
+                name: {"start": start, "end": end, "seconds": end - start}
+                for name, (start, end) in sorted(self.steps.items(), key=lambda item: item[1][0])
+                if end is not None
+            },
+        }
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError("Zip stream ended unexpectedly")
+        data += chunk
+    return data
+
+
+def ExtractZipStream(stream: BinaryIO, dest: str, on_file: Callable[[str, str], None] | None = None) -> int:
+    """
+    Extracts a zip in a single pass as it is read, using the local header in front of each entry.
+    This works for the archives built by ./profile_archive.py, which record the size of every entry
+    up front. File modes are only stored in the central directory at the end of the zip, so they are
+    not restored.
+
+    Args:
+        stream (BinaryIO): The zip data.
+        dest (str): The directory to extract into.
+        on_file (Callable[[str, str], None] | None): Called with the name and path of each file once it
+            has been written.
+
+    Returns:
+        int: The number of files extracted.
+
+    Raises:
+        ValueError: If the zip is malformed, or can not be read without seeking.
+    """
+    dest = os.path.realpath(dest)
+    files = 0
+    while True:
+        signature = _read_exactly(stream, 4)
+        if signature in (CENTRAL_DIRECTORY_SIGNATURE, END_OF_CENTRAL_DIRECTORY_SIGNATURE):
+            return files
+        if signature != LOCAL_HEADER_SIGNATURE:
+            raise ValueError(f"Unexpected zip record {signature!r}")
+
+        _, flags, method, _, _, crc, compressed_size, size, name_length, extra_length = struct.unpack(
+            "<HHHHHIIIHH", _read_exactly(stream, 26))
+        raw_name = _read_exactly(stream, name_length)
+        name = raw_name.decode("utf-8" if flags & FLAG_UTF8 else "cp437")
+        extra = _read_exactly(stream, extra_length)
+        if flags & (FLAG_ENCRYPTED | FLAG_DATA_DESCRIPTOR):
+            raise ValueError(f"{name} is encrypted or its size is not in its local header")
+        if method not in (METHOD_STORED, METHOD_DEFLATED):
+            raise ValueError(f"{name} uses unsupported compression method {method}")
+        if size == ZIP64_LIMIT or compressed_size == ZIP64_LIMIT:
+            offset = 0
+            while offset + 4 <= len(extra):
+                field_id, field_size = struct.unpack_from("<HH", extra, offset)
+                if field_id == 1:
+                    size, compressed_size = struct.unpack_from("<QQ", extra, offset + 4)
+                    break
+                offset += 4 + field_size
+
+        path = os.path.realpath(os.path.join(dest, name))
+        if not path.startswith(dest + os.sep):
+            raise ValueError(f"{name} would be extracted outside of {dest}")
+        if name.endswith("/"):
+            os.makedirs(path, exist_ok=True)
+            _read_exactly(stream, compressed_size)
+            continue
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if method == METHOD_DEFLATED else None
+        remaining = compressed_size
+        written = 0
+        checksum = 0
+        with open(path, "wb") as f:
+            while remaining:
+                chunk = _read_exactly(stream, min(remaining, CHUNK_SIZE))
+                remaining -= len(chunk)
+                if decompressor is not None:
+                    chunk = decompressor.decompress(chunk)
+                checksum = zlib.crc32(chunk, checksum)
+                written += len(chunk)
+                f.write(chunk)
+            if decompressor is not None:
+                chunk = decompressor.flush()
+                checksum = zlib.crc32(chunk, checksum)
+                written += len(chunk)
+                f.write(chunk)
+        if written != size or checksum != crc:
+            raise ValueError(f"{name} is corrupt")
+        files += 1
+        if on_file is not None:
+            on_file(name, path)
+
+
+def UpdateServerProperties(path: str, updates: dict[str, str]):
+    """
+    Sets properties in a server.properties file, keeping the other lines as they are.
+    Properties that are missing are appended, and the file is created if it does not exist yet.
+    """
+    lines = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    remaining = dict(updates)
+    for index, line in enumerate(lines):
+        key = line.partition("=")[0].strip()
+        if not line.lstrip().startswith(("#", "!")) and key in remaining:
+            lines[index] = f"{key}={remaining.pop(key)}"
+    lines.extend(f"{key}={value}" for key, value in remaining.items())
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def ReadServerProperty(path: str, key: str) -> str | None:
+    """
+    Returns:
+        str | None: The value of a property in a server.properties file, None if it is not set.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                name, separator, value = line.partition("=")
+                if separator and not line.lstrip().startswith(("#", "!")) and name.strip() == key:
+                    return value.strip()
+    except OSError:
+        pass
+    return None
+
+
+async def run_command(args: list[str], check: bool = True) -> int:
+    process = await asyncio.create_subprocess_exec(*args)
+    returncode = await process.wait()
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
+    return returncode
+
+
+class Bootstrap:
+    """
+    Runs the first boot setup, see the module docstring.
+    """
+    def __init__(self, client: S3Client, minecraft_dir: str = MINECRAFT_DIR, profile_name: str = PROFILE_NAME,
+                 systemd_dir: str = SYSTEMD_DIR, system: bool = BOOTSTRAP_SYSTEM):
+        self.client = client
+        self.minecraft_dir = minecraft_dir
+        self.profile_name = profile_name
+        self.systemd_dir = systemd_dir
+        self.system = system
+        self.profiles_dir = os.path.join(minecraft_dir, "profiles")
+        self.servers_dir = os.path.join(minecraft_dir, "servers")
+        self.scripts_dir = os.path.join(minecraft_dir, "scripts")
+        self.server_dir = os.path.join(self.servers_dir, profile_name)
+        self.timer = StepTimer()
+        self.java_install: asyncio.subprocess.Process | None = None
+        # Resolved with the path of install-java.sh once it is extracted, or None if the profile has none
+        self._java_script: asyncio.Future | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._downloads = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+    async def download(self, key: str, path: str, mode: int = 0o755):
+        async with self._downloads:
+            data = await self.client.get_object(key)
+        if data is None:
+            raise FileNotFoundError(f"s3://{self.client.bucket}/{key} does not exist")
+        with open(path, "wb") as f:
+            f.write(data)
+        os.chmod(path, mode)
+
+    async def create_user(self):
+        with self.timer.step("create-user"):
+            await run_command(["groupadd", "-r", USERNAME], check=False)
+            await run_command(["useradd", "-r", "-d", self.minecraft_dir, "-g", USERNAME, "-s", "/bin/bash",
+                               USERNAME], check=False)
+
+    async def fetch_scripts(self):
+        with self.timer.step("fetch-scripts"):
+            keys = await self.client.list_objects("scripts/")
+            await asyncio.gather(*(
+                self.download(key, os.path.join(self.scripts_dir, os.path.basename(key)))
+                for key in keys if not key.endswith("/")))
+
+    async def fetch_service(self):
+        with self.timer.step("fetch-service"):
+            await self.download(f"services/{SERVICE_NAME}", os.path.join(self.systemd_dir, SERVICE_NAME), 0o644)
+
+    async def update_packages(self):
+        with self.timer.step("apt-update"):
+            # Not fatal by itself, an install-java.sh that needs the index fails on its own
+            returncode = await run_command(["apt-get", "update", "-y"], check=False)
+        if returncode != 0:
+            print(f"apt-get update exited with status {returncode}")
+
+    def _found_install_script(self, name: str, path: str):
+        # Called on the extraction thread, and again if the download is retried
+        if name != "install-java.sh":
+            return
+        os.chmod(path, 0o755)
+        self._loop.call_soon_threadsafe(self._set_java_script, path)
+
+    def _set_java_script(self, path: str | None):
+        if not self._java_script.done():
+            self._java_script.set_result(path)
+
+    async def fetch_profile(self):
+        with self.timer.step("fetch-profile"):
+            files = await self.client.stream_object(
+                f"profiles/{self.profile_name}.zip",
+                lambda stream: ExtractZipStream(stream, self.server_dir, self._found_install_script))
+            print(f"Extracted {files} files to {self.server_dir}")
+        # Callbacks from the extraction thread run first, this only settles a profile without the script
+        self._loop.call_soon(self._set_java_script, None)
+
+    async def install_java(self, package_index: asyncio.Task | None = None):
+        """
+        Runs the profile's install-java.sh as soon as it is extracted and the package index is up to date.
+
+        Args:
+            package_index (asyncio.Task | None): The running update_packages step, if any.
+
+        Raises:
+            subprocess.CalledProcessError: If install-java.sh fails.
+        """
+        install_script = await self._java_script
+        if install_script is None:
+            print(f"{os.path.join(self.server_dir, 'install-java.sh')} not found, skipping the Java install.")
+            return
+        if package_index is not None:
+            await package_index
+        with self.timer.step("install-java"):
+            self.java_install = await asyncio.create_subprocess_exec(install_script, cwd=self.server_dir)
+            returncode = await self.java_install.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, [install_script])
+
+    def configure(self):
+        with self.timer.step("configure"):
+            rcon_secret = secrets.token_hex(16)
+            start_script = os.path.join(self.server_dir, "start-server.sh")
+            if os.path.exists(start_script):
+                os.chmod(start_script, 0o755)
+            properties_path = os.path.join(self.server_dir, "server.properties")
+            properties = {
+                "rcon.password": rcon_secret,
+                "enable-rcon": "true",
+                "rcon.port": str(RCON_PORT),
+                # Lets stop-server.py count players with a single datagram, the security group keeps it local
+                "enable-query": "true",
+            }
+            if WAKE_PROXY == "1":
+                public_port = int(ReadServerProperty(properties_path, "server-port") or DEFAULT_SERVER_PORT)
+                properties["server-port"] = str(public_port + WAKE_PROXY_PORT_OFFSET)
+            UpdateServerProperties(properties_path, properties)
+            # Sourced by ./start-server.sh
+            with open(os.path.join(self.minecraft_dir, "env-vars.sh"), "w") as f:
+                f.write(f"""
+#! /bin/bash
+export S3_BUCKET={self.client.bucket}
+export MINECRAFT_DIR={self.minecraft_dir}
+export MINECRAFT_PROFILES_DIR={self.profiles_dir}
+export MINECRAFT_SERVERS_DIR={self.servers_dir}
+export MINECRAFT_SCRIPTS_DIR={self.scripts_dir}
+export DEFAULT_PROFILE_NAME={self.profile_name}
+# Space separated profiles in MINECRAFT_SERVERS_DIR to run side by side, each needs its own ports
+export MINECRAFT_PROFILES={self.profile_name}
+export START_SCRIPT={start_script}
+export STOP_SCRIPT={os.path.join(self.scripts_dir, "stop-server.py")}
+export SERVER_JAR={os.path.join(self.server_dir, "server.jar")}
+export RCON_SECRET={rcon_secret}
+# Run each world from RAM when it fits, see ram_disk.py
+export WORLD_RAM_DISK={WORLD_RAM_DISK}
+# Answer on each server's public port while it starts, see wake_proxy.py
+export WAKE_PROXY={WAKE_PROXY}
+export WAKE_PROXY_PORT_OFFSET={WAKE_PROXY_PORT_OFFSET}
+""")
+
+    async def set_permissions(self):
+        with self.timer.step("set-permissions"):
+            await run_command(["chown", "-R", f"{USERNAME}:{USERNAME}", self.minecraft_dir])
+            await run_command(["chmod", "-R", "755", self.minecraft_dir])
+
+    async def start_service(self):
+        with self.timer.step("start-service"):
+            await run_command(["systemctl", "daemon-reload"])
+            await run_command(["systemctl", "enable", "--now", SERVICE_NAME])
+
+    async def run(self) -> dict:
+        """
+        Runs every step, overlapping the ones that do not depend on each other.
+
+        Returns:
+            dict: The timing report, see StepTimer.report.
+        """
+        for directory in (self.profiles_dir, self.servers_dir, self.scripts_dir, self.server_dir,
+                          self.systemd_dir):
+            os.makedirs(directory, exist_ok=True)
+
+        self._loop = asyncio.get_running_loop()
+        self._java_script = self._loop.create_future()
+        package_index = asyncio.create_task(self.update_packages()) if self.system else None
+        java = asyncio.create_task(self.install_java(package_index))
+        fetches = [self.fetch_scripts(), self.fetch_service(), self.fetch_profile()]
+        if self.system:
+            fetches.append(self.create_user())
+
+        async def prepare():
+            await asyncio.gather(*fetches)
+            self.configure()
+            if self.system:
+                await self.set_permissions()
+
+        try:
+            # Without Java the service would only fail to start, so a failed install stops the bootstrap here
+            await asyncio.gather(java, prepare())
+        except BaseException:
+            for task in (java, package_index):
+                if task is not None:
+                    task.cancel()
+            if self.java_install is not None and self.java_install.returncode is None:
+                self.java_install.kill()
+            raise
+        if self.system:
+            await self.start_service()
+
+        report = self.timer.report()
+        with open(os.path.join(self.minecraft_dir, "bootstrap-timings.json"), "w") as f:
+            json.dump(report, f, indent=2)
+        return report
+
+
+async def main():
+    if not S3_BUCKET:
+        raise SystemExit("S3_BUCKET is not set.")
+    metadata = InstanceMetadata()
+    region = os.getenv("AWS_REGION") or await with_retries(metadata.get_region)
+    bootstrap = Bootstrap(S3Client(S3_BUCKET, region, metadata.get_credentials))
+    try:
+        report = await bootstrap.run()
+    except subprocess.CalledProcessError as e:
+        raise SystemExit(f"{e.cmd[0]} exited with status {e.returncode}, the server was not started.")
+
+    print("-" * 44)
+    print(f"{'Step':<18} {'Start':>7} {'End':>7} {'Time':>7}")
+    print("-" * 44)
+    for name, step in report["steps"].items():
+        print(f"{name:<18} {step['start']:>6.1f}s {step['end']:>6.1f}s {step['seconds']:>6.1f}s")
+    print("-" * 44)
+    print(f"Bootstrap finished in {report['total_seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,190 @@
+"""
+Idle Scheduler
+Decides how often the stop script probes the player count and when the server counts as idle.
+
+Probes are frequent while the player count is falling towards zero and back off while the server is busy.
+The gap between probes may grow the more players are online, as all of them have to leave before the
+server is empty: with one player it is at most player_interval, and it doubles with each further player.
+The server is only considered idle after several consecutive empty samples spanning the idle window,
+so a single empty sample during a reconnect does not stop the server. The empty samples are spread
+evenly across the window, as more of them would not stop the server any sooner.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import os
+import time
+from typing import Callable
+
+
+class SystemClock:
+    """
+    Clock backed by the monotonic system clock and the running event loop.
+    """
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+
+class SimulatedClock:
+    """
+    Deterministic clock for testing and benchmarking. Sleeping advances time instantly.
+    """
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+    async def sleep(self, seconds: float):
+        self.advance(seconds)
+        # Still yield so other tasks on the loop get a turn, as they would with a real sleep
+        await asyncio.sleep(0)
+
+
+@dataclass(frozen=True)
+class IdlePolicy:
+    """
+    Settings for the idle scheduler.
+
+    Attributes:
+        min_interval (float): Shortest gap between probes, used after a failed probe.
+        player_interval (float): Longest gap between probes while a single player is online,
+            doubled for each further player.
+        max_interval (float): Longest gap between probes however many players are online.
+        backoff (float): Factor the interval grows by while the player count is steady or rising.
+        idle_samples (int): Consecutive empty samples required before the server is idle.
+        idle_window (float): Seconds the server must be seen empty before it is idle.
+        startup_grace (float): Seconds after the scheduler starts before the server can be idle,
+            giving players time to join a freshly started server.
+    """
+    min_interval: float = 15.0
+    player_interval: float = 120.0
+    max_interval: float = 900.0
+    backoff: float = 2.0
+    idle_samples: int = 3
+    idle_window: float = 60.0
+    startup_grace: float = 180.0
+
+    @classmethod
+    def from_env(cls) -> "IdlePolicy":
+        """
+        Builds the policy from the stop script's environment variables.
+        """
+        player_interval = float(os.getenv("PLAYER_CHECK_INTERVAL", "120"))
+        return cls(
+            min_interval=min(float(os.getenv("PLAYER_CHECK_MIN_INTERVAL", "15")), player_interval),
+            player_interval=player_interval,
+            max_interval=max(float(os.getenv("PLAYER_CHECK_MAX_INTERVAL", "900")), player_interval),
+            idle_samples=max(1, int(os.getenv("IDLE_SAMPLES", "3"))),
+            idle_window=float(os.getenv("IDLE_WINDOW", "60")),
+            startup_grace=float(os.getenv("STARTUP_GRACE_PERIOD", "180")))
+
+
+class IdleScheduler:
+    """
+    Tracks player count samples and decides when to probe next and when the server is idle.
+    """
+    def __init__(self, policy: IdlePolicy, clock: SystemClock | SimulatedClock):
+        self.policy = policy
+        self.clock = clock
+        self.started = clock.monotonic()
+        self.interval = policy.max_interval
+        self.samples = 0
+        self.last_players: int | None = None
+        self.zero_samples = 0
+        self.first_zero_at: float | None = None
+
+    def next_interval(self) -> float:
+        """
+        Returns:
+            float: Seconds to wait before the next probe.
+        """
+        # The very first probe happens once the startup grace period is over
+        if self.samples == 0:
+            return max(self.policy.startup_grace - (self.clock.monotonic() - self.started), 0.0)
+        return self.interval
+
+    def record(self, players: int | None):
+        """
+        Records the result of a probe.
+
+        Args:
+            players (int | None): The number of players online, or None if the probe failed.
+        """
+        policy = self.policy
+        self.samples += 1
+        if players is None:
+            # An unanswered probe says nothing about the players, check again soon without touching the idle streak
+            self.interval = policy.min_interval
+            return
+
+        if players == 0:
+            if self.zero_samples == 0:
+                self.first_zero_at = self.clock.monotonic()
+            self.zero_samples += 1
+            # Spaced so the last of the idle samples lands as the idle window closes
+            self.interval = max(policy.min_interval, policy.idle_window / max(policy.idle_samples - 1, 1))
+        else:
+            self.zero_samples = 0
+            self.first_zero_at = None
+            if self.last_players is not None and players < self.last_players:
+                self.interval = max(policy.min_interval, self.interval / policy.backoff)
+            else:
+                self.interval = min(policy.max_interval, self.interval * policy.backoff)
+            # The fewer players remain, the sooner the server may empty, so the gap is capped accordingly
+            self.interval = min(self.interval, policy.player_interval * 2 ** (players - 1), policy.max_interval)
+        self.last_players = players
+
+    def is_idle(self) -> bool:
+        """
+        Returns:
+            bool: True once the server has been empty for the whole idle window.
+        """
+        now = self.clock.monotonic()
+        return (self.zero_samples >= self.policy.idle_samples
+                and now - self.first_zero_at >= self.policy.idle_window
+                and now - self.started >= self.policy.startup_grace)
+
+
+@dataclass
+class SimulationResult:
+    """
+    Outcome of running a policy against a player count trace.
+
+    Attributes:
+        stopped_at (float | None): When the scheduler declared the server idle, or None if it never did.
+        probes (int): The number of probes sent.
+    """
+    stopped_at: float | None
+    probes: int
+
+
+def simulate(policy: IdlePolicy, players_at: Callable[[float], int | None], duration: float) -> SimulationResult:
+    """
+    Runs a policy against a player count trace on a simulated clock.
+
+    Args:
+        policy (IdlePolicy): The policy to simulate.
+        players_at (Callable[[float], int | None]): Returns the players online at a given time, or None
+            if a probe at that time would fail.
+        duration (float): Seconds to simulate before giving up.
+
+    Returns:
+        SimulationResult: When the server was stopped and how many probes it took.
+    """
+    clock = SimulatedClock()
+    scheduler = IdleScheduler(policy, clock)
+    probes = 0
+    while clock.now < duration:
+        clock.advance(scheduler.next_interval())
+        probes += 1
+        scheduler.record(players_at(clock.now))
+        if scheduler.is_idle():
+            return SimulationResult(clock.now, probes)
+    return SimulationResult(None, probes)
@@ -0,0 +1,274 @@
+"""
+Log Watch
+Follows a Minecraft server's logs/latest.log as it is written and keeps track of the players online from
+its join and leave lines, so the stop script hears about the last player leaving the moment it happens.
+
+The logs directory is watched with inotify, so the tail only wakes when the server writes a line. Where
+inotify is not available the file is polled instead. The log is rotated at startup and at midnight by
+renaming latest.log and starting a new one: the rest of the old file is read before the new one is
+opened, so no line is lost. A log truncated in place is read again from the start.
+
+Only lines written by the server thread are parsed, and player names must be valid Minecraft names, so
+chat messages can not pass for a join or a leave.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+from dataclasses import dataclass, field
+import os
+import re
+
+POLL_INTERVAL = 1.0
+READ_SIZE = 64 * 1024
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# "[19:35:21] [Server thread/INFO]: <message>", modded servers add the logger name after the thread
+SERVER_LINE = re.compile(r"^\[[^\]]*\] \[Server thread/INFO\](?: \[[^\]]*\])?: (?P<message>.*?)\s*$")
+# Java names are 3 to 16 word characters, Bedrock players joining through Floodgate get a "." prefix
+PLAYER_NAME = r"(?P<name>\.?\w{1,16})"
+JOINED = re.compile(rf"^{PLAYER_NAME}(?: \(formerly known as [^)]*\))? joined the game$", re.ASCII)
+LEFT = re.compile(rf"^{PLAYER_NAME} left the game$", re.ASCII)
+STARTING = re.compile(r"^Starting minecraft server version ")
+DONE = re.compile(r"^Done \((?P<seconds>[0-9.]+)s\)!")
+STOPPING = re.compile(r"^Stopping server$")
+
+
+class _Inotify:
+    """
+    Minimal inotify binding through libc, os has no wrapper for it.
+    """
+    def __init__(self, directory: str, mask: int):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), ctypes.c_uint32(mask)) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Can not watch {directory}")
+
+    def drain(self):
+        # The events only say that something changed, the tail checks the file itself
+        try:
+            while os.read(self.fd, READ_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LogTail:
+    """
+    Follows one log file across rotations, see the module docstring.
+    The whole of the current file is read first, so a freshly started tail sees the server's session so far.
+    """
+    def __init__(self, path: str, poll_interval: float = POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.rotations = 0
+        self._file = None
+        self._inode: int | None = None
+        self._partial = b""
+        self._inotify: _Inotify | None = None
+        self._changed: asyncio.Event | None = None
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._inotify is not None
+
+    def open(self):
+        """
+        Starts watching the log's directory. Falls back to polling if inotify is not available.
+        """
+        self._changed = asyncio.Event()
+        try:
+            self._inotify = _Inotify(os.path.dirname(self.path) or ".", WATCH_MASK)
+        except (OSError, AttributeError):
+            # Not Linux, or the server has not created its logs directory yet
+            self._inotify = None
+            return
+        asyncio.get_running_loop().add_reader(self._inotify.fd, self._on_change)
+
+    def _on_change(self):
+        # Drained here rather than in read_lines, the loop polls level triggered and would spin on unread
+        # events while the caller is busy with something else
+        self._inotify.drain()
+        self._changed.set()
+
+    def close(self):
+        if self._inotify is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def __aenter__(self) -> "LogTail":
+        self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def _split(self, data: bytes, final: bool = False) -> list[str]:
+        data = self._partial + data
+        *lines, self._partial = data.split(b"\n")
+        if final and self._partial:
+            # The file will not grow any more, its last line is complete even without a newline
+            lines.append(self._partial)
+            self._partial = b""
+        return [line.decode("utf-8", "replace").rstrip("\r") for line in lines]
+
+    def read_available(self) -> list[str]:
+        """
+        Reads every complete line written since the last call, following the log if it was rotated.
+
+        Returns:
+            list[str]: The new lines, without their line endings.
+        """
+        lines = []
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            # Between a rotation's rename and the new file, the old one may still be written to
+            current = None
+
+        if self._file is not None:
+            if current is not None and current.st_ino != self._inode:
+                lines += self._split(self._file.read(), final=True)
+                self._file.close()
+                self._file = None
+                self.rotations += 1
+            elif os.fstat(self._file.fileno()).st_size < self._file.tell():
+                self._file.seek(0)
+                self._partial = b""
+                self.rotations += 1
+
+        if self._file is None and current is not None:
+            try:
+                self._file = open(self.path, "rb")
+            except FileNotFoundError:
+                return lines
+            self._inode = os.fstat(self._file.fileno()).st_ino
+
+        if self._file is not None:
+            lines += self._split(self._file.read())
+        return lines
+
+    async def read_lines(self, timeout: float) -> list[str]:
+        """
+        Waits up to timeout seconds for new lines.
+
+        Returns:
+            list[str]: The new lines, empty if nothing was written in time.
+        """
+        if self._changed is not None:
+            # Changes from before this read are covered by it
+            self._changed.clear()
+        lines = self.read_available()
+        if lines or timeout <= 0:
+            return lines
+        if self._inotify is None:
+            await asyncio.sleep(min(timeout, self.poll_interval))
+            return self.read_available()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        return self.read_available()
+
+
+@dataclass
+class PlayerTracker:
+    """
+    The players online according to the server log.
+
+    Players the log never showed joining, e.g. because they joined before a rotation the tail did not see,
+    are counted as unnamed once a probe reports them, and are removed again as they leave.
+
+    Attributes:
+        players (set[str]): The names of the players seen joining and not yet leaving.
+        unnamed (int): Players a probe reported that the log did not account for.
+        started (bool): True once the server has logged that it finished starting.
+        startup_seconds (float | None): The startup time the server logged.
+    """
+    players: set[str] = field(default_factory=set)
+    unnamed: int = 0
+    started: bool = False
+    startup_seconds: float | None = None
+
+    @property
+    def online(self) -> int:
+        return len(self.players) + self.unnamed
+
+    def feed(self, line: str) -> tuple[str, str] | None:
+        """
+        Applies one log line.
+
+        Returns:
+            tuple[str, str] | None: The event the line describes and the player it concerns, e.g.
+                ("joined", "Steve"), ("left", "Steve"), ("starting", ""), ("started", "") or ("stopping", ""),
+                or None if the line changes nothing.
+        """
+        match = SERVER_LINE.match(line)
+        if match is None:
+            return None
+        message = match["message"]
+        if match := JOINED.match(message):
+            self.players.add(match["name"])
+            return "joined", match["name"]
+        if match := LEFT.match(message):
+            if match["name"] in self.players:
+                self.players.discard(match["name"])
+            elif self.unnamed:
+                self.unnamed -= 1
+            return "left", match["name"]
+        if match := DONE.match(message):
+            self.started = True
+            self.startup_seconds = float(match["seconds"])
+            return "started", ""
+        if STARTING.match(message):
+            # A new server session, nobody is online yet
+            self.players.clear()
+            self.unnamed = 0
+            self.started = False
+            return "starting", ""
+        if STOPPING.match(message):
+            return "stopping", ""
+        return None
+
+    def resync(self, players_online: int, names: list[str] | None = None) -> bool:
+        """
+        Corrects the tracked players with the result of a probe.
+
+        Args:
+            players_online (int): The player count the server reported.
+            names (list[str] | None): The names of the players online, if the probe returned them.
+
+        Returns:
+            bool: True if the probe disagreed with the log.
+        """
+        agreed = players_online == self.online and (names is None or set(names) == self.players)
+        if names is not None:
+            self.players = set(names)
+            self.unnamed = max(0, players_online - len(self.players))
+        elif players_online == 0:
+            self.players.clear()
+            self.unnamed = 0
+        else:
+            # Names the log shows are kept, the count only says how many more or fewer there are
+            if players_online < len(self.players):
+                self.players.clear()
+            self.unnamed = players_online - len(self.players)
+        return not agreed
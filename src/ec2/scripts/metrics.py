@@ -0,0 +1,267 @@
+"""
+Metrics
+Minimal Prometheus instrumentation for the stop script, with no dependencies outside the standard library.
+
+Metrics are plain Python objects updated from the event loop thread, so no locking is needed and recording
+a sample is a couple of attribute updates. Histograms use fixed buckets, an observation is a binary search
+over the bucket bounds and an increment. Labelled children are created once and cached, callers on hot
+paths should look them up ahead of time.
+
+The endpoint is served by start_metrics_server on the running event loop, in the Prometheus text format.
+
+Please refer to docs found here for format details:
+    - https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+from abc import ABC, abstractmethod
+import asyncio
+from bisect import bisect_left
+import math
+import time
+
+# Suited to local pings and RCON commands, from sub millisecond responses up to the 10s client timeouts
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Scrapers send a short GET request, anything bigger than this is not a scrape
+MAX_REQUEST_SIZE = 8192
+REQUEST_TIMEOUT = 5.0
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Registry:
+    """
+    Collection of metrics rendered together on the metrics endpoint.
+    """
+    def __init__(self):
+        self._metrics: dict[str, "_Metric"] = {}
+
+    def register(self, metric: "_Metric"):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+        Returns:
+            str: Every metric in the Prometheus text format.
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for label_values, child in metric._children.items():
+                lines.extend(child._render(metric.name, metric.label_names, label_values))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (),
+                 registry: Registry | None = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children: dict[tuple[str, ...], object] = {}
+        # Metrics without labels have a single child that the metric's own methods update
+        if not self.label_names:
+            self._default = self.labels()
+        if registry is not None:
+            registry.register(self)
+
+    @abstractmethod
+    def _new_child(self):
+        """
+        Creates the object holding the value for one set of label values.
+        """
+
+    def labels(self, *values: str):
+        """
+        Returns the child for a set of label values, creating it on first use.
+
+        Args:
+            *values (str): One value per label name, in order.
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def _render(self, name: str, label_names: tuple[str, ...], label_values: tuple[str, ...]) -> list[str]:
+        return [f"{name}{_format_labels(label_names, label_values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    """
+    Value that only goes up, e.g. the number of pings sent. Names should end in _total.
+    """
+    type = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_to_current_time(self):
+        self.value = time.time()
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down, e.g. the number of players online.
+    """
+    type = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def set_to_current_time(self):
+        self._default.set_to_current_time()
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: "_HistogramChild"):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        # One count per bucket plus the +Inf bucket, made cumulative when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self) -> _Timer:
+        """
+        Returns a context manager that observes the time spent in its block.
+        """
+        return _Timer(self)
+
+    def _render(self, name: str, label_names: tuple[str, ...], label_values: tuple[str, ...]) -> list[str]:
+        lines = []
+        total = 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            total += count
+            labels = _format_labels(label_names + ("le",), label_values + (_format_value(bound),))
+            lines.append(f"{name}_bucket{labels} {total}")
+        labels = _format_labels(label_names, label_values)
+        lines.append(f"{name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{labels} {total}")
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Distribution of values over fixed buckets, e.g. ping latency in seconds.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS, registry: Registry | None = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, label_names, registry)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+
+async def _handle_request(registry: Registry, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+        method, path, *_ = request.split(b"\r\n", 1)[0].decode("latin-1").split(" ")
+        if method != "GET":
+            status, body = "405 Method Not Allowed", b""
+        elif path.split("?", 1)[0] in ("/metrics", "/"):
+            status, body = "200 OK", registry.render().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b""
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+    except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int, registry: Registry = REGISTRY) -> asyncio.Server:
+    """
+    Serves the registry's metrics over HTTP on the running event loop.
+
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        registry (Registry): The metrics to serve.
+
+    Returns:
+        asyncio.Server: The running server, close it to stop serving.
+    """
+    return await asyncio.start_server(
+        lambda reader, writer: _handle_request(registry, reader, writer), host, port, limit=MAX_REQUEST_SIZE)
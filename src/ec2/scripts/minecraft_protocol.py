@@ -0,0 +1,383 @@
+"""
+Minecraft Protocol Client
+Framing, VarInt and Server List Ping helpers shared by the EC2 management scripts.
+
+Please refer to docs found here for Protocol details:
+    - https://minecraft.wiki/w/Java_Edition_protocol/Data_types
+    - https://minecraft.wiki/w/Java_Edition_protocol/Server_List_Ping
+"""
+
+import asyncio
+import base64
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
+import json
+import re
+
+# Constants for VarInt encoding/decoding
+SEGMENT_BITS = 0x7F
+CONTINUE_BIT = 0x80
+# A VarInt is never longer than 5 bytes (32 bits of data, 7 bits per byte)
+VARINT_MAX_BYTES = 5
+# Largest packet the client will accept, mirrors the vanilla server's limit
+MAX_PACKET_LENGTH = 2097151
+
+# Protocol version sent in the handshake. Servers answer a status request for any version.
+HANDSHAKE_PROTOCOL_VERSION = 4
+STATUS_NEXT_STATE = 1
+STATUS_PACKET_ID = 0x00
+
+
+def encode_varint(value: int) -> bytes:
+    """
+    Encodes an integer into minecrafts VarInt format.
+
+    Args:
+        value (int): The integer to encode, negative values are encoded as their 32 bit two's complement.
+
+    Returns:
+        bytes: The encoded VarInt as bytes.
+    """
+    value &= 0xFFFFFFFF
+    if value < CONTINUE_BIT:
+        return bytes((value,))
+
+    out = bytearray()
+    while value >= CONTINUE_BIT:
+        out.append((value & SEGMENT_BITS) | CONTINUE_BIT)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_string(value: str) -> bytes:
+    """
+    Encodes a string as a VarInt length prefixed UTF-8 string.
+
+    Args:
+        value (str): The string to encode.
+
+    Returns:
+        bytes: The encoded string.
+    """
+    data = value.encode("utf-8")
+    return encode_varint(len(data)) + data
+
+
+class VarIntDecoder:
+    """
+    Incremental VarInt decoder that is fed one byte at a time.
+    Used to read VarInt prefixes directly off a stream without over reading.
+    """
+    __slots__ = ("value", "_shift")
+
+    def __init__(self):
+        self.value = 0
+        self._shift = 0
+
+    def feed(self, byte: int) -> bool:
+        """
+        Feeds a single byte into the decoder.
+
+        Args:
+            byte (int): The next byte of the VarInt.
+
+        Returns:
+            bool: True once the VarInt is complete and `value` holds the result.
+
+        Raises:
+            ValueError: If the VarInt is longer than 5 bytes.
+        """
+        self.value |= (byte & SEGMENT_BITS) << self._shift
+        if not byte & CONTINUE_BIT:
+            return True
+
+        self._shift += 7
+        if self._shift >= 7 * VARINT_MAX_BYTES:
+            raise ValueError("VarInt is too big")
+        return False
+
+
+class PacketBuffer:
+    """
+    Read cursor over the body of a single packet.
+    Fields are sliced through a memoryview so large strings are only copied once.
+    """
+    __slots__ = ("_data", "position")
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self.position = 0
+
+    def remaining(self) -> int:
+        return len(self._data) - self.position
+
+    def read_varint(self) -> int:
+        """
+        Reads a VarInt from the current position.
+
+        Returns:
+            int: The decoded integer.
+
+        Raises:
+            ValueError: If the VarInt is too big or the buffer ends mid VarInt.
+        """
+        data = self._data
+        position = self.position
+        if position < len(data) and data[position] < CONTINUE_BIT:
+            self.position = position + 1
+            return data[position]
+
+        value = 0
+        shift = 0
+        while position < len(data):
+            byte = data[position]
+            position += 1
+            value |= (byte & SEGMENT_BITS) << shift
+            if not byte & CONTINUE_BIT:
+                self.position = position
+                return value
+            shift += 7
+            if shift >= 7 * VARINT_MAX_BYTES:
+                raise ValueError("VarInt is too big")
+        raise ValueError("Incomplete VarInt")
+
+    def read_bytes(self, length: int) -> memoryview:
+        """
+        Reads a fixed number of bytes from the current position.
+
+        Args:
+            length (int): The number of bytes to read.
+
+        Returns:
+            memoryview: A view of the bytes read.
+
+        Raises:
+            ValueError: If the buffer does not hold enough bytes.
+        """
+        end = self.position + length
+        if length < 0 or end > len(self._data):
+            raise ValueError(f"Packet is truncated, wanted {length} bytes with {self.remaining()} remaining")
+        data = memoryview(self._data)[self.position:end]
+        self.position = end
+        return data
+
+    def read_string(self) -> str:
+        """
+        Reads a VarInt length prefixed UTF-8 string.
+        """
+        return str(self.read_bytes(self.read_varint()), "utf-8")
+
+
+async def read_varint(reader: asyncio.StreamReader) -> int:
+    """
+    Reads a single VarInt from a stream, consuming only the bytes that belong to it.
+
+    Args:
+        reader (asyncio.StreamReader): The stream reader to read data from.
+
+    Returns:
+        int: The decoded integer.
+    """
+    byte = (await reader.readexactly(1))[0]
+    if byte < CONTINUE_BIT:
+        return byte
+
+    decoder = VarIntDecoder()
+    while not decoder.feed(byte):
+        byte = (await reader.readexactly(1))[0]
+    return decoder.value
+
+
+async def read_packet(reader: asyncio.StreamReader) -> tuple[int, PacketBuffer]:
+    """
+    Reads one length framed packet from a stream.
+
+    Args:
+        reader (asyncio.StreamReader): The stream reader to read data from.
+
+    Returns:
+        tuple[int, PacketBuffer]: The packet id and a buffer positioned at the start of the packet data.
+
+    Raises:
+        ValueError: If the packet length is invalid.
+        asyncio.IncompleteReadError: If the stream closes before the full packet is received.
+    """
+    # Status and RCON sized packets almost always have a single byte length prefix
+    packet_length = (await reader.readexactly(1))[0]
+    if packet_length >= CONTINUE_BIT:
+        decoder = VarIntDecoder()
+        decoder.feed(packet_length)
+        while not decoder.feed((await reader.readexactly(1))[0]):
+            pass
+        packet_length = decoder.value
+    if packet_length <= 0 or packet_length > MAX_PACKET_LENGTH:
+        raise ValueError(f"Invalid packet length {packet_length}")
+
+    packet = PacketBuffer(await reader.readexactly(packet_length))
+    return packet.read_varint(), packet
+
+
+def MakePacket(packet_id: int, payload: bytes = b"") -> bytes:
+    """
+    Frames a packet with its id and length prefix.
+
+    Args:
+        packet_id (int): The id of the packet.
+        payload (bytes): The encoded packet fields.
+
+    Returns:
+        bytes: The length prefixed packet.
+    """
+    packet_data = encode_varint(packet_id) + payload
+    return encode_varint(len(packet_data)) + packet_data
+
+
+@lru_cache(maxsize=16)
+def MakeHandShakePacket(host: str, port: int, next_state: int) -> bytes:
+    """
+    Creates a Handshake packet for the Minecraft protocol.
+    The result is cached as the monitor sends the same handshake on every poll.
+
+    Args:
+        host (str): The server hostname.
+        port (int): The server port.
+        next_state (int): The next state (1 for status).
+
+    Returns:
+        bytes: The constructed Handshake packet.
+    """
+    return MakePacket(
+        0x00,
+        encode_varint(HANDSHAKE_PROTOCOL_VERSION)
+        + encode_string(host)
+        + port.to_bytes(2, byteorder="big")
+        + encode_varint(next_state))
+
+
+# The Status Request packet has no fields, so it is only ever encoded once
+STATUS_REQUEST_PACKET = MakePacket(STATUS_PACKET_ID)
+
+
+@dataclass
+class StatusResponse:
+    """
+    Response structure for the Minecraft server status.
+    decode_status_response parses the JSON payload and checks the version and player counts, the
+    favicon and player sample are only converted when asked for.
+    """
+    raw: str = field(repr=False)
+
+    @cached_property
+    def _json(self) -> dict:
+        return json.loads(self.raw)
+
+    @property
+    def version_name(self) -> str:
+        return self._json["version"]["name"]
+
+    @property
+    def version_protocol(self) -> int:
+        return self._json["version"]["protocol"]
+
+    @property
+    def players_max(self) -> int:
+        return self._json["players"]["max"]
+
+    @property
+    def players_online(self) -> int:
+        return self._json["players"]["online"]
+
+    @property
+    def description(self) -> str | dict:
+        return self._json.get("description", "")
+
+    @cached_property
+    def motd(self) -> str:
+        """
+        The description as plain text, with chat components flattened and formatting codes removed.
+        """
+        def flatten(component) -> str:
+            if isinstance(component, str):
+                return component
+            if isinstance(component, list):
+                return "".join(flatten(part) for part in component)
+            if isinstance(component, dict):
+                return str(component.get("text", "")) + "".join(flatten(part) for part in component.get("extra", []))
+            return ""
+
+        return re.sub("\u00a7.", "", flatten(self.description))
+
+    @cached_property
+    def player_sample(self) -> list[tuple[str, str]]:
+        """
+        The (name, uuid) pairs the server chose to include in the response.
+        """
+        return [(player["name"], player["id"]) for player in self._json["players"].get("sample", [])]
+
+    @cached_property
+    def favicon(self) -> bytes | None:
+        """
+        The decoded PNG favicon, or None if the server does not send one.
+        """
+        favicon = self._json.get("favicon")
+        if not favicon:
+            return None
+        _, _, encoded = favicon.partition(",")
+        return base64.b64decode(encoded)
+
+
+async def decode_status_response(reader: asyncio.StreamReader) -> StatusResponse:
+    """
+    Decodes the status response from the Minecraft server.
+
+    Args:
+        reader (asyncio.StreamReader): The stream reader to read data from.
+
+    Returns:
+        StatusResponse: The decoded status response.
+
+    Raises:
+        ValueError: If the server responds with an unexpected packet, or a status that is not valid JSON or
+            lacks the version and player counts.
+    """
+    packet_id, packet = await read_packet(reader)
+    if packet_id != STATUS_PACKET_ID:
+        raise ValueError(f"Unexpected packet id {packet_id:#x} in status response")
+    response = StatusResponse(packet.read_string())
+    # Checked here rather than on first access, so callers only have to handle errors from this call
+    try:
+        fields = (response.players_online, response.players_max, response.version_name)
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Status response lacks the version or player counts: {e!r}") from e
+    if not all(isinstance(value, expected) and not isinstance(value, bool)
+               for value, expected in zip(fields, (int, int, str))):
+        raise ValueError(f"Status response has invalid fields {fields!r}")
+    return response
+
+
+async def query_status(host: str, port: int, timeout: float = 10.0) -> StatusResponse:
+    """
+    Performs a Server List Ping against a Minecraft server.
+
+    Args:
+        host (str): The server hostname.
+        port (int): The server port.
+        timeout (float): Seconds to wait for the whole exchange.
+
+    Returns:
+        StatusResponse: The decoded status response.
+
+    Raises:
+        OSError: If unable to connect to the Minecraft server.
+        asyncio.TimeoutError: If the server does not respond in time.
+    """
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        # Both packets go out in a single write
+        writer.write(MakeHandShakePacket(host, port, STATUS_NEXT_STATE) + STATUS_REQUEST_PACKET)
+        await writer.drain()
+        return await asyncio.wait_for(decode_status_response(reader), timeout)
+    finally:
+        writer.close()
+        await writer.wait_closed()
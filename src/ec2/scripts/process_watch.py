@@ -0,0 +1,158 @@
+"""
+Process Watch
+Waits for a process that is not a child of this one to exit, and stops it with signals if it does not.
+
+On Linux 5.3+ the process is opened as a pidfd, which the event loop watches like a socket: it becomes
+readable the moment the process exits, so the wait wakes immediately without polling. The pidfd refers to
+the process itself rather than its id, so a reused process id can never be mistaken for the server.
+Where pidfds are not available the process is polled instead.
+
+Servers are started in their own session by ./start-server.sh, so signals are sent to the whole process
+group, reaching the JVM behind any wrapper scripts.
+"""
+
+import asyncio
+import os
+import select
+import signal
+
+POLL_INTERVAL = 1.0
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user
+        return True
+    # A process that has exited but not been reaped by its parent still has its id
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            return f.read().rpartition(b")")[2].split()[0] != b"Z"
+    except (OSError, IndexError):
+        return True
+
+
+class ProcessWatcher:
+    """
+    Watches a single process, see the module docstring.
+    """
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.pidfd: int | None = None
+        self._exited = False
+        # Shared by every waiter, resolved by the event loop reader or the polling task
+        self._exit: asyncio.Future | None = None
+        self._poll_task: asyncio.Task | None = None
+        try:
+            self.pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            self._exited = True
+        except (AttributeError, OSError):
+            # Not Linux, a kernel older than 5.3, or a seccomp policy that blocks the syscall
+            self.pidfd = None
+
+    @property
+    def uses_pidfd(self) -> bool:
+        return self.pidfd is not None
+
+    def is_running(self) -> bool:
+        if self._exited:
+            return False
+        if self.pidfd is not None:
+            # The pidfd is readable once the process has exited
+            readable, _, _ = select.select([self.pidfd], [], [], 0)
+            self._exited = bool(readable)
+        else:
+            self._exited = not _is_running(self.pid)
+        return not self._exited
+
+    def _set_exited(self):
+        self._exited = True
+        if self.pidfd is not None:
+            self._exit.get_loop().remove_reader(self.pidfd)
+        if not self._exit.done():
+            self._exit.set_result(None)
+
+    async def _poll(self):
+        while _is_running(self.pid):
+            await asyncio.sleep(POLL_INTERVAL)
+        self._set_exited()
+
+    async def wait(self):
+        """
+        Waits for the process to exit. Any number of tasks can wait at once.
+        """
+        if self._exited:
+            return
+        if self._exit is None:
+            loop = asyncio.get_running_loop()
+            self._exit = loop.create_future()
+            if self.pidfd is not None:
+                loop.add_reader(self.pidfd, self._set_exited)
+            else:
+                self._poll_task = loop.create_task(self._poll())
+        # Shielded so that a waiter timing out does not cancel the wait for the others
+        await asyncio.shield(self._exit)
+
+    async def wait_for(self, timeout: float) -> bool:
+        """
+        Waits up to timeout seconds for the process to exit.
+
+        Returns:
+            bool: True if the process exited in time.
+        """
+        try:
+            await asyncio.wait_for(self.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def send_signal(self, sig: int):
+        """
+        Sends a signal to the process, and to its whole process group if it leads one.
+        Does nothing once the process has exited.
+        """
+        if not self.is_running():
+            return
+        try:
+            # While the pidfd shows the process is alive its id and group id can not have been reused
+            if os.getpgid(self.pid) == self.pid:
+                os.killpg(self.pid, sig)
+            elif self.pidfd is not None:
+                signal.pidfd_send_signal(self.pidfd, sig)
+            else:
+                os.kill(self.pid, sig)
+        except ProcessLookupError:
+            self._exited = True
+
+    async def stop(self, timeout: float, term_timeout: float) -> str:
+        """
+        Waits for the process to exit, escalating to SIGTERM and then SIGKILL if it takes too long.
+
+        Args:
+            timeout (float): Seconds to wait before sending SIGTERM.
+            term_timeout (float): Seconds to wait after SIGTERM before sending SIGKILL.
+
+        Returns:
+            str: How the process ended: "exited", "terminated" or "killed".
+        """
+        if await self.wait_for(timeout):
+            return "exited"
+        self.send_signal(signal.SIGTERM)
+        if await self.wait_for(term_timeout):
+            return "terminated"
+        self.send_signal(signal.SIGKILL)
+        await self.wait()
+        return "killed"
+
+    def close(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+        if self.pidfd is not None:
+            if self._exit is not None and not self._exit.done():
+                self._exit.get_loop().remove_reader(self.pidfd)
+            os.close(self.pidfd)
+            self.pidfd = None
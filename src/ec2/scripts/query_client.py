@@ -0,0 +1,219 @@
+"""
+Minecraft Query Client
+Client for the UDP Query protocol (GameSpy 4), served by Minecraft when enable-query=true is set in
+server.properties. A stat request is a single datagram each way with no JSON to parse, and the full stat
+lists the names of the players online.
+
+Every stat request needs a challenge token from a handshake. The token is cached and reused until the
+server stops accepting it: servers drop tokens after 30 seconds and silently ignore requests with a
+stale token, so the token is refreshed shortly before then, and once more if a request goes unanswered.
+
+Please refer to docs found here for Protocol details:
+    - https://minecraft.wiki/w/Query
+"""
+
+import asyncio
+from dataclasses import dataclass
+import os
+import struct
+
+MAGIC = b"\xfe\xfd"
+TYPE_HANDSHAKE = 9
+TYPE_STAT = 0
+# Minecraft only keeps the low 4 bits of each byte of the session id
+SESSION_ID_MASK = 0x0F0F0F0F
+# Servers forget challenge tokens after 30 seconds
+TOKEN_LIFETIME = 25.0
+# Padding the full stat response puts before the key values and before the player names
+FULL_STAT_HEADER = b"splitnum\x00\x80\x00"
+FULL_STAT_PLAYERS_HEADER = b"\x01player_\x00\x00"
+
+
+@dataclass(frozen=True)
+class QueryBasicStat:
+    motd: str
+    game_type: str
+    map: str
+    players_online: int
+    players_max: int
+    host_port: int
+    host_ip: str
+
+
+@dataclass(frozen=True)
+class QueryFullStat:
+    """
+    Attributes:
+        info (dict[str, str]): The key values the server sent, e.g. "hostname", "version" and "numplayers".
+        players (list[str]): The names of the players online.
+    """
+    info: dict[str, str]
+    players: list[str]
+
+    @property
+    def motd(self) -> str:
+        return self.info.get("hostname", "")
+
+    @property
+    def version(self) -> str:
+        return self.info.get("version", "")
+
+    @property
+    def players_online(self) -> int:
+        return int(self.info.get("numplayers", len(self.players)))
+
+    @property
+    def players_max(self) -> int:
+        return int(self.info.get("maxplayers", 0))
+
+
+def _split_strings(data: bytes) -> list[str]:
+    return [value.decode("utf-8", "replace") for value in data.split(b"\x00")]
+
+
+def DecodeBasicStat(payload: bytes) -> QueryBasicStat:
+    """
+    Decodes the payload of a basic stat response, after the type and session id.
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    try:
+        motd, game_type, map_name, online, maximum, rest = payload.split(b"\x00", 5)
+        host_port = struct.unpack_from("<H", rest)[0]
+        host_ip = rest[2:].split(b"\x00", 1)[0].decode("utf-8", "replace")
+        return QueryBasicStat(motd.decode("utf-8", "replace"), game_type.decode("utf-8", "replace"),
+                              map_name.decode("utf-8", "replace"), int(online), int(maximum), host_port, host_ip)
+    except (struct.error, ValueError) as e:
+        raise ValueError(f"Malformed basic stat response: {e}") from e
+
+
+def DecodeFullStat(payload: bytes) -> QueryFullStat:
+    """
+    Decodes the payload of a full stat response, after the type and session id.
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    if not payload.startswith(FULL_STAT_HEADER):
+        raise ValueError("Malformed full stat response")
+    body = payload[len(FULL_STAT_HEADER):]
+    info_data, separator, player_data = body.partition(b"\x00\x00" + FULL_STAT_PLAYERS_HEADER)
+    if not separator:
+        raise ValueError("Full stat response has no player section")
+    values = _split_strings(info_data)
+    if len(values) % 2:
+        raise ValueError("Full stat response has a key without a value")
+    info = dict(zip(values[0::2], values[1::2]))
+    players = [name for name in _split_strings(player_data) if name]
+    return QueryFullStat(info, players)
+
+
+class _QueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport: asyncio.DatagramTransport | None = None
+        # The request waiting for a reply, and the packet type and session id the reply must carry
+        self.waiter: asyncio.Future | None = None
+        self.expected: bytes = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address):
+        # Late replies to requests that timed out are ignored, they do not carry the expected prefix
+        if self.waiter is not None and not self.waiter.done() and data.startswith(self.expected):
+            self.waiter.set_result(data[len(self.expected):])
+
+    def error_received(self, exc: Exception):
+        # An ICMP port unreachable, query is turned off or the server is down
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(ConnectionRefusedError(str(exc)))
+
+    def connection_lost(self, exc: Exception | None):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(ConnectionError("Query socket closed"))
+
+
+class QueryClient:
+    """
+    Sends Query requests to a single server over one UDP socket. Requests are sent one at a time.
+    """
+    def __init__(self, host: str, port: int, timeout: float = 2.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.session_id = int.from_bytes(os.urandom(4), "big") & SESSION_ID_MASK
+        self._protocol: _QueryProtocol | None = None
+        self._lock = asyncio.Lock()
+        self._token: bytes | None = None
+        self._token_expires = 0.0
+
+    async def connect(self):
+        if self._protocol is None or self._protocol.transport.is_closing():
+            loop = asyncio.get_running_loop()
+            _, self._protocol = await loop.create_datagram_endpoint(
+                _QueryProtocol, remote_addr=(self.host, self.port))
+
+    async def close(self):
+        if self._protocol is not None:
+            self._protocol.transport.close()
+            self._protocol = None
+        self._token = None
+
+    async def __aenter__(self) -> "QueryClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _request(self, packet_type: int, payload: bytes = b"") -> bytes:
+        await self.connect()
+        session = struct.pack(">i", self.session_id)
+        protocol = self._protocol
+        protocol.expected = bytes([packet_type]) + session
+        protocol.waiter = asyncio.get_running_loop().create_future()
+        protocol.transport.sendto(MAGIC + bytes([packet_type]) + session + payload)
+        try:
+            return await asyncio.wait_for(protocol.waiter, self.timeout)
+        finally:
+            protocol.waiter = None
+
+    async def _get_token(self) -> bytes:
+        loop = asyncio.get_running_loop()
+        if self._token is None or loop.time() >= self._token_expires:
+            response = await self._request(TYPE_HANDSHAKE)
+            try:
+                self._token = struct.pack(">i", int(response.split(b"\x00", 1)[0]))
+            except ValueError as e:
+                raise ValueError(f"Malformed challenge token {response!r}") from e
+            self._token_expires = loop.time() + TOKEN_LIFETIME
+        return self._token
+
+    async def _stat(self, full: bool) -> bytes:
+        async with self._lock:
+            padding = b"\x00\x00\x00\x00" if full else b""
+            try:
+                return await self._request(TYPE_STAT, await self._get_token() + padding)
+            except asyncio.TimeoutError:
+                # The server ignores stale tokens, so try once more with a new one
+                self._token = None
+                return await self._request(TYPE_STAT, await self._get_token() + padding)
+
+    async def basic_stat(self) -> QueryBasicStat:
+        """
+        Raises:
+            asyncio.TimeoutError: If the server does not answer, e.g. because query is turned off.
+            ConnectionError: If the server refuses the datagram.
+            ValueError: If the response is malformed.
+        """
+        return DecodeBasicStat(await self._stat(full=False))
+
+    async def full_stat(self) -> QueryFullStat:
+        """
+        Raises:
+            asyncio.TimeoutError: If the server does not answer, e.g. because query is turned off.
+            ConnectionError: If the server refuses the datagram.
+            ValueError: If the response is malformed.
+        """
+        return DecodeFullStat(await self._stat(full=True))
@@ -0,0 +1,250 @@
+"""
+RAM Disk Worlds
+Runs a server's world from tmpfs, so chunk loads and saves never wait on the EBS volume.
+
+./start-server.sh runs "ram_disk.py prepare <server dir>" before starting each server. With WORLD_RAM_DISK=1
+and a world that fits the memory budget, the world is copied to RAM_DISK_DIR, the copy on the volume is
+renamed to <world>.ebs and a symlink to the RAM copy takes its place. A world that does not fit runs from the
+volume as usual. /dev/shm is a tmpfs on every distribution, so the minecraft user needs no mount.
+
+While the server runs, stop-server.py copies the files that changed back to <world>.ebs every
+RAM_DISK_SYNC_INTERVAL seconds with saving turned off, and once more after the server exits. The final sync
+also moves the world back into place, and must succeed before the instance is stopped. A world left in RAM
+by a run that did not get that far is synced back, if the RAM copy survived, and restored by the next
+prepare.
+"""
+
+from dataclasses import dataclass
+import os
+import shutil
+import sys
+import time
+
+from resource_profiler import ReadMemoryTotal
+from server_profiles import ReadServerProperties
+
+WORLD_RAM_DISK = os.getenv("WORLD_RAM_DISK", "0") == "1"
+RAM_DISK_DIR = os.getenv("RAM_DISK_DIR", "/dev/shm/awscraft")
+# The share of the instance's memory the worlds in RAM may use together, the rest is left to the servers
+RAM_DISK_MEMORY_SHARE = float(os.getenv("RAM_DISK_MEMORY_SHARE", "0.25"))
+# Room for a world to grow while it runs, as a multiple of its size when it is loaded
+RAM_DISK_HEADROOM = 1.5
+DISK_COPY_SUFFIX = ".ebs"
+
+
+@dataclass
+class TreeSyncResult:
+    files: int
+    copied: int
+    copied_bytes: int
+    deleted: int
+    elapsed: float
+
+
+def DiskCopyDir(world_dir: str) -> str:
+    """
+    Returns:
+        str: Where the volume's copy of a world in RAM is kept.
+    """
+    return world_dir.rstrip("/") + DISK_COPY_SUFFIX
+
+
+def IsRamDiskWorld(world_dir: str) -> bool:
+    """
+    Returns:
+        bool: True if the world was loaded into RAM by LoadWorld.
+    """
+    return os.path.islink(world_dir) and os.path.isdir(DiskCopyDir(world_dir))
+
+
+def TreeSize(path: str) -> int:
+    """
+    Returns:
+        int: The size in bytes of the files under path, 0 if it does not exist.
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def MemoryBudget() -> int:
+    """
+    Returns:
+        int: The bytes the worlds in RAM may use together.
+    """
+    return int(ReadMemoryTotal() * RAM_DISK_MEMORY_SHARE)
+
+
+def _copy_file(source: str, dest: str):
+    # Written next to the destination and renamed over it, a sync cut short never leaves half a file
+    temp = f"{dest}.tmp-{os.getpid()}"
+    try:
+        shutil.copyfile(source, temp)
+        # The mtime is what the next sync compares
+        shutil.copystat(source, temp)
+        os.replace(temp, dest)
+    except BaseException:
+        try:
+            os.unlink(temp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def SyncTree(source: str, dest: str) -> TreeSyncResult:
+    """
+    Makes dest a copy of source, copying only the files whose size or mtime differ and deleting the files
+    and directories source no longer has. The source must not be written to while it syncs.
+
+    Args:
+        source (str): The directory to copy from, followed if it is a symlink.
+        dest (str): The directory to copy to, created if it does not exist.
+
+    Returns:
+        TreeSyncResult: What was copied and deleted.
+    """
+    started = time.monotonic()
+    result = TreeSyncResult(0, 0, 0, 0, 0.0)
+    os.makedirs(dest, exist_ok=True)
+    for root, dirs, files in os.walk(source):
+        relative = os.path.relpath(root, source)
+        target_root = os.path.normpath(os.path.join(dest, relative))
+        try:
+            existing = {entry.name: entry for entry in os.scandir(target_root)}
+        except FileNotFoundError:
+            os.makedirs(target_root)
+            existing = {}
+
+        for name in dirs:
+            entry = existing.pop(name, None)
+            if entry is not None and not entry.is_dir(follow_symlinks=False):
+                os.unlink(entry.path)
+                entry = None
+            if entry is None:
+                os.mkdir(os.path.join(target_root, name))
+
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            result.files += 1
+            entry = existing.pop(name, None)
+            if entry is not None:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    current = entry.stat(follow_symlinks=False)
+                    if current.st_size == stat.st_size and current.st_mtime_ns == stat.st_mtime_ns:
+                        continue
+            _copy_file(path, os.path.join(target_root, name))
+            result.copied += 1
+            result.copied_bytes += stat.st_size
+
+        # Whatever is left was deleted from the source
+        for entry in existing.values():
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+            result.deleted += 1
+
+    result.elapsed = time.monotonic() - started
+    return result
+
+
+def LoadWorld(world_dir: str, name: str) -> bool:
+    """
+    Moves a world into RAM if it fits the memory budget, see the module docstring.
+
+    Args:
+        world_dir (str): The world directory on the volume.
+        name (str): The profile name, the RAM copy is kept in RAM_DISK_DIR/<name>.
+
+    Returns:
+        bool: True if the server will run from RAM, False if it stays on the volume.
+    """
+    ram_dir = os.path.join(RAM_DISK_DIR, name, os.path.basename(world_dir.rstrip("/")))
+    size = TreeSize(world_dir)
+    needed = int(size * RAM_DISK_HEADROOM)
+    # Other profiles loaded before this one count against the same budget
+    in_use = TreeSize(RAM_DISK_DIR)
+    budget = MemoryBudget()
+    os.makedirs(RAM_DISK_DIR, exist_ok=True)
+    available = shutil.disk_usage(RAM_DISK_DIR).free
+    if in_use + needed > budget or needed > available:
+        print(f"The {name} world needs {needed / 2**20:.0f} MiB with room to grow, {(budget - in_use) / 2**20:.0f} "
+              f"MiB of the RAM disk budget and {available / 2**20:.0f} MiB of {RAM_DISK_DIR} are left. "
+              "Running it from the volume.")
+        return False
+
+    try:
+        result = SyncTree(world_dir, ram_dir)
+    except OSError as e:
+        print(f"Failed to copy the {name} world to {ram_dir}: {e}. Running it from the volume.")
+        shutil.rmtree(ram_dir, ignore_errors=True)
+        return False
+    # A crash between these two steps is undone by RestoreWorld
+    os.rename(world_dir, DiskCopyDir(world_dir))
+    os.symlink(ram_dir, world_dir)
+    print(f"Loaded the {name} world into {ram_dir}, {result.copied_bytes / 2**20:.1f} MiB in "
+          f"{result.elapsed:.2f}s")
+    return True
+
+
+def RestoreWorld(world_dir: str) -> TreeSyncResult | None:
+    """
+    Syncs a world in RAM back to the volume and moves it back into place. Does nothing for a world that is
+    not in RAM. The server must have exited.
+
+    Returns:
+        TreeSyncResult | None: The final sync, None if there was no RAM copy to sync.
+
+    Raises:
+        OSError: If the world could not be synced or moved back, the RAM copy is kept.
+    """
+    disk_dir = DiskCopyDir(world_dir)
+    result = None
+    if os.path.islink(world_dir):
+        if not os.path.isdir(disk_dir):
+            raise OSError(f"{world_dir} is a symlink without a copy on the volume, not touching it")
+        ram_dir = os.path.realpath(world_dir)
+        if os.path.isdir(ram_dir):
+            result = SyncTree(ram_dir, disk_dir)
+        os.unlink(world_dir)
+        os.rename(disk_dir, world_dir)
+        shutil.rmtree(ram_dir, ignore_errors=True)
+    elif not os.path.exists(world_dir) and os.path.isdir(disk_dir):
+        # Stopped between moving the world aside and linking the RAM copy
+        os.rename(disk_dir, world_dir)
+    return result
+
+
+def Prepare(server_dir: str) -> bool:
+    """
+    Restores a world a previous run left in RAM, then loads it into RAM if WORLD_RAM_DISK=1.
+
+    Returns:
+        bool: True if the server will run from RAM.
+    """
+    name = os.path.basename(server_dir.rstrip("/"))
+    world_dir = os.path.join(server_dir, ReadServerProperties(server_dir).get("level-name") or "world")
+    result = RestoreWorld(world_dir)
+    if result is not None:
+        print(f"Restored the {name} world left in RAM by the last run, {result.copied} files were newer")
+    if not WORLD_RAM_DISK or not os.path.isdir(world_dir):
+        return False
+    return LoadWorld(world_dir, name)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "prepare":
+        print(f"Usage: {sys.argv[0]} prepare <server dir>")
+        sys.exit(2)
+    Prepare(sys.argv[2])
@@ -0,0 +1,267 @@
+"""
+RCON Client
+Long lived client for the Source RCON protocol used by Minecraft servers.
+
+The client authenticates once and keeps the connection open between commands. Responses larger than one
+packet are reassembled by sending an empty SERVERDATA_RESPONSE_VALUE packet after the command. The server
+answers packets in order, so its reply to that sentinel marks the end of the command's response.
+
+A vanilla server reads each packet with a single read of at most MAX_RCON_REQUEST_SIZE bytes, and drops the
+connection if the read does not hold exactly one packet. So only one packet is ever left unanswered: the
+sentinel is only sent once the first packet of the command's response has arrived, and commands from
+different tasks take turns on the connection.
+
+Please refer to docs found here for Protocol details:
+    - https://developer.valvesoftware.com/wiki/Source_RCON_Protocol
+    - https://minecraft.wiki/w/RCON
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+import itertools
+import struct
+
+SERVERDATA_AUTH = 3
+SERVERDATA_AUTH_RESPONSE = 2
+SERVERDATA_EXECCOMMAND = 2
+SERVERDATA_RESPONSE_VALUE = 0
+
+# Request id, type and the two null terminators
+RCON_HEADER_SIZE = 10
+MAX_RCON_PACKET_SIZE = 4096 + RCON_HEADER_SIZE + 4096
+# The buffer a vanilla server reads each request packet into, length prefix included
+MAX_RCON_REQUEST_SIZE = 1460
+
+
+def EncodeRconPacket(request_id: int, packet_type: int, payload: str) -> bytes:
+    """
+    Creates a length prefixed RCON packet.
+
+    Args:
+        request_id (int): The id used to match the response to this packet.
+        packet_type (int): The type of the packet.
+        payload (str): The body of the packet.
+
+    Returns:
+        bytes: The encoded packet.
+    """
+    body = struct.pack("<ii", request_id, packet_type) + payload.encode("utf-8") + b"\x00\x00"
+    return struct.pack("<i", len(body)) + body
+
+
+async def read_rcon_packet(reader: asyncio.StreamReader) -> tuple[int, int, str]:
+    """
+    Reads a single RCON packet from a stream.
+
+    Args:
+        reader (asyncio.StreamReader): The stream reader to read data from.
+
+    Returns:
+        tuple[int, int, str]: The request id, packet type and payload of the packet.
+
+    Raises:
+        ValueError: If the packet size is invalid.
+        asyncio.IncompleteReadError: If the stream closes mid packet.
+    """
+    (size,) = struct.unpack("<i", await reader.readexactly(4))
+    if size < RCON_HEADER_SIZE or size > MAX_RCON_PACKET_SIZE:
+        raise ValueError(f"Invalid RCON packet size {size}")
+    data = await reader.readexactly(size)
+
+    request_id, packet_type = struct.unpack_from("<ii", data)
+    # Payload is everything up to the first null byte after the header
+    payload_end = data.find(b"\x00", 8)
+    payload = data[8:payload_end if payload_end != -1 else len(data)].decode("utf-8", errors="replace")
+    return request_id, packet_type, payload
+
+
+@dataclass
+class _PendingCommand:
+    future: asyncio.Future
+    # Set once the first packet of the response arrives, the sentinel is only sent after it
+    first_reply: asyncio.Future
+    sentinel_id: int
+    parts: list[str] = field(default_factory=list)
+
+
+class RconClient:
+    """
+    Persistent RCON connection that reconnects and re-authenticates on demand.
+    """
+    def __init__(self, host: str, port: int, password: str, timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._receive_task: asyncio.Task | None = None
+        self._connect_lock = asyncio.Lock()
+        self._command_lock = asyncio.Lock()
+        self._request_ids = itertools.count(1)
+        # Keyed by both the command request id and its sentinel request id
+        self._pending: dict[int, _PendingCommand] = {}
+
+    @property
+    def connected(self) -> bool:
+        return self._receive_task is not None and not self._receive_task.done()
+
+    def _next_request_id(self) -> int:
+        # Request ids must be positive 32 bit integers, -1 is reserved for failed auth
+        return next(self._request_ids) % 2147483647 + 1
+
+    async def connect(self):
+        """
+        Connects and authenticates, unless the client is already connected.
+
+        Raises:
+            ConnectionError: If unable to connect to the RCON server.
+            PermissionError: If RCON authentication fails.
+        """
+        async with self._connect_lock:
+            if self.connected:
+                return
+
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                raise ConnectionError(f"Failed to connect to RCON server: {e}") from e
+
+            try:
+                await asyncio.wait_for(self._authenticate(reader, writer), self.timeout)
+            except PermissionError:
+                writer.close()
+                raise
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                raise ConnectionError(f"RCON connection lost during authentication: {e}") from e
+
+            self._reader = reader
+            self._writer = writer
+            self._receive_task = asyncio.create_task(self._receive_loop(reader, writer))
+
+    async def _authenticate(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        auth_request_id = self._next_request_id()
+        writer.write(EncodeRconPacket(auth_request_id, SERVERDATA_AUTH, self.password))
+        await writer.drain()
+
+        # Source servers send an empty SERVERDATA_RESPONSE_VALUE before the auth response, Minecraft does not
+        while True:
+            auth_id, auth_type, _ = await read_rcon_packet(reader)
+            if auth_type == SERVERDATA_AUTH_RESPONSE:
+                break
+
+        # On auth failure, the server responds with request id = -1.
+        if auth_id == -1:
+            raise PermissionError("RCON authentication failed (request id = -1). Check RCON_SECRET")
+
+        if auth_id != auth_request_id:
+            raise PermissionError("Unexpected RCON auth response. Check RCON port/password and server config.")
+
+    async def _receive_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        error: BaseException = ConnectionError("RCON connection closed")
+        try:
+            while True:
+                request_id, _, payload = await read_rcon_packet(reader)
+                pending = self._pending.get(request_id)
+                if pending is None:
+                    continue
+
+                if request_id == pending.sentinel_id:
+                    # Everything for the command has arrived once the sentinel is echoed back
+                    for key in [key for key, value in self._pending.items() if value is pending]:
+                        del self._pending[key]
+                    if not pending.future.done():
+                        pending.future.set_result("".join(pending.parts))
+                else:
+                    pending.parts.append(payload)
+                    if not pending.first_reply.done():
+                        pending.first_reply.set_result(None)
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            error = ConnectionError(f"RCON connection lost: {e}")
+        finally:
+            self._fail_pending(error)
+            writer.close()
+
+    def _fail_pending(self, error: BaseException):
+        for pending in self._pending.values():
+            for future in (pending.first_reply, pending.future):
+                if not future.done():
+                    future.set_exception(error)
+        self._pending.clear()
+
+    async def command(self, command: str, timeout: float | None = None) -> str:
+        """
+        Runs a command on the server, connecting first if needed. Commands from different tasks run one
+        after the other, the timeout only starts once it is this command's turn.
+
+        Args:
+            command (str): The command to run, without a leading slash.
+            timeout (float | None): Seconds to wait for the response, defaults to the client's timeout.
+
+        Returns:
+            str: The full response from the server.
+
+        Raises:
+            ValueError: If the command is too long for the server to read.
+            ConnectionError: If the connection fails before the full response is received.
+            PermissionError: If RCON authentication fails.
+            asyncio.TimeoutError: If the server does not respond in time.
+        """
+        request_id = self._next_request_id()
+        packet = EncodeRconPacket(request_id, SERVERDATA_EXECCOMMAND, command)
+        if len(packet) > MAX_RCON_REQUEST_SIZE:
+            raise ValueError(f"RCON command is {len(packet)} bytes, the server reads at most "
+                             f"{MAX_RCON_REQUEST_SIZE}")
+
+        async with self._command_lock:
+            await self.connect()
+            loop = asyncio.get_running_loop()
+            pending = _PendingCommand(loop.create_future(), loop.create_future(), self._next_request_id())
+            self._pending[request_id] = pending
+            self._pending[pending.sentinel_id] = pending
+            try:
+                return await asyncio.wait_for(self._run(packet, pending), timeout or self.timeout)
+            except ConnectionError:
+                raise
+            except OSError as e:
+                raise ConnectionError(f"RCON connection lost: {e}") from e
+            finally:
+                self._pending.pop(request_id, None)
+                self._pending.pop(pending.sentinel_id, None)
+
+    async def _run(self, packet: bytes, pending: _PendingCommand) -> str:
+        self._writer.write(packet)
+        await self._writer.drain()
+        # The futures are settled by the receive loop, a timeout must not cancel them under it
+        await asyncio.shield(pending.first_reply)
+        self._writer.write(EncodeRconPacket(pending.sentinel_id, SERVERDATA_RESPONSE_VALUE, ""))
+        await self._writer.drain()
+        return await asyncio.shield(pending.future)
+
+    async def close(self):
+        """
+        Closes the connection. The next command will reconnect.
+        """
+        if self._receive_task is not None:
+            self._receive_task.cancel()
+            try:
+                await self._receive_task
+            except asyncio.CancelledError:
+                pass
+            self._receive_task = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._writer = None
+            self._reader = None
+
+    async def __aenter__(self) -> "RconClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,374 @@
+"""
+Resource Profiler
+Samples the CPU, memory, threads and disk I/O of a Minecraft server at a fixed rate while it runs, and
+summarizes them when it stops, so the InstanceType and EBSSize in terraform/.tfvars can be chosen from
+what the servers actually used.
+
+Every process in the server's session is counted, the JVM and any wrapper scripts ./start-server.sh
+started. Samples are read from /proc and kept in a ring buffer backed by a single array, so memory use is
+fixed however long the server runs: percentiles cover the most recent samples it holds, while peaks and
+sample counts cover the whole session.
+
+Each sample also records the player count the monitor last saw, which the summary correlates with CPU
+and memory use.
+"""
+
+import asyncio
+from array import array
+import math
+import os
+import shutil
+import time
+from typing import Sequence
+
+SAMPLE_INTERVAL = 5.0
+# A day of samples at the default interval, 7 columns of 8 bytes each take under 1 MiB
+SAMPLE_CAPACITY = 17280
+# Processes that join the session later, e.g. the JVM behind a wrapper script, are found this often
+MEMBER_REFRESH_SAMPLES = 12
+COLUMNS = ("time", "cpu_cores", "rss_bytes", "threads", "read_bytes_per_second", "write_bytes_per_second",
+           "players")
+PERCENTILES = (50, 95, 99)
+
+# Share of the instance the servers must stay under, or exceed, for the instance to count as too large or
+# too small. CPU is judged by its 95th percentile, memory by its peak.
+OVERSIZED_CPU_SHARE = 0.3
+OVERSIZED_MEMORY_SHARE = 0.4
+UNDERSIZED_CPU_SHARE = 0.8
+UNDERSIZED_MEMORY_SHARE = 0.85
+# The volume is sized to hold this much more than is in use, and is never suggested below the AMI minimum
+EBS_HEADROOM = 1.5
+EBS_MIN_GIB = 8
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class RingBuffer:
+    """
+    Fixed capacity table of float rows stored in one array. Once full, each row overwrites the oldest.
+    """
+    def __init__(self, columns: Sequence[str], capacity: int):
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self._width = len(self.columns)
+        self._data = array("d", bytes(8 * self._width * capacity))
+        self._next = 0
+        # Rows currently held, and rows ever appended
+        self.count = 0
+        self.total = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.itemsize * len(self._data)
+
+    def append(self, values: Sequence[float]):
+        offset = self._next * self._width
+        self._data[offset:offset + self._width] = array("d", values)
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.total += 1
+
+    def column(self, name: str) -> list[float]:
+        """
+        Returns:
+            list[float]: The values of a column, oldest first.
+        """
+        values = self._data[self.columns.index(name)::self._width]
+        if self.count < self.capacity:
+            return values[:self.count].tolist()
+        return (values[self._next:] + values[:self._next]).tolist()
+
+
+def Percentile(sorted_values: list[float], percent: float) -> float:
+    """
+    Returns:
+        float: The nearest rank percentile of already sorted values, 0 if there are none.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(len(sorted_values) * percent / 100)
+    return sorted_values[min(len(sorted_values) - 1, max(0, rank - 1))]
+
+
+def Correlate(xs: list[float], ys: list[float]) -> tuple[float | None, float | None]:
+    """
+    Returns:
+        tuple[float | None, float | None]: The Pearson correlation of ys with xs and the slope of the least
+            squares line, None if xs does not vary.
+    """
+    n = len(xs)
+    if n < 2:
+        return None, None
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    variance_x = sum((x - mean_x) ** 2 for x in xs)
+    variance_y = sum((y - mean_y) ** 2 for y in ys)
+    if variance_x == 0:
+        return None, None
+    slope = covariance / variance_x
+    if variance_y == 0:
+        return 0.0, slope
+    return covariance / math.sqrt(variance_x * variance_y), slope
+
+
+def _read_session_members(session: int) -> list[int]:
+    members = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "rb") as f:
+                fields = f.read().rpartition(b")")[2].split()
+        except OSError:
+            continue
+        if int(fields[3]) == session:
+            members.append(int(name))
+    return members
+
+
+def _read_process(pid: int) -> tuple[int, int, int, int | None, int | None] | None:
+    """
+    Returns:
+        tuple | None: CPU ticks, resident bytes, threads, and bytes read and written (None if /proc/<pid>/io
+            can not be read), or None if the process is gone.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            fields = f.read().rpartition(b")")[2].split()
+    except OSError:
+        return None
+    if fields[0] == b"Z":
+        # Exited, only waiting for its parent to reap it
+        return None
+    ticks = int(fields[11]) + int(fields[12])
+    threads = int(fields[17])
+    rss = int(fields[21]) * PAGE_SIZE
+    read_bytes = write_bytes = None
+    try:
+        with open(f"/proc/{pid}/io", "rb") as f:
+            for line in f:
+                key, _, value = line.partition(b":")
+                if key == b"read_bytes":
+                    read_bytes = int(value)
+                elif key == b"write_bytes":
+                    write_bytes = int(value)
+    except OSError:
+        # Only readable by the process owner and root
+        pass
+    return ticks, rss, threads, read_bytes, write_bytes
+
+
+class ResourceProfiler:
+    """
+    Samples the processes of one server's session, see the module docstring.
+
+    Attributes:
+        players (int | None): The player count recorded with each sample, set by the monitor.
+        samples (RingBuffer): The samples taken.
+        peaks (dict[str, float]): The highest value of each column over the whole session.
+    """
+    def __init__(self, pid: int, interval: float = SAMPLE_INTERVAL, capacity: int = SAMPLE_CAPACITY):
+        self.pid = pid
+        self.interval = interval
+        self.players: int | None = None
+        self.samples = RingBuffer(COLUMNS, capacity)
+        self.peaks = {name: 0.0 for name in COLUMNS}
+        self.io_available = True
+        self.started: float | None = None
+        self.stopped: float | None = None
+        self._members: list[int] = []
+        # CPU ticks and I/O bytes of each member at the last sample, deltas are taken per process so an
+        # exiting process does not make the totals go backwards
+        self._last: dict[int, tuple[int, int, int]] = {}
+        self._last_time: float | None = None
+
+    def sample(self, now: float | None = None) -> bool:
+        """
+        Takes one sample.
+
+        Returns:
+            bool: False once no process of the session is left.
+        """
+        now = time.monotonic() if now is None else now
+        if not self._members or self.samples.total % MEMBER_REFRESH_SAMPLES == 0:
+            self._members = _read_session_members(self.pid) or [self.pid]
+
+        ticks = rss = threads = read_bytes = write_bytes = 0
+        current = {}
+        for pid in self._members:
+            reading = _read_process(pid)
+            if reading is None:
+                continue
+            process_ticks, process_rss, process_threads, process_read, process_written = reading
+            if process_read is None:
+                self.io_available = False
+                process_read = process_written = 0
+            previous = self._last.get(pid, (process_ticks, process_read, process_written))
+            ticks += process_ticks - previous[0]
+            read_bytes += process_read - previous[1]
+            write_bytes += process_written - previous[2]
+            rss += process_rss
+            threads += process_threads
+            current[pid] = (process_ticks, process_read, process_written)
+        if not current:
+            return False
+        self._members = list(current)
+
+        if self._last_time is not None:
+            elapsed = max(now - self._last_time, 1e-9)
+            players = float("nan") if self.players is None else float(self.players)
+            row = (now, ticks / CLOCK_TICKS / elapsed, rss, threads, read_bytes / elapsed, write_bytes / elapsed,
+                   players)
+            self.samples.append(row)
+            for name, value in zip(COLUMNS, row):
+                if value > self.peaks[name]:
+                    self.peaks[name] = value
+        self._last = current
+        self._last_time = now
+        return True
+
+    async def run(self):
+        """
+        Samples at the interval until cancelled or the session has no processes left.
+        """
+        loop = asyncio.get_running_loop()
+        self.started = time.time()
+        next_sample = loop.time()
+        try:
+            while self.sample():
+                next_sample += self.interval
+                # A late sample does not make the following ones bunch up
+                await asyncio.sleep(max(0.0, next_sample - loop.time()))
+                next_sample = max(next_sample, loop.time())
+        finally:
+            self.stopped = time.time()
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: Percentiles of every resource over the samples held, session peaks, and how CPU and memory
+                use follow the player count.
+        """
+        summary = {
+            "pid": self.pid,
+            "started": self.started,
+            "stopped": self.stopped,
+            "interval_seconds": self.interval,
+            "samples": self.samples.total,
+            "samples_held": len(self.samples),
+            "buffer_bytes": self.samples.nbytes,
+            "io_available": self.io_available,
+        }
+        for name in COLUMNS[1:-1]:
+            values = sorted(self.samples.column(name))
+            summary[name] = {
+                **{f"p{percent}": Percentile(values, percent) for percent in PERCENTILES},
+                "mean": sum(values) / len(values) if values else 0.0,
+                "peak": self.peaks[name],
+            }
+
+        players = self.samples.column("players")
+        cpu = self.samples.column("cpu_cores")
+        rss = self.samples.column("rss_bytes")
+        known = [index for index, count in enumerate(players) if not math.isnan(count)]
+        xs = [players[index] for index in known]
+        cpu_correlation, cpu_per_player = Correlate(xs, [cpu[index] for index in known])
+        rss_correlation, rss_per_player = Correlate(xs, [rss[index] for index in known])
+        summary["players"] = {
+            "peak": max(xs, default=0.0),
+            "mean": sum(xs) / len(xs) if xs else 0.0,
+            "cpu_correlation": cpu_correlation,
+            "cpu_cores_per_player": cpu_per_player,
+            "rss_correlation": rss_correlation,
+            "rss_bytes_per_player": rss_per_player,
+        }
+        # The load at each player count seen, to show what the next player would cost
+        by_players: dict[int, tuple[list[float], list[float]]] = {}
+        for index in known:
+            group = by_players.setdefault(int(players[index]), ([], []))
+            group[0].append(cpu[index])
+            group[1].append(rss[index])
+        summary["by_players"] = {
+            str(count): {
+                "samples": len(group_cpu),
+                "cpu_cores_p95": Percentile(sorted(group_cpu), 95),
+                "rss_bytes_peak": max(group_rss),
+            }
+            for count, (group_cpu, group_rss) in sorted(by_players.items())
+        }
+        return summary
+
+
+def ReadMemoryTotal() -> int:
+    """
+    Returns:
+        int: The memory of the instance in bytes, 0 if /proc/meminfo can not be read.
+    """
+    try:
+        with open("/proc/meminfo", "rb") as f:
+            for line in f:
+                if line.startswith(b"MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def RecommendSizing(summaries: list[dict], cpu_count: int, memory_total: int, volume_path: str,
+                    instance_type: str | None = None) -> dict:
+    """
+    Judges whether the instance and its volume suit the servers, from the summaries of every server on it.
+    Servers are assumed to peak together, so their usage is added up.
+
+    Args:
+        summaries (list[dict]): ResourceProfiler.summary() of each server.
+        cpu_count (int): The vCPUs of the instance.
+        memory_total (int): The memory of the instance in bytes.
+        volume_path (str): A path on the volume the servers store their data on.
+        instance_type (str | None): The instance type, only used in the report.
+
+    Returns:
+        dict: "instance" is "over-provisioned", "under-provisioned" or "right-sized", "reasons" says why,
+            and "ebs_size_gib" is the suggested volume size.
+    """
+    cpu_p95 = sum(summary["cpu_cores"]["p95"] for summary in summaries)
+    memory_peak = sum(summary["rss_bytes"]["peak"] for summary in summaries)
+    cpu_share = cpu_p95 / cpu_count if cpu_count else 0.0
+    memory_share = memory_peak / memory_total if memory_total else 0.0
+
+    reasons = []
+    if cpu_share > UNDERSIZED_CPU_SHARE:
+        reasons.append(f"95th percentile CPU use is {cpu_p95:.2f} of {cpu_count} vCPUs")
+    if memory_share > UNDERSIZED_MEMORY_SHARE:
+        reasons.append(f"peak memory use is {memory_share:.0%} of the instance's memory")
+    if reasons:
+        verdict = "under-provisioned"
+    elif cpu_share < OVERSIZED_CPU_SHARE and memory_share < OVERSIZED_MEMORY_SHARE:
+        verdict = "over-provisioned"
+        reasons.append(f"95th percentile CPU use is {cpu_p95:.2f} of {cpu_count} vCPUs and peak memory use "
+                       f"is {memory_share:.0%} of the instance's memory")
+    else:
+        verdict = "right-sized"
+
+    recommendation = {
+        "instance_type": instance_type,
+        "instance": verdict,
+        "reasons": reasons,
+        "cpu_count": cpu_count,
+        "cpu_cores_p95": cpu_p95,
+        "memory_bytes": memory_total,
+        "rss_bytes_peak": memory_peak,
+    }
+    try:
+        usage = shutil.disk_usage(volume_path)
+    except OSError:
+        return recommendation
+    recommendation["volume_bytes"] = usage.total
+    recommendation["volume_used_bytes"] = usage.used
+    recommendation["ebs_size_gib"] = max(EBS_MIN_GIB, math.ceil(usage.used * EBS_HEADROOM / 1024 ** 3))
+    return recommendation
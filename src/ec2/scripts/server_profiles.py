@@ -0,0 +1,114 @@
+"""
+Server Profiles
+Describes the Minecraft servers running on the instance, one per profile in the servers directory.
+
+./start-server.sh starts every profile listed in MINECRAFT_PROFILES and passes their process ids to the
+stop script as SERVER_PROFILES="<name>=<pid> <name>=<pid> ...". The ports and RCON password of each
+server are read from the server.properties file in its directory.
+"""
+
+from dataclasses import dataclass
+import os
+
+DEFAULT_SERVER_PORT = 25565
+DEFAULT_RCON_PORT = 25575
+
+
+@dataclass(frozen=True)
+class ServerProfile:
+    """
+    Attributes:
+        name (str): The profile name, also the name of the server's directory.
+        pid (int): The process id of the server, or -1 if it is unknown.
+        port (int): The game port, used for status pings.
+        rcon_port (int): The RCON port.
+        rcon_secret (str): The RCON password.
+        server_dir (str): The directory the server runs in.
+        level_name (str): The name of the world directory inside server_dir.
+        query_port (int): The UDP Query port, 0 if enable-query is off.
+    """
+    name: str
+    pid: int
+    port: int = DEFAULT_SERVER_PORT
+    rcon_port: int = DEFAULT_RCON_PORT
+    rcon_secret: str = ""
+    server_dir: str = ""
+    level_name: str = "world"
+    query_port: int = 0
+
+    @property
+    def world_dir(self) -> str:
+        return os.path.join(self.server_dir, self.level_name)
+
+
+def ReadServerProperties(server_dir: str) -> dict[str, str]:
+    """
+    Reads a server's server.properties file.
+
+    Returns:
+        dict[str, str]: The properties, empty if the file does not exist.
+    """
+    properties = {}
+    try:
+        with open(os.path.join(server_dir, "server.properties"), encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith(("#", "!")):
+                    continue
+                key, separator, value = line.partition("=")
+                if separator:
+                    properties[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return properties
+
+
+def ProfileFromProperties(name: str, pid: int, server_dir: str) -> ServerProfile:
+    """
+    Builds a profile from the server.properties file in the server's directory.
+    """
+    properties = ReadServerProperties(server_dir)
+    port = int(properties.get("server-port") or DEFAULT_SERVER_PORT)
+    query_port = 0
+    if properties.get("enable-query", "").lower() == "true":
+        # Query listens on the game port number unless told otherwise, it is UDP so they do not clash
+        query_port = int(properties.get("query.port") or port)
+    return ServerProfile(
+        name=name,
+        pid=pid,
+        port=port,
+        rcon_port=int(properties.get("rcon.port") or DEFAULT_RCON_PORT),
+        rcon_secret=properties.get("rcon.password", ""),
+        server_dir=server_dir,
+        level_name=properties.get("level-name") or "world",
+        query_port=query_port)
+
+
+def LoadServerProfiles(spec: str, servers_dir: str) -> list[ServerProfile]:
+    """
+    Parses the SERVER_PROFILES value written by ./start-server.sh.
+
+    Args:
+        spec (str): Space separated <name>=<pid> pairs.
+        servers_dir (str): The directory holding one directory per profile.
+
+    Returns:
+        list[ServerProfile]: One profile per pair, in order.
+
+    Raises:
+        ValueError: If the value is malformed or lists a profile twice.
+    """
+    profiles = []
+    for item in spec.split():
+        name, separator, pid = item.partition("=")
+        if not separator or not name or not pid.lstrip("-").isdigit():
+            raise ValueError(f"Invalid server profile {item!r}, expected <name>=<pid>")
+        if any(profile.name == name for profile in profiles):
+            raise ValueError(f"Server profile {name} is listed more than once")
+        profiles.append(ProfileFromProperties(name, int(pid), os.path.join(servers_dir, name)))
+
+    ports = [port for profile in profiles for port in (profile.port, profile.rcon_port)]
+    query_ports = [profile.query_port for profile in profiles if profile.query_port]
+    if len(ports) != len(set(ports)) or len(query_ports) != len(set(query_ports)):
+        raise ValueError("Server profiles must each use their own game, RCON and query ports")
+    return profiles
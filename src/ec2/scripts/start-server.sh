@@ -9,14 +9,46 @@ else
     exit 1
 fi
 
-if [ ! -f "$START_SCRIPT" ]; then
-	echo "$START_SCRIPT not found. Cannot start the Minecraft server."
+# Seconds since boot, the stop script records the rest of the boot timeline on the same clock
+read -r SERVICE_STARTED _ < /proc/uptime
+export SERVICE_STARTED
+
+# Start every profile, each server runs from its own directory in $MINECRAFT_SERVERS_DIR.
+# The stop script is given the process id of each server as "<name>=<pid> <name>=<pid> ...".
+SERVER_PROFILES=""
+SERVER_SPAWN_TIMES=""
+for profile_name in ${MINECRAFT_PROFILES:-$DEFAULT_PROFILE_NAME}; do
+	profile_dir="$MINECRAFT_SERVERS_DIR/$profile_name"
+	profile_start_script="$profile_dir/start-server.sh"
+	if [ ! -f "$profile_start_script" ]; then
+		echo "$profile_start_script not found. Cannot start the $profile_name Minecraft server."
+		continue
+	fi
+
+	# Answers on the public port while the world is prepared and the server starts, see wake_proxy.py
+	if [ "${WAKE_PROXY:-0}" = "1" ]; then
+		python3 "$MINECRAFT_SCRIPTS_DIR/wake_proxy.py" "$profile_dir" &
+	fi
+
+	# Puts the world back on the volume if the last run left it in RAM, then moves it into RAM if
+	# WORLD_RAM_DISK=1 and it fits. See ram_disk.py, the server runs from the volume if this fails.
+	python3 "$MINECRAFT_SCRIPTS_DIR/ram_disk.py" prepare "$profile_dir" \
+		|| echo "Could not prepare the $profile_name world, running it from where it is."
+
+	# Start file also requires path to jar. Each server gets its own session, so the stop script can signal
+	# the server and everything it started as one process group.
+	setsid "$profile_start_script" "$profile_dir/server.jar" &
+	SERVER_PROFILES="$SERVER_PROFILES $profile_name=$!"
+	read -r spawned _ < /proc/uptime
+	SERVER_SPAWN_TIMES="$SERVER_SPAWN_TIMES $profile_name=$spawned"
+done
+
+if [ -z "$SERVER_PROFILES" ]; then
+	echo "No Minecraft servers were started."
 	exit 1
 fi
+export SERVER_PROFILES SERVER_SPAWN_TIMES
 
-# Start file also requires path to jar
-"$START_SCRIPT" "$SERVER_JAR" &
-export SERVER_PID=$!
 export IMS_TOKEN=$(curl -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 300")
 export INSTANCE_ID=$(curl -H "X-aws-ec2-metadata-token: $IMS_TOKEN" http://169.254.169.254/latest/meta-data/instance-id)
 
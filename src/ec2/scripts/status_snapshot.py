@@ -0,0 +1,160 @@
+"""
+Status Snapshot
+Publishes a compact summary of the servers on the instance to S3, so the ServerStatusFunction lambda can
+report player counts and the MOTD without calling the EC2 API on every request.
+
+The snapshot is written to status/<instance id>.json whenever the status of a server changes, and at least
+every heartbeat interval, so readers can tell a live snapshot from one left behind by a stopped instance
+by its "updated" time. Publishing is rate limited, a burst of changes is written as one snapshot.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import json
+import time
+
+from aws_client import AWSRequestError, InstanceMetadata, S3Client
+
+SNAPSHOT_VERSION = 1
+HEARTBEAT_INTERVAL = 60.0
+MIN_PUBLISH_INTERVAL = 5.0
+
+
+def SnapshotKey(instance_id: str) -> str:
+    # NOTE: Ensure that this matches the key read by src/lambda/ServerStatusFunction/index.ts
+    return f"status/{instance_id}.json"
+
+
+@dataclass
+class ServerStatus:
+    """
+    Attributes:
+        state (str): "starting" until the first successful ping, then "running", "stopping" once the server
+            is being shut down and "stopped" once it has exited.
+        players_online (int | None): Players online at the last successful ping.
+        players_max (int | None): Player slots reported at the last successful ping.
+        version (str): The server version name.
+        motd (str): The message of the day as plain text.
+        last_seen (float | None): Unix time of the last successful ping.
+        players (list[str] | None): The names of the players online, only known when the server is probed
+            with the Query protocol.
+    """
+    state: str = "starting"
+    players_online: int | None = None
+    players_max: int | None = None
+    version: str = ""
+    motd: str = ""
+    last_seen: float | None = None
+    players: list[str] | None = None
+
+
+class StatusPublisher:
+    """
+    Collects the status of every server and publishes it, see the module docstring.
+    Without a client the snapshot is only kept in memory.
+    """
+    def __init__(self, client: S3Client | None, instance_id: str, heartbeat_interval: float = HEARTBEAT_INTERVAL,
+                 min_publish_interval: float = MIN_PUBLISH_INTERVAL):
+        self.client = client
+        self.instance_id = instance_id
+        self.heartbeat_interval = heartbeat_interval
+        self.min_publish_interval = min_publish_interval
+        self.servers: dict[str, ServerStatus] = {}
+        self.public_ip: str | None = None
+        self.public_dns: str | None = None
+        # How long the instance and its servers took to start, see ./boot_timeline.py
+        self.boot_timeline: dict | None = None
+        # Number of snapshots written successfully
+        self.published = 0
+        self._changed = asyncio.Event()
+
+    def update(self, profile: str, **changes):
+        """
+        Updates the status of a server, publishing it soon if anything other than last_seen changed.
+
+        Args:
+            profile (str): The profile name of the server.
+            **changes: New values for ServerStatus fields.
+        """
+        status = self.servers.setdefault(profile, ServerStatus())
+        changed = False
+        for name, value in changes.items():
+            if getattr(status, name) != value:
+                setattr(status, name, value)
+                changed = changed or name != "last_seen"
+        if changed:
+            self._changed.set()
+
+    def set_boot_timeline(self, timeline: dict):
+        """
+        Publishes the boot timeline with the next snapshot.
+        """
+        self.boot_timeline = timeline
+        self._changed.set()
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: The JSON document that is published, keys are camel case to match the lambda responses.
+        """
+        return {
+            "version": SNAPSHOT_VERSION,
+            "instanceId": self.instance_id,
+            "updated": time.time(),
+            "ipAddress": self.public_ip,
+            "publicDNS": self.public_dns,
+            "servers": {
+                name: {
+                    "state": status.state,
+                    "playersOnline": status.players_online,
+                    "playersMax": status.players_max,
+                    "version": status.version,
+                    "motd": status.motd,
+                    "lastSeen": status.last_seen,
+                    "players": status.players,
+                }
+                for name, status in sorted(self.servers.items())
+            },
+            "bootTimeline": self.boot_timeline,
+        }
+
+    async def publish(self):
+        """
+        Writes the snapshot to S3. Failures are logged, the next change or heartbeat tries again.
+        """
+        if self.client is None:
+            return
+        body = json.dumps(self.snapshot(), separators=(",", ":")).encode("utf-8")
+        try:
+            await self.client.request("PUT", SnapshotKey(self.instance_id), body=body,
+                                      headers={"Content-Type": "application/json"})
+        except AWSRequestError as e:
+            print(f"Failed to publish the status snapshot: {e}")
+            return
+        self.published += 1
+
+    async def run(self):
+        """
+        Publishes the snapshot on every change and heartbeat until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        if self.client is not None and self.public_ip is None:
+            metadata = InstanceMetadata()
+            for attribute, path in (("public_ip", "meta-data/public-ipv4"),
+                                    ("public_dns", "meta-data/public-hostname")):
+                try:
+                    setattr(self, attribute, await metadata.get(path) or None)
+                except AWSRequestError:
+                    # Instances without a public address answer with 404
+                    pass
+
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+            started = loop.time()
+            await self.publish()
+            # Changes made while waiting here are picked up by the next publish
+            await asyncio.sleep(max(0.0, self.min_publish_interval - (loop.time() - started)))
@@ -1,287 +1,740 @@
 """
 Minecraft Server Stop Script
-This script connects to a Minecraft server to monitor player count and then stops the server and ec2 instance when no players are online in a given period of time.
+This script connects to the Minecraft servers on the instance to monitor their player counts, stops each server when no players are online in a given period of time, and stops the ec2 instance once every server has exited.
 
 Please refer to docs found here for Protocol details:
     - https://minecraft.wiki/w/Java_Edition_protocol/Packets
     - https://minecraft.wiki/w/Java_Edition_protocol/Server_List_Ping
+    - https://minecraft.wiki/w/Query
     - https://developer.valvesoftware.com/wiki/Source_RCON_Protocol
 """
 
 import asyncio
-from dataclasses import dataclass
+from contextlib import contextmanager
 import json
 import os
-import random
-import struct
 import subprocess
-import psutil
-
-PLAYER_CHECK_INTERVAL = int(os.getenv("PLAYER_CHECK_INTERVAL", "180"))
-SERVER_PID = int(os.getenv("SERVER_PID", "-1"))
+import time
+
+from aws_client import AWSRequestError, EC2Client, InstanceMetadata, S3Client, with_retries
+from boot_timeline import AppendTimelineHistory, BootTimeline, ParseBootTimes, WatchServerStartup
+from idle_scheduler import IdlePolicy, IdleScheduler, SystemClock
+from log_watch import LogTail, PlayerTracker
+from metrics import Counter, Gauge, Histogram, start_metrics_server
+from minecraft_protocol import query_status
+from process_watch import ProcessWatcher
+from query_client import QueryClient
+from ram_disk import RAM_DISK_DIR, DiskCopyDir, IsRamDiskWorld, RestoreWorld, SyncTree
+from resource_profiler import ReadMemoryTotal, RecommendSizing, ResourceProfiler
+from rcon_client import RconClient
+from server_profiles import LoadServerProfiles, ServerProfile
+from status_snapshot import ServerStatus, StatusPublisher
+from world_sync import SyncWorld
+
+IDLE_POLICY = IdlePolicy.from_env()
+# "poll" finds idle servers by probing the player count, "log" follows each server's logs/latest.log and
+# starts the idle window the moment the last player leaves, probing only as a sanity check
+IDLE_DETECTOR = os.getenv("IDLE_DETECTOR", "poll")
 INSTANCE_ID = os.getenv("INSTANCE_ID", "i-0123456789abcdef0")
-RCON_SECRET = os.getenv("RCON_SECRET")
-RCON_PORT = int(os.getenv("RCON_PORT", "-1"))
-
-
-# Constants for VarInt encoding/decoding
-SEGMENT_BITS = b'\x7F'[0] 
-CONTINUE_BIT = b'\x80'[0]
-
-
-def encode_varint(value: int) -> bytes:
+SERVERS_DIR = os.getenv("MINECRAFT_SERVERS_DIR", "/opt/minecraft/servers")
+PROFILE_NAME = os.getenv("DEFAULT_PROFILE_NAME", "DefaultMinecraftProfile")
+# Written by ./start-server.sh, see ./server_profiles.py
+SERVER_PROFILES = os.getenv("SERVER_PROFILES", "")
+# Describe a single server when SERVER_PROFILES is not set
+SERVER_PID = int(os.getenv("SERVER_PID", "-1"))
+SERVER_PORT = int(os.getenv("SERVER_PORT", "25565"))
+RCON_HOST = os.getenv("RCON_HOST", "localhost")
+RCON_PORT = int(os.getenv("RCON_PORT", "25575"))
+RCON_SECRET = os.getenv("RCON_SECRET", "123456")
+QUERY_PORT = int(os.getenv("QUERY_PORT", "0"))
+# "auto" probes the player count with the Query protocol when a server has enable-query on, "ping" always
+# uses the TCP Server List Ping
+PLAYER_PROBE = os.getenv("PLAYER_PROBE", "auto")
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "1"))
+# Consecutive unanswered queries after which a monitor only uses the Server List Ping
+QUERY_MAX_FAILURES = 3
+S3_BUCKET = os.getenv("S3_BUCKET")
+# Each world is synced below worlds/<profile>/ in S3_BUCKET, the manifests of the last syncs are kept in MINECRAFT_DIR
+MINECRAFT_DIR = os.getenv("MINECRAFT_DIR", "/opt/minecraft")
+# Sample each server's CPU, memory and disk I/O, and write a right-sizing report to RESOURCE_REPORT_DIR (and
+# S3_BUCKET) once every server has stopped, see ./resource_profiler.py
+RESOURCE_PROFILER = os.getenv("RESOURCE_PROFILER", "1") != "0"
+RESOURCE_SAMPLE_INTERVAL = float(os.getenv("RESOURCE_SAMPLE_INTERVAL", "5"))
+RESOURCE_SAMPLE_CAPACITY = int(os.getenv("RESOURCE_SAMPLE_CAPACITY", "17280"))
+RESOURCE_REPORT_DIR = os.getenv("RESOURCE_REPORT_DIR", os.path.join(MINECRAFT_DIR, "resource-reports"))
+# Worlds ./start-server.sh moved into RAM are copied back to the volume this often, and once more after the
+# server exits, see ./ram_disk.py
+RAM_DISK_SYNC_INTERVAL = float(os.getenv("RAM_DISK_SYNC_INTERVAL", "300"))
+RAM_DISK_RESTORE_ATTEMPTS = 3
+# Flushing a large world to disk can take far longer than a normal RCON command
+SAVE_TIMEOUT = float(os.getenv("SAVE_TIMEOUT", "300"))
+# Seconds a server gets to exit after the stop command before it is sent SIGTERM, and then SIGKILL
+STOP_TIMEOUT = float(os.getenv("STOP_TIMEOUT", "120"))
+TERM_TIMEOUT = float(os.getenv("TERM_TIMEOUT", "30"))
+
+# Publish a status snapshot to S3_BUCKET for the ServerStatusFunction lambda, see ./status_snapshot.py
+STATUS_SNAPSHOT = os.getenv("STATUS_SNAPSHOT", "1") != "0"
+
+# Record when each server spawned, first accepted a connection, first answered a ping and logged that it was
+# done, appending every session to BOOT_TIMELINE_HISTORY and publishing it with the status snapshot, see
+# ./boot_timeline.py. The times ./start-server.sh took are passed in SERVICE_STARTED and SERVER_SPAWN_TIMES.
+BOOT_TIMELINE = os.getenv("BOOT_TIMELINE", "1") != "0"
+BOOT_TIMELINE_HISTORY = os.getenv("BOOT_TIMELINE_HISTORY", os.path.join(MINECRAFT_DIR, "boot-timeline.jsonl"))
+SERVICE_STARTED = os.getenv("SERVICE_STARTED", "")
+SERVER_SPAWN_TIMES = os.getenv("SERVER_SPAWN_TIMES", "")
+
+# The metrics endpoint is only served when a port is set
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+PINGS = Counter("awscraft_pings_total", "Server list pings sent to the server, by result.", ("profile", "result"))
+PING_SECONDS = Histogram("awscraft_ping_duration_seconds", "Round trip time of successful server list pings.",
+                         ("profile",))
+RCON_COMMANDS = Counter("awscraft_rcon_commands_total", "RCON commands sent to the server, by command and result.",
+                        ("profile", "command", "result"))
+RCON_SECONDS = Histogram("awscraft_rcon_command_duration_seconds",
+                         "Round trip time of successful RCON commands, by command.", ("profile", "command"))
+QUERIES = Counter("awscraft_queries_total", "Query full stat requests sent to the server, by result.",
+                  ("profile", "result"))
+QUERY_SECONDS = Histogram("awscraft_query_duration_seconds", "Round trip time of successful Query full stats.",
+                          ("profile",))
+LOG_PLAYER_EVENTS = Counter("awscraft_log_events_total", "Server log lines the log idle detector acted on, by event.",
+                            ("profile", "event"))
+PLAYER_COUNT_MISMATCHES = Counter("awscraft_player_count_mismatches_total",
+                                  "Probes that disagreed with the players seen in the server log.", ("profile",))
+PLAYERS_ONLINE = Gauge("awscraft_players_online", "Players online at the last successful ping.", ("profile",))
+PLAYERS_MAX = Gauge("awscraft_players_max", "Player slots reported at the last successful ping.", ("profile",))
+CHECK_INTERVAL = Gauge("awscraft_player_check_interval_seconds", "Seconds until the next player count check.",
+                       ("profile",))
+IDLE_SAMPLES = Gauge("awscraft_idle_samples", "Consecutive checks that found the server empty.", ("profile",))
+SERVERS_RUNNING = Gauge("awscraft_servers_running", "Servers on the instance that have not exited yet.")
+SHUTDOWN_STARTED = Gauge("awscraft_shutdown_started_timestamp_seconds",
+                         "Unix time the server was found idle and shutdown began, 0 while running.", ("profile",))
+SHUTDOWN_PHASE_SECONDS = Gauge("awscraft_shutdown_phase_duration_seconds",
+                               "Time spent in each completed phase of the shutdown, the instance stop has no profile.",
+                               ("profile", "phase"))
+WORLD_SYNC_BYTES = Counter("awscraft_world_sync_uploaded_bytes_total", "Bytes of world data uploaded to S3.",
+                           ("profile",))
+RAM_DISK_SYNC_BYTES = Counter("awscraft_ram_disk_synced_bytes_total",
+                              "Bytes of world data copied from RAM back to the volume.", ("profile",))
+
+
+@contextmanager
+def shutdown_phase(phase: str, profile: str = ""):
     """
-    Encodes an integer into minecrafts VarInt format.
-
-    Args:
-        value (int): The integer to encode.
-
-    Returns:
-        bytes: The encoded VarInt as bytes.
+    Records how long a phase of the shutdown took, whether or not it succeeded.
     """
-    out = bytearray()
-    while True:
-        if (value & ~SEGMENT_BITS) == 0:
-            out.append(value)
-            return bytes(out)
-        else: 
-            out.append((value & SEGMENT_BITS) | CONTINUE_BIT)
-            value >>= 7
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        SHUTDOWN_PHASE_SECONDS.labels(profile, phase).set(duration)
+        print(f"{f'[{profile}] ' if profile else ''}Shutdown phase {phase} took {duration:.2f}s")
 
 
-def decode_varint(data: bytes) -> int:
+class ServerMonitor:
     """
-    Decodes a VarInt from minecraft's format.
-
-    Args:
-        data (bytes): The bytes containing the VarInt.
-
-    Returns:
-        int: The decoded integer.
+    Watches one server profile: checks its player count, and saves, syncs and stops it once it is idle.
     """
-    value = 0
-    shift = 0
+    def __init__(self, profile: ServerProfile, clock: SystemClock | None = None,
+                 status: StatusPublisher | None = None):
+        self.profile = profile
+        self.clock = clock or SystemClock()
+        self.status = status or StatusPublisher(None, INSTANCE_ID)
+        # RCON session for this server, it connects on first use and stays authenticated between commands
+        self.rcon = RconClient(RCON_HOST, profile.rcon_port, profile.rcon_secret)
+        # Query is cheaper than a status ping, it is used whenever the server has it turned on
+        self.query: QueryClient | None = None
+        if profile.query_port and PLAYER_PROBE == "auto":
+            self.query = QueryClient("localhost", profile.query_port, QUERY_TIMEOUT)
+        self._query_failures = 0
+        # The player names returned by the last probe, only Query returns them
+        self.probed_names: list[str] | None = None
+        self.profiler: ResourceProfiler | None = None
+        if RESOURCE_PROFILER and profile.pid > 0:
+            self.profiler = ResourceProfiler(profile.pid, RESOURCE_SAMPLE_INTERVAL, RESOURCE_SAMPLE_CAPACITY)
+        # True if ./start-server.sh moved the world into RAM
+        self.ram_disk = IsRamDiskWorld(profile.world_dir)
+        # Held while saving is turned off, so the RAM disk and S3 syncs do not turn it back on under each other
+        self._save_lock = asyncio.Lock()
+        # Children used on every check are looked up once
+        self._pings_ok = PINGS.labels(profile.name, "ok")
+        self._pings_error = PINGS.labels(profile.name, "error")
+        self._ping_seconds = PING_SECONDS.labels(profile.name)
+        self._queries_ok = QUERIES.labels(profile.name, "ok")
+        self._queries_error = QUERIES.labels(profile.name, "error")
+        self._query_seconds = QUERY_SECONDS.labels(profile.name)
+        self._players_online = PLAYERS_ONLINE.labels(profile.name)
+        self._players_max = PLAYERS_MAX.labels(profile.name)
+        self._check_interval = CHECK_INTERVAL.labels(profile.name)
+        self._idle_samples = IDLE_SAMPLES.labels(profile.name)
+        self._player_count_mismatches = PLAYER_COUNT_MISMATCHES.labels(profile.name)
+
+    def print(self, message: str):
+        print(f"[{self.profile.name}] {message}")
+
+    async def run(self):
+        """
+        Monitors the server until its process has exited, whether the monitor stopped it or not.
+        """
+        detector = self.run_log_idle_detector if IDLE_DETECTOR == "log" else self.run_player_count_client
+        if self.profile.pid <= 0:
+            # Without a process to watch, the server counts as exited as soon as the stop command is sent
+            self.print("Server process id is unknown, the server is assumed to exit once it is stopped.")
+            await detector()
+            return
 
-    for index in range(len(data)):
-        current_byte = data[index]
-        value |= (current_byte & SEGMENT_BITS) << shift
+        # Opened before anything else, so the process id can not be reused while it is watched
+        watcher = ProcessWatcher(self.profile.pid)
+        if not watcher.uses_pidfd:
+            self.print("pidfd is not available, polling the server process instead.")
+        client = asyncio.create_task(detector())
+        exited = asyncio.create_task(watcher.wait())
+        tasks = [client, exited]
+        if self.profiler is not None:
+            tasks.append(asyncio.create_task(self.profiler.run()))
+        if self.ram_disk:
+            self.print(f"World is in RAM, syncing it to the volume every {RAM_DISK_SYNC_INTERVAL:.0f}s.")
+            tasks.append(asyncio.create_task(self.run_ram_disk_sync()))
+        try:
+            await asyncio.wait({client, exited}, return_when=asyncio.FIRST_COMPLETED)
+            if not client.done():
+                self.print("Server exited before it went idle.")
+            elif client.exception() is not None:
+                # The server may still have players, so it is left to exit on its own
+                self.print(f"Monitoring failed, waiting for the server to exit: {client.exception()!r}")
+                await exited
+            else:
+                with shutdown_phase("server_exit", self.profile.name):
+                    outcome = await watcher.stop(STOP_TIMEOUT, TERM_TIMEOUT)
+                if outcome != "exited":
+                    self.print(f"Server did not exit within {STOP_TIMEOUT:.0f}s of the stop command and was {outcome}.")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.rcon.close()
+            if self.query is not None:
+                await self.query.close()
+            watcher.close()
+
+    async def run_player_count_client(self):
+        """
+        Asynchronously monitors the server's player count and stops the server when no players have been online
+        for the idle window. See ./idle_scheduler.py for how often the player count is checked.
+        """
+        scheduler = IdleScheduler(IDLE_POLICY, self.clock)
+        while True:
+            interval = scheduler.next_interval()
+            self._check_interval.set(interval)
+            await self.clock.sleep(interval)
+
+            scheduler.record(await self.probe_players())
+            self._idle_samples.set(scheduler.zero_samples)
+            if scheduler.is_idle():
+                await self.stop_idle_server(f"No players online for {IDLE_POLICY.idle_window:.0f}s "
+                                            f"({scheduler.zero_samples} consecutive checks)")
+                return
+
+    async def run_log_idle_detector(self):
+        """
+        Follows the server log and stops the server once nobody has been online for the idle window, which
+        starts the moment the last player leaves. See ./log_watch.py for how the log is followed.
+        The player count is still probed every PLAYER_CHECK_INTERVAL seconds and before stopping the server,
+        in case the log and the server disagree.
+        """
+        policy = IDLE_POLICY
+        tracker = PlayerTracker()
+        started = self.clock.monotonic()
+        empty_since = started
+        next_check = started
+        async with LogTail(os.path.join(self.profile.server_dir, "logs", "latest.log")) as tail:
+            if not tail.uses_inotify:
+                self.print(f"inotify is not available for {tail.path}, polling it instead.")
+            # The current log covers the server session so far
+            for line in tail.read_available():
+                tracker.feed(line)
+            self.print(f"Following {tail.path}, {tracker.online} player(s) online.")
+            self.publish_tracked_players(tracker)
+
+            while True:
+                now = self.clock.monotonic()
+                idle_at = None
+                if tracker.online == 0:
+                    idle_at = max(empty_since + policy.idle_window, started + policy.startup_grace)
+
+                if idle_at is not None and now >= idle_at:
+                    # One last probe, in case the log missed a join
+                    players = await self.probe_players()
+                    if players:
+                        self.resync_players(tracker, players)
+                        next_check = self.clock.monotonic() + policy.player_interval
+                        continue
+                    await self.stop_idle_server(f"No players online for {now - empty_since:.0f}s")
+                    return
+
+                if now >= next_check:
+                    players = await self.probe_players()
+                    if players is not None and self.resync_players(tracker, players) and tracker.online == 0:
+                        empty_since = self.clock.monotonic()
+                    next_check = self.clock.monotonic() + policy.player_interval
+                    continue
+
+                wake = next_check if idle_at is None else min(next_check, idle_at)
+                self._check_interval.set(wake - now)
+                for line in await tail.read_lines(wake - now):
+                    event = tracker.feed(line)
+                    if event is None:
+                        continue
+                    kind, name = event
+                    LOG_PLAYER_EVENTS.labels(self.profile.name, kind).inc()
+                    if kind in ("joined", "left"):
+                        self.print(f"{name} {kind} the game, {tracker.online} player(s) online.")
+                        self.publish_tracked_players(tracker)
+                    elif kind == "started":
+                        self.print(f"Server finished starting in {tracker.startup_seconds:.1f}s.")
+                        self.status.update(self.profile.name, state="running")
+                    if kind in ("left", "starting") and tracker.online == 0:
+                        empty_since = self.clock.monotonic()
+
+    def record_players(self, players: int):
+        self._players_online.set(players)
+        if self.profiler is not None:
+            self.profiler.players = players
+
+    def publish_tracked_players(self, tracker: PlayerTracker):
+        self.record_players(tracker.online)
+        # Players only known from a probe's count have no name
+        names = sorted(tracker.players) if not tracker.unnamed else None
+        self.status.update(self.profile.name, players_online=tracker.online, players=names)
+
+    def resync_players(self, tracker: PlayerTracker, players: int) -> bool:
+        """
+        Corrects the players seen in the log with the count a probe returned.
+
+        Returns:
+            bool: True if the probe disagreed with the log.
+        """
+        logged = tracker.online
+        if not tracker.resync(players, self.probed_names):
+            return False
+        self._player_count_mismatches.inc()
+        self.print(f"The server reports {players} player(s) online but the log shows {logged}, "
+                   "using the server's count.")
+        self.publish_tracked_players(tracker)
+        return True
+
+    async def stop_idle_server(self, reason: str):
+        """
+        Saves, syncs and stops the server once it has been found idle. Errors are logged, not raised.
+        """
+        self.print(f"{reason}, stopping the server...")
+        SHUTDOWN_STARTED.labels(self.profile.name).set_to_current_time()
+        self.status.update(self.profile.name, state="stopping")
+        try:
+            with shutdown_phase("save_and_sync", self.profile.name):
+                await self.save_and_sync_world()
+        except (ConnectionError, PermissionError, asyncio.TimeoutError, AWSRequestError, OSError,
+                ValueError) as e:
+            # The copy in S3 is a convenience, the server is still stopped and its data stays on the volume
+            self.print(f"Error syncing world data: {e}")
+        try:
+            with shutdown_phase("stop_command", self.profile.name):
+                await self.stop_server_command()
+        except Exception as e:
+            self.print(f"Error stopping server: {e}")
+
+    async def probe_players(self) -> int | None:
+        """
+        Gets the player count with Query if the server has it turned on, and with a Server List Ping if not.
+
+        Returns:
+            int | None: The number of players online, or None if the server could not be reached.
+        """
+        players = None
+        if self.query is not None:
+            players = await self.query_players()
+        if players is None:
+            self.probed_names = None
+            players = await self.ping_players()
+        return players
+
+    async def query_players(self) -> int | None:
+        """
+        Gets the player count with a Query full stat.
+
+        Returns:
+            int | None: The number of players online, or None if the server did not answer.
+        """
+        started = time.perf_counter()
+        try:
+            stat = await self.query.full_stat()
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            self._queries_error.inc()
+            self._query_failures += 1
+            if self._query_failures >= QUERY_MAX_FAILURES:
+                self.print(f"Query did not answer {self._query_failures} times in a row ({e!r}), "
+                           "using the status ping from now on.")
+                await self.query.close()
+                self.query = None
+            return None
+
+        self._query_failures = 0
+        self.probed_names = stat.players
+        self._query_seconds.observe(time.perf_counter() - started)
+        self._queries_ok.inc()
+        self.record_players(stat.players_online)
+        self._players_max.set(stat.players_max)
+        self.status.update(self.profile.name, state="running", players_online=stat.players_online,
+                           players_max=stat.players_max, version=stat.version, motd=stat.motd,
+                           players=stat.players, last_seen=time.time())
+        return stat.players_online
+
+    async def ping_players(self) -> int | None:
+        """
+        Gets the player count with a Server List Ping.
+
+        Returns:
+            int | None: The number of players online, or None if the server could not be reached.
+        """
+        started = time.perf_counter()
+        try:
+            response = await query_status('localhost', self.profile.port)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            self._pings_error.inc()
+            self.print(f"Could not get server status: {e}")
+            self.print("Server is likely offline, retrying...")
+            return None
+
+        self._ping_seconds.observe(time.perf_counter() - started)
+        self._pings_ok.inc()
+        self.record_players(response.players_online)
+        self._players_max.set(response.players_max)
+        self.status.update(self.profile.name, state="running", players_online=response.players_online,
+                           players_max=response.players_max, version=response.version_name,
+                           motd=response.motd, last_seen=time.time())
+        return response.players_online
+
+    async def rcon_command(self, command: str, timeout: float | None = None) -> str:
+        """
+        Runs a command through the server's RCON session, recording its round trip time.
+        See RconClient.command for the arguments and errors.
+        """
+        name = command.split(" ", 1)[0]
+        started = time.perf_counter()
+        try:
+            response = await self.rcon.command(command, timeout)
+        except BaseException:
+            RCON_COMMANDS.labels(self.profile.name, name, "error").inc()
+            raise
+        RCON_SECONDS.labels(self.profile.name, name).observe(time.perf_counter() - started)
+        RCON_COMMANDS.labels(self.profile.name, name, "ok").inc()
+        return response
+
+    async def save_and_sync_world(self):
+        """
+        Flushes the world to disk and uploads the files that changed since the last sync to S3_BUCKET.
+        Saving is turned off while the files are read, so the copy in S3 is consistent.
+
+        Raises:
+            ConnectionError: If unable to connect to the RCON server.
+            PermissionError: If RCON authentication fails.
+            AWSRequestError: If the upload fails.
+        """
+        if not S3_BUCKET:
+            self.print("S3_BUCKET is not set, skipping the world sync.")
+            return
 
-        if (current_byte & CONTINUE_BIT) == 0:
-            return value
+        async with self._save_lock:
+            await self._save_and_upload_world()
 
-        shift += 7
-        if shift >= 32:
-            raise ValueError("VarInt is too big")
+    async def _save_and_upload_world(self):
+        self.print(await self.rcon_command("save-off"))
+        try:
+            # With flush the command only returns once every chunk has been written to disk
+            response = await self.rcon_command("save-all flush", timeout=SAVE_TIMEOUT)
+            self.print(response)
+            if "Saved the game" not in response:
+                self.print("The server did not confirm the save, skipping the world sync.")
+                return
+
+            metadata = InstanceMetadata()
+            region = os.getenv("AWS_REGION") or await with_retries(metadata.get_region)
+            client = S3Client(S3_BUCKET, region, metadata.get_credentials)
+            prefix = f"worlds/{self.profile.name}"
+            manifest = os.path.join(MINECRAFT_DIR, f"{self.profile.name}.world-sync.json")
+            self.print(f"Syncing {self.profile.world_dir} to s3://{S3_BUCKET}/{prefix}/...")
+            result = await SyncWorld(self.profile.world_dir, client, prefix, manifest)
+            WORLD_SYNC_BYTES.labels(self.profile.name).inc(result.uploaded_bytes)
+            self.print(f"Synced {result.files} files in {result.elapsed:.1f}s: uploaded {result.uploaded} "
+                       f"({result.uploaded_bytes / 1024 / 1024:.1f} MiB), deleted {result.deleted}.")
+        finally:
+            self.print(await self.rcon_command("save-on"))
+
+    async def run_ram_disk_sync(self):
+        """
+        Copies the world in RAM back to the volume every RAM_DISK_SYNC_INTERVAL seconds until cancelled.
+        A failed sync is logged and tried again at the next interval.
+        """
+        while True:
+            await asyncio.sleep(RAM_DISK_SYNC_INTERVAL)
+            try:
+                await self.sync_ram_disk()
+            except (ConnectionError, PermissionError, asyncio.TimeoutError, OSError) as e:
+                self.print(f"Failed to sync the world in RAM to the volume: {e!r}")
+
+    async def sync_ram_disk(self):
+        """
+        Flushes the world in RAM and copies the files that changed to the volume, with saving turned off so
+        the copy is consistent.
+
+        Raises:
+            ConnectionError: If unable to connect to the RCON server.
+            PermissionError: If RCON authentication fails.
+            OSError: If the files could not be copied.
+        """
+        async with self._save_lock:
+            await self.rcon_command("save-off")
+            try:
+                response = await self.rcon_command("save-all flush", timeout=SAVE_TIMEOUT)
+                if "Saved the game" not in response:
+                    self.print(f"The server did not confirm the save, skipping the RAM disk sync: {response}")
+                    return
+                world_dir = self.profile.world_dir
+                result = await asyncio.to_thread(SyncTree, world_dir, DiskCopyDir(world_dir))
+            finally:
+                await self.rcon_command("save-on")
+        RAM_DISK_SYNC_BYTES.labels(self.profile.name).inc(result.copied_bytes)
+        self.print(f"Synced the world in RAM to the volume in {result.elapsed:.2f}s: copied {result.copied} of "
+                   f"{result.files} files ({result.copied_bytes / 1024 / 1024:.1f} MiB), deleted {result.deleted}.")
+
+    async def restore_ram_disk(self) -> bool:
+        """
+        Copies the world in RAM to the volume for the last time and moves it back into place. Must only be
+        called once the server has exited.
+
+        Returns:
+            bool: True if the world is safe on the volume, False if it is still only in RAM.
+        """
+        for attempt in range(1, RAM_DISK_RESTORE_ATTEMPTS + 1):
+            try:
+                result = await asyncio.to_thread(RestoreWorld, self.profile.world_dir)
+            except OSError as e:
+                self.print(f"Failed to restore the world in RAM to the volume (attempt {attempt}): {e!r}")
+                continue
+            if result is not None:
+                RAM_DISK_SYNC_BYTES.labels(self.profile.name).inc(result.copied_bytes)
+                self.print(f"Restored the world to the volume in {result.elapsed:.2f}s: copied {result.copied} "
+                           f"files ({result.copied_bytes / 1024 / 1024:.1f} MiB), deleted {result.deleted}.")
+            return True
+        return False
+
+    async def stop_server_command(self):
+        """
+        Asynchronously sends the "stop" command to the Minecraft server via RCON.
+
+        Raises:
+            ConnectionError: If unable to connect to the RCON server.
+            PermissionError: If RCON authentication fails.
+        """
+        try:
+            await self.rcon.connect()
+        except ConnectionError as e:
+            self.print(f"Could not connect to RCON server: {e}")
+            raise
 
-    raise ValueError("Incomplete VarInt")
+        try:
+            self.print(await self.rcon_command("stop"))
+        except ConnectionError:
+            # The server may close the connection as it shuts down, before the full response arrives
+            pass
+        finally:
+            await self.rcon.close()
 
 
-def MakeHandShakePacket(host: str, port: int, next_state: int) -> bytes:
+def LoadProfiles() -> list[ServerProfile]:
     """
-    Creates a Handshake packet for the Minecraft protocol.
-
-    Args:
-        host (str): The server hostname.
-        port (int): The server port.
-        next_state (int): The next state (1 for status).
-
     Returns:
-        bytes: The constructed Handshake packet.
-    """
-    # Create the data required for a Handshake packet
-    packet_id = b'\x00'
-    protocol_version = encode_varint(4) 
-    server_address = encode_varint(len(host)) + host.encode('utf-8')
-    server_port = port.to_bytes(2, byteorder='big')
-    intent = encode_varint(next_state)
-
-    packet_data = (packet_id + protocol_version + server_address + server_port + intent)
-
-    # Packets are prefixed with their length as a VarInt
-    return encode_varint(len(packet_data)) + packet_data
-
-
-def MakeStatusRequestPacket() -> bytes:
-    """
-    Creates a Status Request packet for the Minecraft protocol.
+        list[ServerProfile]: The servers listed in SERVER_PROFILES, or the single server described by the
+            SERVER_PID, SERVER_PORT, RCON_PORT, RCON_SECRET and QUERY_PORT variables if it is not set.
     """
-    # Create the data required for a Status Request packet
-    packet_id = b'\x00'
+    if SERVER_PROFILES.strip():
+        return LoadServerProfiles(SERVER_PROFILES, SERVERS_DIR)
+    return [ServerProfile(PROFILE_NAME, SERVER_PID, SERVER_PORT, RCON_PORT, RCON_SECRET,
+                          os.path.join(SERVERS_DIR, PROFILE_NAME), query_port=QUERY_PORT)]
 
-    return encode_varint(len(packet_id)) + packet_id
 
-
-@dataclass
-class StatusResponse:
-    """
-    Response structure for the Minecraft server status.
+async def GetInstanceType() -> str | None:
     """
-    version_name: str
-    version_protocol: int
-    players_max: int
-    players_online: int
-    description: str
-
-
-async def decode_status_response(reader: asyncio.StreamReader) -> StatusResponse:
-    """
-    Decodes the status response from the Minecraft server.
-    
-    Args:
-        reader (asyncio.StreamReader): The stream reader to read data from.
-    
     Returns:
-        StatusResponse: The decoded status response.
+        str | None: The instance type from the instance metadata, or None if it can not be read.
     """
-    packet_length = decode_varint(await reader.read(3))
-    _ = decode_varint(await reader.read(2))
-    data = (await reader.read(packet_length - 3)).decode('utf-8')
+    try:
+        return await asyncio.wait_for(InstanceMetadata().get("meta-data/instance-type"), 5)
+    except (AWSRequestError, asyncio.TimeoutError, OSError):
+        return None
 
-    json_data = json.loads(data)
-    return StatusResponse(
-        version_name=json_data['version']['name'],
-        version_protocol=json_data['version']['protocol'],
-        players_max=json_data['players']['max'],
-        players_online=json_data['players']['online'],
-        description=json_data['description']
-    )
 
+def PrintBootTimeline(timeline: BootTimeline):
+    for name, server in timeline.servers.items():
+        phases = [f"{phase.replace('_', ' ')} at {getattr(server, phase):.2f}s"
+                  for phase in ("spawned", "first_accept", "first_status", "done")
+                  if getattr(server, phase) is not None]
+        reported = f" (the server reported {server.reported_startup:g}s)" if server.reported_startup else ""
+        print(f"[{name}] Since boot: {', '.join(phases) or 'no phases recorded'}{reported}")
 
-async def run_player_count_client():
-    """
-    Asynchronously monitors the Minecraft server player count and stops the server and EC2 instance when no players are online.
 
-    Raises:
-        ConnectionError: If unable to connect to the Minecraft server.
+def WriteResourceReport(monitors: list[ServerMonitor], instance_type: str | None) -> dict | None:
     """
-    while True:
-        await asyncio.sleep(PLAYER_CHECK_INTERVAL)
-        
-        try:
-            reader, writer = await asyncio.open_connection('localhost', 25565)
-        except Exception as e:
-            print(f"Could not connect to server: {e}")
-            print("Server is likely offline, retrying...")
-            await asyncio.sleep(PLAYER_CHECK_INTERVAL)
-            continue
-
-        handshake_packet = MakeHandShakePacket('localhost', 25565, 1)
-        writer.write(handshake_packet)
-        await writer.drain()
-
-        status_request_packet = MakeStatusRequestPacket()
-        writer.write(status_request_packet)
-        await writer.drain()
-
-        # Read the response length as a VarInt
-        response = await decode_status_response(reader)
-        
-        if response.players_online == 0:
-            try:
-                await stop_server_command()
-            except Exception as e:
-                print(f"Error stopping server: {e}")
-            finally:
-                writer.close()
-                await writer.wait_closed()
-            return
+    Summarizes the resource use of every server this session, writes it to RESOURCE_REPORT_DIR and prints
+    whether the instance is sized right for it.
 
-        # Close the socket connection
-        writer.close()
-        await writer.wait_closed()
-        
-
-async def stop_server_command():
-    """
-    Asynchronously sends the "stop" command to the Minecraft server via RCON.
-    
-    Raises:
-        ConnectionError: If unable to connect to the RCON server.
-        PermissionError: If RCON authentication fails.    
+    Returns:
+        dict | None: The report, or None if no samples were taken.
     """
-    host = os.getenv("RCON_HOST", "localhost")
-    port = int(os.getenv("RCON_PORT", "25575"))
-    password = os.getenv("RCON_SECRET", "123456")
-
+    summaries = {monitor.profile.name: monitor.profiler.summary() for monitor in monitors
+                 if monitor.profiler is not None and monitor.profiler.samples.total}
+    if not summaries:
+        return None
+    recommendation = RecommendSizing(list(summaries.values()), os.cpu_count() or 1, ReadMemoryTotal(),
+                                     SERVERS_DIR, instance_type)
+    report = {
+        "instanceId": INSTANCE_ID,
+        "created": time.time(),
+        "servers": summaries,
+        "recommendation": recommendation,
+    }
     try:
-        reader, writer = await asyncio.open_connection(host, port)
-    except Exception as e:
-        print(f"Could not connect to RCON server: {e}")
-        raise ConnectionError("Failed to connect to RCON server") 
-    
+        os.makedirs(RESOURCE_REPORT_DIR, exist_ok=True)
+        path = os.path.join(RESOURCE_REPORT_DIR, time.strftime("%Y%m%dT%H%M%SZ.json", time.gmtime()))
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Resource report written to {path}")
+    except OSError as e:
+        print(f"Failed to write the resource report: {e}")
+
+    print(f"The {instance_type or 'instance'} is {recommendation['instance']}"
+          + (f": {'; '.join(recommendation['reasons'])}." if recommendation["reasons"] else "."))
+    if "ebs_size_gib" in recommendation:
+        print(f"{recommendation['volume_used_bytes'] / 1024 ** 3:.1f} GiB of the volume is in use, "
+              f"an EBSSize of {recommendation['ebs_size_gib']} leaves room to grow.")
+    return report
+
+
+async def UploadResourceReport(client: S3Client | None, report: dict | None):
+    """
+    Copies the report to S3_BUCKET, so it can be read without logging into the stopped instance.
+    """
+    if client is None or report is None:
+        return
+    key = f"reports/{INSTANCE_ID}/{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(report['created']))}.json"
     try:
-        auth_request_id = random.randint(1, 2147483647)
-        auth_id, auth_type, _ = await rcon_send_and_recv(reader, writer, auth_request_id, 3, password)
-
-        # On auth failure, the server responds with request id = -1.
-        if auth_id == -1:
-            raise PermissionError("RCON authentication failed (request id = -1). Check RCON_SECRET")
-
-        if auth_id != auth_request_id or auth_type != 2:
-            raise PermissionError("Unexpected RCON auth response. Check RCON port/password and server config.")
-
-        cmd_request_id = random.randint(1, 2147483647)
-        await rcon_send_and_recv(reader, writer, cmd_request_id, 2, "stop")
-    finally:
-        writer.close()
-        await writer.wait_closed()
-
-
-async def rcon_send_and_recv(
-    reader: asyncio.StreamReader,
-    writer: asyncio.StreamWriter,
-    request_id: int,
-    packet_type: int,
-    payload: str,
-) -> tuple[int, int, str]:
-    payload_bytes = payload.encode("ascii")
-    body = struct.pack("<ii", request_id, packet_type) + payload_bytes + b"\x00\x00"
-    writer.write(struct.pack("<i", len(body)) + body)
-    await writer.drain()
-
-    # Read response
-    size_raw = await reader.readexactly(4)
-    (size,) = struct.unpack("<i", size_raw)
-    data = await reader.readexactly(size)
-
-    resp_id, resp_type = struct.unpack("<ii", data[:8])
-    # Payload is everything up to the first null byte after the header
-    payload_end = data.find(b"\x00", 8)
-    resp_payload = data[8:payload_end].decode("ascii", errors="replace") if payload_end != -1 else ""
-    return resp_id, resp_type, resp_payload
+        await client.request("PUT", key, body=json.dumps(report).encode("utf-8"),
+                             headers={"Content-Type": "application/json"})
+    except AWSRequestError as e:
+        print(f"Failed to upload the resource report: {e}")
 
 
 async def RunAWSStopInstance():
     """
-    Stops the EC2 instance using AWS CLI.
+    Stops the EC2 instance through the EC2 API, using the instance role's credentials.
+    Halts the instance instead if the API call fails.
     """
     try:
         print(f"Stopping EC2 instance {INSTANCE_ID}...")
-        subprocess.run(
-            ["aws", "ec2", "stop-instances", "--instance-ids", INSTANCE_ID], 
-            text=True, 
-            check=True, 
-            capture_output=True
-            )
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to stop EC2 instance: {e.stderr}")
+        await EC2Client().stop_instances([INSTANCE_ID])
+    except Exception as e:
+        # Whatever went wrong, the instance must not be left running and billing
+        print(f"Failed to stop EC2 instance: {e!r}")
         print("Halting the server instead.")
         subprocess.run(["sudo", "shutdown", "-h", "now"])
 
 async def main():
-    await run_player_count_client()
+    if METRICS_PORT:
+        await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        print(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    profiles = LoadProfiles()
+    print(f"Monitoring {len(profiles)} server(s): "
+          + ", ".join(f"{profile.name} (port {profile.port}, pid {profile.pid})" for profile in profiles))
 
-    # Wait for the server process to exit before stopping the EC2 instance
-    while True:
-        await asyncio.sleep(2)
-        if not psutil.pid_exists(SERVER_PID):
-            break
+    status = StatusPublisher(None, INSTANCE_ID)
+    if S3_BUCKET and STATUS_SNAPSHOT:
+        metadata = InstanceMetadata()
+        try:
+            region = os.getenv("AWS_REGION") or await with_retries(metadata.get_region)
+            status.client = S3Client(S3_BUCKET, region, metadata.get_credentials)
+        except AWSRequestError as e:
+            print(f"Status snapshots are disabled, the region could not be read: {e}")
+    for profile in profiles:
+        status.update(profile.name, state="starting")
+    publisher = asyncio.create_task(status.run())
+    instance_type = asyncio.create_task(GetInstanceType()) if RESOURCE_PROFILER or BOOT_TIMELINE else None
+
+    async def record_boot_timeline():
+        timeline = BootTimeline(float(SERVICE_STARTED) if SERVICE_STARTED else None,
+                                ParseBootTimes(SERVER_SPAWN_TIMES))
+        try:
+            await asyncio.gather(*(WatchServerStartup(timeline, profile.name, "localhost", profile.port,
+                                                      os.path.join(profile.server_dir, "logs", "latest.log"))
+                                   for profile in profiles))
+        finally:
+            # Servers that exited or were stopped before they were up are recorded as far as they got
+            PrintBootTimeline(timeline)
+            record = {
+                "instanceId": INSTANCE_ID,
+                "instanceType": instance_type.result() if instance_type.done() else None,
+                **timeline.to_dict(),
+            }
+            try:
+                AppendTimelineHistory(BOOT_TIMELINE_HISTORY, record)
+            except OSError as e:
+                print(f"Failed to write the boot timeline: {e}")
+            status.set_boot_timeline(record)
+
+    boot_timeline = asyncio.create_task(record_boot_timeline()) if BOOT_TIMELINE else None
+
+    # Profiles whose world could not be moved out of RAM, stopping the instance would lose it
+    unsaved: list[str] = []
+
+    async def monitor(server: ServerMonitor):
+        profile = server.profile
+        await server.run()
+        if server.ram_disk:
+            with shutdown_phase("ram_disk_restore", profile.name):
+                if not await server.restore_ram_disk():
+                    unsaved.append(profile.name)
+        SERVERS_RUNNING.inc(-1)
+        # Names are only listed for servers probed with Query
+        players = [] if status.servers.get(profile.name, ServerStatus()).players is not None else None
+        status.update(profile.name, state="stopped", players_online=0, players=players)
+        print(f"[{profile.name}] Server has exited.")
+
+    # Each server is stopped on its own, the instance only once every server has exited
+    SERVERS_RUNNING.set(len(profiles))
+    monitors = [ServerMonitor(profile, status=status) for profile in profiles]
+    await asyncio.gather(*(monitor(server) for server in monitors))
+
+    if boot_timeline is not None:
+        boot_timeline.cancel()
+        await asyncio.gather(boot_timeline, return_exceptions=True)
+    publisher.cancel()
+    await asyncio.gather(publisher, return_exceptions=True)
+    report = None
+    if instance_type is not None:
+        report = WriteResourceReport(monitors, await instance_type)
+    if unsaved:
+        await asyncio.gather(status.publish(), UploadResourceReport(status.client, report))
+        print(f"The worlds of {', '.join(unsaved)} are only in {RAM_DISK_DIR}, leaving the instance running so "
+              "they can be recovered. Restarting start-minecraft.service syncs them to the volume.")
+        exit(1)
+    with shutdown_phase("stop_instance"):
+        # The lambda serves the final snapshot until it expires, and then asks EC2
+        await asyncio.gather(status.publish(), UploadResourceReport(status.client, report), RunAWSStopInstance())
+    exit(0)
 
-    await RunAWSStopInstance()
-    exit(0)    
-    
 
 if __name__ == "__main__":
     # Run the player count monitoring client
     asyncio.run(main())
-
@@ -0,0 +1,360 @@
+"""
+Wake Proxy
+Listens on a server's public port from the moment the service starts, so players see the server as
+starting instead of offline while the JVM starts and loads the world.
+
+With WAKE_PROXY=1, bootstrap.py moves the server to an internal port, WAKE_PROXY_PORT_OFFSET above the
+public one, and ./start-server.sh starts a proxy for each profile before the server. Every connection is
+passed through to the internal port once the server accepts it. Until then, status pings are answered with
+a "starting" response built once from the last status the real server gave, and players who try to join
+are told to come back in a minute.
+
+Traffic is relayed with splice(2) through a pipe, so the bytes move between the two sockets inside the
+kernel without being copied into Python. Where splice is not available, each direction reads into a single
+reused buffer instead.
+
+The server sees every player connecting from 127.0.0.1, so IP bans do not work behind the proxy, and
+prevent-proxy-connections must stay off in server.properties.
+
+Usage:
+    python wake_proxy.py <server dir>
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sys
+
+from minecraft_protocol import (CONTINUE_BIT, MAX_PACKET_LENGTH, STATUS_NEXT_STATE, STATUS_PACKET_ID,
+                                VARINT_MAX_BYTES, MakePacket, PacketBuffer, encode_string, query_status)
+from server_profiles import DEFAULT_SERVER_PORT, ReadServerProperties
+
+# The server listens this far above the public port when the proxy is in front of it
+WAKE_PROXY_PORT_OFFSET = int(os.getenv("WAKE_PROXY_PORT_OFFSET", "10000"))
+# The last status of the real server, the "starting" response is built from it
+STATUS_CACHE_NAME = "wake-proxy-status.json"
+STARTING_VERSION_NAME = "Starting..."
+STARTING_DESCRIPTION = "§eThe server is starting, it will be ready in a minute"
+STARTING_DISCONNECT = "The server is starting, please try again in a minute."
+PING_PACKET_ID = 0x01
+LOGIN_DISCONNECT_PACKET_ID = 0x00
+# The first byte of the pre-1.7 Server List Ping, which has no length prefix
+LEGACY_PING = 0xFE
+HANDSHAKE_TIMEOUT = 10.0
+READ_SIZE = 4096
+# Bytes moved per splice, the size of a default pipe buffer
+SPLICE_SIZE = 64 * 1024
+RELAY_BUFFER_SIZE = 64 * 1024
+USE_SPLICE = hasattr(os, "splice") and os.getenv("WAKE_PROXY_SPLICE", "1") != "0"
+
+
+def BuildStartingStatus(cached: dict | None) -> bytes:
+    """
+    Builds the status response sent while the server is starting.
+
+    Args:
+        cached (dict | None): The last status response of the real server, for its favicon and slots.
+
+    Returns:
+        bytes: The framed status response packet.
+    """
+    cached = cached or {}
+    status = {
+        # A protocol no client speaks, so launchers show the version name in place of the ping bars
+        "version": {"name": STARTING_VERSION_NAME, "protocol": -1},
+        "players": {"max": cached.get("players", {}).get("max", 0), "online": 0},
+        "description": {"text": STARTING_DESCRIPTION},
+    }
+    if cached.get("favicon"):
+        status["favicon"] = cached["favicon"]
+    return MakePacket(STATUS_PACKET_ID, encode_string(json.dumps(status, separators=(",", ":"))))
+
+
+def _frame_length(buffer: bytes | bytearray) -> tuple[int, int] | None:
+    # The packet length and the size of its VarInt prefix, None until the whole prefix has arrived
+    for index in range(min(len(buffer), VARINT_MAX_BYTES)):
+        if buffer[index] < CONTINUE_BIT:
+            return PacketBuffer(bytes(buffer[:index + 1])).read_varint(), index + 1
+    if len(buffer) >= VARINT_MAX_BYTES:
+        raise ValueError("VarInt is too big")
+    return None
+
+
+class _SocketReader:
+    """
+    Reads whole packets off a non-blocking socket, keeping everything it received so it can be forwarded.
+    """
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.received = bytearray()
+        self.position = 0
+
+    async def _fill(self):
+        data = await asyncio.get_running_loop().sock_recv(self.sock, READ_SIZE)
+        if not data:
+            raise ConnectionError("Client closed the connection")
+        self.received += data
+
+    async def peek_byte(self) -> int:
+        while len(self.received) <= self.position:
+            await self._fill()
+        return self.received[self.position]
+
+    async def read_packet(self) -> tuple[int, PacketBuffer]:
+        while (frame := _frame_length(self.received[self.position:])) is None:
+            await self._fill()
+        length, prefix = frame
+        if length <= 0 or length > MAX_PACKET_LENGTH:
+            raise ValueError(f"Invalid packet length {length}")
+        end = self.position + prefix + length
+        while len(self.received) < end:
+            await self._fill()
+        packet = PacketBuffer(bytes(self.received[self.position + prefix:end]))
+        self.position = end
+        return packet.read_varint(), packet
+
+
+async def _wait_fd(add, remove, fd: int):
+    # Registered only while waiting, the loop polls level triggered and would spin on an fd that stays ready
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    add(fd, lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        remove(fd)
+
+
+async def _splice(source: socket.socket, dest: socket.socket):
+    loop = asyncio.get_running_loop()
+    read_fd, write_fd = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    try:
+        while True:
+            try:
+                pending = os.splice(source.fileno(), write_fd, SPLICE_SIZE, flags=flags)
+            except BlockingIOError:
+                await _wait_fd(loop.add_reader, loop.remove_reader, source.fileno())
+                continue
+            if pending == 0:
+                return
+            # The pipe is emptied before reading more, so the source can only block on itself
+            while pending:
+                try:
+                    pending -= os.splice(read_fd, dest.fileno(), pending, flags=flags)
+                except BlockingIOError:
+                    await _wait_fd(loop.add_writer, loop.remove_writer, dest.fileno())
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+async def _copy(source: socket.socket, dest: socket.socket):
+    loop = asyncio.get_running_loop()
+    buffer = bytearray(RELAY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    while size := await loop.sock_recv_into(source, buffer):
+        await loop.sock_sendall(dest, view[:size])
+
+
+async def _relay(source: socket.socket, dest: socket.socket):
+    try:
+        await (_splice if USE_SPLICE else _copy)(source, dest)
+    finally:
+        # Passes the end of the stream on, the other direction may still have data to deliver
+        try:
+            dest.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+async def _read_handshake(reader: _SocketReader) -> int | None:
+    # The state the client asks for, None for a legacy ping or a client that is not speaking the protocol
+    if await reader.peek_byte() == LEGACY_PING:
+        return None
+    packet_id, handshake = await reader.read_packet()
+    if packet_id != 0:
+        return None
+    handshake.read_varint()
+    handshake.read_string()
+    handshake.read_bytes(2)
+    return handshake.read_varint()
+
+
+async def _answer_status(reader: _SocketReader, status: bytes):
+    loop = asyncio.get_running_loop()
+    while True:
+        packet_id, packet = await reader.read_packet()
+        if packet_id == STATUS_PACKET_ID:
+            await loop.sock_sendall(reader.sock, status)
+        elif packet_id == PING_PACKET_ID:
+            await loop.sock_sendall(reader.sock, MakePacket(PING_PACKET_ID, bytes(packet.read_bytes(8))))
+            return
+
+
+class WakeProxy:
+    """
+    Proxies one server's public port, see the module docstring.
+    """
+    def __init__(self, public_port: int, backend_port: int, backend_host: str = "127.0.0.1",
+                 status_cache: str | None = None, listen_host: str = ""):
+        self.public_port = public_port
+        self.backend_port = backend_port
+        self.backend_host = backend_host
+        self.listen_host = listen_host
+        self.status_cache = status_cache
+        cached = None
+        if status_cache is not None:
+            try:
+                with open(status_cache, encoding="utf-8") as f:
+                    cached = json.load(f)
+            except (OSError, ValueError):
+                pass
+        self.starting_status = BuildStartingStatus(cached)
+        self.starting_disconnect = MakePacket(LOGIN_DISCONNECT_PACKET_ID,
+                                              encode_string(json.dumps({"text": STARTING_DISCONNECT})))
+        self.listener: socket.socket | None = None
+        # Connections passed through and answered while starting
+        self.relayed = 0
+        self.answered = 0
+        self._status_cached = False
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(self):
+        """
+        Starts listening. A public port of 0 is assigned by the OS and written back to public_port.
+        """
+        if not self.listen_host and socket.has_dualstack_ipv6():
+            self.listener = socket.create_server(("", self.public_port), family=socket.AF_INET6,
+                                                 dualstack_ipv6=True)
+        else:
+            self.listener = socket.create_server((self.listen_host, self.public_port))
+        self.listener.setblocking(False)
+        self.public_port = self.listener.getsockname()[1]
+
+    async def serve(self):
+        """
+        Accepts connections until cancelled.
+        """
+        if self.listener is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                client, _ = await loop.sock_accept(self.listener)
+                task = asyncio.create_task(self.handle(client))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            self.listener.close()
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _connect_backend(self) -> socket.socket | None:
+        backend = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        backend.setblocking(False)
+        try:
+            await asyncio.get_running_loop().sock_connect(backend, (self.backend_host, self.backend_port))
+        except OSError:
+            backend.close()
+            return None
+        backend.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return backend
+
+    async def handle(self, client: socket.socket):
+        """
+        Passes one connection through to the server, or answers it while the server is starting.
+        """
+        client.setblocking(False)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        backend = None
+        try:
+            reader = _SocketReader(client)
+            try:
+                next_state = await asyncio.wait_for(_read_handshake(reader), HANDSHAKE_TIMEOUT)
+            except (ConnectionError, ValueError, asyncio.TimeoutError):
+                return
+
+            backend = await self._connect_backend()
+            if backend is None:
+                await self.answer_starting(client, reader, next_state)
+                return
+            if not self._status_cached and self.status_cache is not None:
+                self._status_cached = True
+                self._spawn(self.cache_status())
+
+            self.relayed += 1
+            # The handshake and anything sent after it are forwarded as they were received
+            await asyncio.get_running_loop().sock_sendall(backend, reader.received)
+            relays = [asyncio.create_task(_relay(client, backend)), asyncio.create_task(_relay(backend, client))]
+            try:
+                await asyncio.gather(*relays)
+            finally:
+                # A reset in one direction ends the other, before the sockets are closed under it
+                for relay in relays:
+                    relay.cancel()
+                await asyncio.gather(*relays, return_exceptions=True)
+        except OSError:
+            pass
+        finally:
+            client.close()
+            if backend is not None:
+                backend.close()
+
+    async def answer_starting(self, client: socket.socket, reader: _SocketReader, next_state: int | None):
+        """
+        Answers a status ping with the starting response, and turns players away until the server is up.
+        """
+        self.answered += 1
+        try:
+            if next_state == STATUS_NEXT_STATE:
+                await asyncio.wait_for(_answer_status(reader, self.starting_status), HANDSHAKE_TIMEOUT)
+            elif next_state is not None:
+                # Login and transfer both start in the login state, where a disconnect shows its reason
+                await asyncio.get_running_loop().sock_sendall(client, self.starting_disconnect)
+        except (ConnectionError, ValueError, asyncio.TimeoutError):
+            pass
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def cache_status(self):
+        """
+        Saves the real server's status, so the next starting response has its favicon and slots.
+        """
+        for _ in range(10):
+            try:
+                response = await query_status(self.backend_host, self.backend_port, 5.0)
+                status = json.loads(response.raw)
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                await asyncio.sleep(5.0)
+                continue
+            try:
+                with open(f"{self.status_cache}.tmp", "w", encoding="utf-8") as f:
+                    json.dump(status, f)
+                os.replace(f"{self.status_cache}.tmp", self.status_cache)
+            except OSError as e:
+                print(f"Failed to cache the server status: {e}")
+            return
+
+
+async def main(server_dir: str):
+    properties = ReadServerProperties(server_dir)
+    backend_port = int(properties.get("server-port") or DEFAULT_SERVER_PORT + WAKE_PROXY_PORT_OFFSET)
+    proxy = WakeProxy(backend_port - WAKE_PROXY_PORT_OFFSET, backend_port,
+                      status_cache=os.path.join(server_dir, STATUS_CACHE_NAME))
+    await proxy.start()
+    print(f"Proxying port {proxy.public_port} to {backend_port} "
+          f"({'splice' if USE_SPLICE else 'buffered copy'}) for {server_dir}", flush=True)
+    await proxy.serve()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(f"Usage: {sys.argv[0]} <server dir>")
+        sys.exit(2)
+    asyncio.run(main(sys.argv[1]))
@@ -0,0 +1,527 @@
+"""
+World Backup
+Streaming, deduplicating backup engine for Minecraft worlds.
+
+Files are split into content defined chunks and each chunk is identified by its SHA-256 hash. Chunks that
+an earlier backup already stored are skipped, new chunks are appended to a pack object that is streamed to
+the store as a multipart upload, with a bounded number of parts in flight. Nothing is staged on disk and
+memory use is bounded by the number of workers times the part size.
+
+Chunk boundaries are only placed on 4 KiB block edges, chosen by the CRC32 of the block. Region files are
+made of 4 KiB sectors, so when a region file changes the unchanged sectors still land in the same chunks,
+and the CRC runs in C so chunking is never the bottleneck.
+
+Every backup writes a manifest listing each file with its chunks and where they are stored, so a world
+can be restored from the manifest alone.
+
+Usage:
+    python3 world_backup.py backup <world_dir> <destination>
+    python3 world_backup.py restore <destination> <output_dir> [--manifest KEY]
+
+Destinations are either a local directory or s3://bucket/prefix.
+"""
+
+import argparse
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import functools
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import Awaitable, BinaryIO, Callable
+import uuid
+import zlib
+
+from aws_client import S3Client, cli_credentials
+
+BLOCK_SIZE = 4096
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+# A block ends a chunk when the low bits of its CRC are zero, giving ~1 MiB past the minimum on average
+BOUNDARY_MASK = (1 << 8) - 1
+READ_SIZE = 4 * 1024 * 1024
+# S3 requires every part but the last to be at least 5 MiB
+PART_SIZE = 8 * 1024 * 1024
+DEFAULT_WORKERS = 8
+
+INDEX_KEY = "index.json"
+LATEST_MANIFEST_KEY = "manifests/LATEST"
+
+
+def ChunkStream(stream: BinaryIO):
+    """
+    Splits a stream into content defined chunks, reading it as it arrives.
+
+    Args:
+        stream (BinaryIO): The stream to split, e.g. an open file or an S3 response.
+
+    Yields:
+        bytes: The chunks of the stream, in order.
+    """
+    chunk = bytearray()
+    while data := stream.read(READ_SIZE):
+        view = memoryview(data)
+        position = 0
+        while position < len(view):
+            # Nothing can end a chunk below the minimum size, so copy up to it in one go
+            if len(chunk) < MIN_CHUNK_SIZE - BLOCK_SIZE:
+                take = min(MIN_CHUNK_SIZE - BLOCK_SIZE - len(chunk), len(view) - position)
+                chunk += view[position:position + take]
+                position += take
+                continue
+
+            block = view[position:position + BLOCK_SIZE]
+            chunk += block
+            position += len(block)
+            if len(chunk) >= MAX_CHUNK_SIZE or zlib.crc32(block) & BOUNDARY_MASK == 0:
+                yield bytes(chunk)
+                chunk = bytearray()
+    if chunk:
+        yield bytes(chunk)
+
+
+def ChunkFile(path: str):
+    """
+    Splits a file into content defined chunks, reading it in a streaming fashion.
+
+    Args:
+        path (str): The file to split.
+
+    Yields:
+        bytes: The chunks of the file, in order.
+    """
+    with open(path, "rb") as f:
+        yield from ChunkStream(f)
+
+
+@dataclass
+class BackupFile:
+    """
+    A file to back up. read runs a function on a worker thread with a stream of the file's data, and may
+    call it again with a fresh stream if reading fails part way.
+    """
+    path: str
+    mtime: float
+    mode: int
+    read: Callable[[Callable[[BinaryIO], None]], Awaitable[None]]
+
+
+def _read_local_file(path: str, consume: Callable[[BinaryIO], None]):
+    with open(path, "rb") as f:
+        consume(f)
+
+
+def ListBackupFiles(world_dir: str) -> list[BackupFile]:
+    """
+    Lists every file below a directory for BackupWorld.
+
+    Returns:
+        list[BackupFile]: The files, with paths relative to the directory using forward slashes.
+    """
+    files = []
+    for dir_path, dir_names, file_names in os.walk(world_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            path = os.path.join(dir_path, file_name)
+            stat = os.stat(path)
+            files.append(BackupFile(
+                path=os.path.relpath(path, world_dir).replace(os.sep, "/"),
+                mtime=stat.st_mtime,
+                mode=stat.st_mode & 0o777,
+                read=functools.partial(asyncio.to_thread, _read_local_file, path)))
+    return files
+
+
+class LocalChunkStore:
+    """
+    Stores backups in a local directory.
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    async def read(self, key: str) -> bytes | None:
+        try:
+            return await asyncio.to_thread(_read_file, self._path(key))
+        except FileNotFoundError:
+            return None
+
+    async def write(self, key: str, data: bytes):
+        await asyncio.to_thread(_write_file, self._path(key), data)
+
+    async def read_range(self, key: str, offset: int, length: int) -> bytes:
+        return await asyncio.to_thread(_read_file, self._path(key), offset, length)
+
+    async def open_pack(self, key: str) -> "LocalPackUpload":
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return LocalPackUpload(path)
+
+
+class LocalPackUpload:
+    def __init__(self, path: str):
+        self.path = path
+        self._temp_path = path + ".partial"
+        open(self._temp_path, "wb").close()
+
+    async def upload_part(self, part_number: int, offset: int, data: bytes):
+        await asyncio.to_thread(_write_file, self._temp_path, data, offset)
+
+    async def complete(self):
+        os.replace(self._temp_path, self.path)
+
+    async def abort(self):
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+def _read_file(path: str, offset: int = 0, length: int = -1) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def _write_file(path: str, data: bytes, offset: int | None = None):
+    if offset is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    else:
+        with open(path, "r+b") as f:
+            f.seek(offset)
+            f.write(data)
+
+
+class S3ChunkStore:
+    """
+    Stores backups in an S3 bucket below a key prefix.
+    """
+    def __init__(self, client: S3Client, prefix: str = ""):
+        self.client = client
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    async def read(self, key: str) -> bytes | None:
+        return await self.client.get_object(self.prefix + key)
+
+    async def write(self, key: str, data: bytes):
+        await self.client.put_object(self.prefix + key, data)
+
+    async def read_range(self, key: str, offset: int, length: int) -> bytes:
+        data = await self.client.get_object(self.prefix + key, (offset, length))
+        if data is None:
+            raise FileNotFoundError(f"s3://{self.client.bucket}/{self.prefix}{key}")
+        return data
+
+    async def open_pack(self, key: str) -> "S3PackUpload":
+        key = self.prefix + key
+        return S3PackUpload(self.client, key, await self.client.create_multipart_upload(key))
+
+
+class S3PackUpload:
+    def __init__(self, client: S3Client, key: str, upload_id: str):
+        self.client = client
+        self.key = key
+        self.upload_id = upload_id
+        self.etags: dict[int, str] = {}
+
+    async def upload_part(self, part_number: int, offset: int, data: bytes):
+        self.etags[part_number] = await self.client.upload_part(self.key, self.upload_id, part_number, data)
+
+    async def complete(self):
+        await self.client.complete_multipart_upload(
+            self.key, self.upload_id, [self.etags[number] for number in sorted(self.etags)])
+
+    async def abort(self):
+        await self.client.abort_multipart_upload(self.key, self.upload_id)
+
+
+class PackWriter:
+    """
+    Appends chunks to a pack and streams it to the store part by part.
+    At most `workers` parts are buffered or uploading at any time.
+    """
+    def __init__(self, store: LocalChunkStore | S3ChunkStore, key: str, workers: int):
+        self.store = store
+        self.key = key
+        self.size = 0
+        self._upload = None
+        self._buffer = bytearray()
+        self._flushed = 0
+        self._part_number = 0
+        self._slots = asyncio.Semaphore(workers)
+        # Parts must be numbered in the order their bytes appear in the pack
+        self._flush_lock = asyncio.Lock()
+        self._tasks: list[asyncio.Task] = []
+
+    def add(self, data: bytes) -> tuple[int, int]:
+        """
+        Appends a chunk to the pack.
+
+        Returns:
+            tuple[int, int]: The offset and length of the chunk within the pack.
+        """
+        offset = self.size
+        self._buffer += data
+        self.size += len(data)
+        return offset, len(data)
+
+    async def flush(self, final: bool = False):
+        """
+        Uploads every full part in the buffer, or everything if this is the final flush.
+        Waits for an upload slot before starting each part, which is what bounds memory.
+        """
+        async with self._flush_lock:
+            while len(self._buffer) >= PART_SIZE or (final and self._buffer):
+                if self._upload is None:
+                    self._upload = await self.store.open_pack(self.key)
+                await self._slots.acquire()
+                part = bytes(self._buffer[:PART_SIZE])
+                del self._buffer[:PART_SIZE]
+                self._part_number += 1
+                self._tasks.append(asyncio.create_task(self._upload_part(self._part_number, self._flushed, part)))
+                self._flushed += len(part)
+                # Surface upload failures as soon as possible
+                for task in [task for task in self._tasks if task.done()]:
+                    self._tasks.remove(task)
+                    task.result()
+
+    async def _upload_part(self, part_number: int, offset: int, data: bytes):
+        try:
+            await self._upload.upload_part(part_number, offset, data)
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        """
+        Uploads the rest of the buffer and completes the pack. Does nothing if no chunks were added.
+        """
+        await self.flush(final=True)
+        if self._upload is None:
+            return
+        await asyncio.gather(*self._tasks)
+        await self._upload.complete()
+
+    async def abort(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._upload is not None:
+            await self._upload.abort()
+
+
+@dataclass
+class BackupResult:
+    manifest_key: str
+    files: int
+    total_bytes: int
+    new_chunks: int
+    uploaded_bytes: int
+    elapsed: float
+
+
+async def _load_json(store, key: str, default):
+    data = await store.read(key)
+    return json.loads(data) if data is not None else default
+
+
+async def BackupWorld(source: str | list[BackupFile], store: LocalChunkStore | S3ChunkStore,
+                      workers: int = DEFAULT_WORKERS) -> BackupResult:
+    """
+    Backs up a directory, storing only chunks that no earlier backup in the store already has.
+    Each file is chunked as it is read, so files can be streamed from anywhere, e.g. ListSyncedWorlds in
+    ./world_sync.py backs up worlds straight from the bucket they are synced to.
+
+    Args:
+        source (str | list[BackupFile]): The directory to back up, or the files to back up.
+        store (LocalChunkStore | S3ChunkStore): Where to store the backup.
+        workers (int): The number of files read and parts uploaded concurrently.
+
+    Returns:
+        BackupResult: The manifest key and statistics about the backup.
+    """
+    started = time.monotonic()
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    backup_id = f"{timestamp}-{uuid.uuid4().hex[:8]}"
+    index: dict[str, list] = await _load_json(store, INDEX_KEY, {})
+    pack_key = f"packs/{backup_id}.pack"
+    writer = PackWriter(store, pack_key, workers)
+    new_chunks: dict[str, list] = {}
+    files: list[dict] = []
+    file_slots = asyncio.Semaphore(workers)
+    loop = asyncio.get_running_loop()
+    # Set once the backup fails, the readers still running on worker threads must not add to the pack
+    stopped = False
+    adding: set[asyncio.Task] = set()
+
+    async def add_chunk(entry: dict, chunk: bytes, digest: str):
+        if stopped:
+            raise asyncio.CancelledError()
+        adding.add(asyncio.current_task())
+        try:
+            entry["chunks"].append(digest)
+            entry["size"] += len(chunk)
+            # Locations are assigned before any await, so a chunk shared by two files is only stored once
+            if digest not in index and digest not in new_chunks:
+                offset, length = writer.add(chunk)
+                new_chunks[digest] = [pack_key, offset, length]
+                await writer.flush()
+        finally:
+            adding.discard(asyncio.current_task())
+
+    def chunk_stream(entry: dict, stream: BinaryIO):
+        # Runs on a worker thread. Each chunk waits for the event loop to take it, which holds back
+        # reading while the pack's upload slots are full. A retried read starts the file over.
+        entry["chunks"] = []
+        entry["size"] = 0
+        for chunk in ChunkStream(stream):
+            digest = hashlib.sha256(chunk).hexdigest()
+            asyncio.run_coroutine_threadsafe(add_chunk(entry, chunk, digest), loop).result()
+
+    async def backup_file(file: BackupFile):
+        async with file_slots:
+            entry = {"path": file.path, "size": 0, "mtime": file.mtime, "mode": file.mode, "chunks": []}
+            files.append(entry)
+            await file.read(functools.partial(chunk_stream, entry))
+
+    if isinstance(source, str):
+        source = await asyncio.to_thread(ListBackupFiles, source)
+
+    tasks = [asyncio.create_task(backup_file(file)) for file in source]
+    try:
+        await asyncio.gather(*tasks)
+        await writer.close()
+    except BaseException:
+        # The other files must stop adding to the pack before it is aborted
+        stopped = True
+        for task in tasks + list(adding):
+            task.cancel()
+        await asyncio.gather(*tasks, *adding, return_exceptions=True)
+        await writer.abort()
+        raise
+
+    index.update(new_chunks)
+    files.sort(key=lambda entry: entry["path"])
+    used = {digest for entry in files for digest in entry["chunks"]}
+    manifest = {
+        "version": 1,
+        "created": timestamp,
+        "files": files,
+        "chunks": {digest: index[digest] for digest in sorted(used)},
+    }
+    manifest_key = f"manifests/{backup_id}.json"
+    await store.write(manifest_key, json.dumps(manifest, separators=(",", ":")).encode("utf-8"))
+    await store.write(INDEX_KEY, json.dumps(index, separators=(",", ":")).encode("utf-8"))
+    await store.write(LATEST_MANIFEST_KEY, manifest_key.encode("utf-8"))
+
+    return BackupResult(
+        manifest_key=manifest_key,
+        files=len(files),
+        total_bytes=sum(entry["size"] for entry in files),
+        new_chunks=len(new_chunks),
+        uploaded_bytes=writer.size,
+        elapsed=time.monotonic() - started)
+
+
+async def RestoreWorld(store: LocalChunkStore | S3ChunkStore, output_dir: str, manifest_key: str | None = None,
+                       workers: int = DEFAULT_WORKERS) -> dict:
+    """
+    Rebuilds a directory from a backup manifest, verifying the hash of every chunk.
+
+    Args:
+        store (LocalChunkStore | S3ChunkStore): The store holding the backup.
+        output_dir (str): The directory to restore into.
+        manifest_key (str | None): The manifest to restore, defaults to the latest backup.
+        workers (int): The number of files restored concurrently.
+
+    Returns:
+        dict: The manifest that was restored.
+
+    Raises:
+        ValueError: If there is no backup or a chunk fails verification.
+    """
+    if manifest_key is None:
+        latest = await store.read(LATEST_MANIFEST_KEY)
+        if latest is None:
+            raise ValueError("The store does not contain any backups")
+        manifest_key = latest.decode("utf-8").strip()
+    manifest = await _load_json(store, manifest_key, None)
+    if manifest is None:
+        raise ValueError(f"Manifest {manifest_key} not found")
+
+    file_slots = asyncio.Semaphore(workers)
+
+    async def restore_file(entry: dict):
+        async with file_slots:
+            path = os.path.join(output_dir, *entry["path"].split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                for digest in entry["chunks"]:
+                    pack, offset, length = manifest["chunks"][digest]
+                    chunk = await store.read_range(pack, offset, length)
+                    if hashlib.sha256(chunk).hexdigest() != digest:
+                        raise ValueError(f"Chunk {digest} of {entry['path']} failed verification")
+                    await asyncio.to_thread(f.write, chunk)
+            os.chmod(path, entry["mode"])
+            os.utime(path, (entry["mtime"], entry["mtime"]))
+
+    await asyncio.gather(*(restore_file(entry) for entry in manifest["files"]))
+    return manifest
+
+
+def OpenChunkStore(destination: str, region: str | None = None) -> LocalChunkStore | S3ChunkStore:
+    """
+    Opens a store from a local path or an s3://bucket/prefix URL.
+
+    Args:
+        destination (str): The local directory or S3 URL.
+        region (str | None): The region of the bucket, defaults to AWS_REGION.
+    """
+    if not destination.startswith("s3://"):
+        return LocalChunkStore(destination)
+
+    bucket, _, prefix = destination[len("s3://"):].partition("/")
+    region = region or os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION")
+    if not region:
+        raise ValueError("A region is required for S3 destinations, set AWS_REGION or pass --region")
+    return S3ChunkStore(S3Client(bucket, region, cli_credentials), prefix)
+
+
+def FormatSize(size: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--region", help="The region of the destination bucket, defaults to AWS_REGION.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    commands = parser.add_subparsers(dest="command", required=True)
+    backup_parser = commands.add_parser("backup")
+    backup_parser.add_argument("world_dir")
+    backup_parser.add_argument("destination")
+    restore_parser = commands.add_parser("restore")
+    restore_parser.add_argument("destination")
+    restore_parser.add_argument("output_dir")
+    restore_parser.add_argument("--manifest")
+    args = parser.parse_args()
+
+    store = OpenChunkStore(args.destination, args.region)
+    if args.command == "backup":
+        result = asyncio.run(BackupWorld(args.world_dir, store, args.workers))
+        print(f"Backed up {result.files} files ({FormatSize(result.total_bytes)}) in {result.elapsed:.1f}s, "
+              f"uploaded {result.new_chunks} new chunks ({FormatSize(result.uploaded_bytes)}).")
+        print(f"Manifest: {result.manifest_key}")
+    else:
+        manifest = asyncio.run(RestoreWorld(store, args.output_dir, args.manifest, args.workers))
+        print(f"Restored {len(manifest['files'])} files from the backup made at {manifest['created']}.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+World Sync
+Keeps an off-instance copy of a Minecraft world in S3 by uploading only the files that changed.
+
+Only the files needed to rebuild the world are synced: region files (terrain, entities and points of
+interest for every dimension), player data and the level files. A manifest of each file's size, mtime and
+SHA-256 is kept next to the server and in the bucket. Files whose size and mtime match the manifest are
+skipped without being read, files that were touched but not changed are hashed and skipped, and files
+that disappeared from the world are deleted from the bucket.
+
+The world must not be written to while it syncs, see ServerMonitor.save_and_sync_world in ./stop-server.py.
+ListSyncedWorlds lists the synced worlds for world_backup.py, e.g. to back them up before the instance is destroyed.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import functools
+import hashlib
+import json
+import os
+import time
+
+from aws_client import S3Client
+from world_backup import BackupFile
+
+# Level files at the root of the world directory
+LEVEL_FILES = {"level.dat", "level.dat_old"}
+# Directories of .mca files, found in every dimension (world/, world/DIM-1/, world/dimensions/<ns>/<name>/)
+REGION_DIRS = {"region", "entities", "poi"}
+# Directories of .dat files, player data plus maps, raids and other saved data
+DATA_DIRS = {"playerdata", "data"}
+MANIFEST_NAME = "manifest.json"
+DEFAULT_WORKERS = 8
+
+
+@dataclass
+class SyncResult:
+    files: int
+    uploaded: int
+    uploaded_bytes: int
+    deleted: int
+    elapsed: float
+
+
+def IsWorldFile(path: str) -> bool:
+    """
+    Args:
+        path (str): A path relative to the world directory, using forward slashes.
+
+    Returns:
+        bool: True if the file is synced.
+    """
+    if path in LEVEL_FILES:
+        return True
+    parent, _, name = path.rpartition("/")
+    parent = parent.rpartition("/")[2]
+    return ((parent in REGION_DIRS and name.endswith(".mca"))
+            or (parent in DATA_DIRS and name.endswith(".dat")))
+
+
+def ListWorldFiles(world_dir: str) -> list[str]:
+    """
+    Lists the files in a world that are synced.
+
+    Returns:
+        list[str]: The paths of the files relative to the world directory, using forward slashes.
+    """
+    paths = []
+    for dir_path, dir_names, file_names in os.walk(world_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            path = os.path.relpath(os.path.join(dir_path, file_name), world_dir).replace(os.sep, "/")
+            if IsWorldFile(path):
+                paths.append(path)
+    return paths
+
+
+def LoadSyncManifest(path: str) -> dict[str, dict]:
+    """
+    Loads the manifest from the last sync, returning an empty manifest if there is none.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def SaveSyncManifest(path: str, files: dict[str, dict]) -> bytes:
+    """
+    Writes the manifest atomically, so an interrupted sync never leaves a truncated manifest behind.
+
+    Returns:
+        bytes: The encoded manifest.
+    """
+    data = json.dumps({"version": 1, "files": files}, indent=1, sort_keys=True).encode("utf-8")
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    return data
+
+
+def _read_changed_file(path: str, entry: dict | None) -> tuple[dict, bytes | None]:
+    # Runs on a worker thread. Returns the new manifest entry, and the file's data if it has to be uploaded.
+    stat = os.stat(path)
+    if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry, None
+
+    with open(path, "rb") as f:
+        data = f.read()
+    new_entry = {"size": len(data), "mtime_ns": stat.st_mtime_ns, "sha256": hashlib.sha256(data).hexdigest()}
+    if entry is not None and entry["sha256"] == new_entry["sha256"]:
+        return new_entry, None
+    return new_entry, data
+
+
+async def SyncWorld(world_dir: str, client: S3Client, prefix: str, manifest_path: str,
+                    workers: int = DEFAULT_WORKERS) -> SyncResult:
+    """
+    Uploads the world files that changed since the last sync and deletes the ones that were removed.
+
+    Args:
+        world_dir (str): The world directory, e.g. /opt/minecraft/servers/<profile>/world.
+        client (S3Client): The client for the bucket to sync to.
+        prefix (str): The key prefix the world is stored under.
+        manifest_path (str): Where the manifest of the last sync is kept on disk.
+        workers (int): The number of files read and uploaded concurrently.
+
+    Returns:
+        SyncResult: Statistics about the sync.
+    """
+    started = time.monotonic()
+    prefix = prefix.strip("/") + "/"
+    previous = LoadSyncManifest(manifest_path)
+    if not previous:
+        # A fresh volume may still have a copy in the bucket, which saves uploading every file again
+        data = await client.get_object(prefix + MANIFEST_NAME)
+        if data is not None:
+            previous = json.loads(data).get("files", {})
+
+    paths = await asyncio.to_thread(ListWorldFiles, world_dir)
+    current: dict[str, dict] = {}
+    uploaded: list[int] = []
+    slots = asyncio.Semaphore(workers)
+
+    async def sync_file(path: str):
+        async with slots:
+            try:
+                entry, data = await asyncio.to_thread(
+                    _read_changed_file, os.path.join(world_dir, *path.split("/")), previous.get(path))
+            except FileNotFoundError:
+                return
+            if data is not None:
+                await client.put_object(prefix + path, data)
+                uploaded.append(len(data))
+            current[path] = entry
+
+    async def delete_file(path: str):
+        async with slots:
+            await client.delete_object(prefix + path)
+
+    try:
+        await asyncio.gather(*(sync_file(path) for path in paths))
+        removed = sorted(set(previous) - set(current))
+        await asyncio.gather(*(delete_file(path) for path in removed))
+    except BaseException:
+        # Whatever was uploaded before the failure is recorded, so the next sync does not send it again
+        SaveSyncManifest(manifest_path, {**previous, **current})
+        raise
+
+    # The manifest is uploaded last, it only ever describes files that are already in the bucket
+    data = SaveSyncManifest(manifest_path, current)
+    await client.put_object(prefix + MANIFEST_NAME, data)
+
+    return SyncResult(
+        files=len(current),
+        uploaded=len(uploaded),
+        uploaded_bytes=sum(uploaded),
+        deleted=len(removed),
+        elapsed=time.monotonic() - started)
+
+
+async def ListSyncedWorlds(client: S3Client, prefix: str) -> list[BackupFile]:
+    """
+    Lists the files of every world synced below a prefix, one world per profile, for BackupWorld in
+    ./world_backup.py. The backup streams each file straight from the bucket.
+
+    Args:
+        client (S3Client): The client for the bucket the worlds are synced to.
+        prefix (str): The key prefix the profiles' worlds are stored under, e.g. worlds/.
+
+    Returns:
+        list[BackupFile]: The world files, with paths of the form <profile>/<path within the world>.
+    """
+    prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+    keys = await client.list_objects(prefix)
+    profiles = sorted({key[len(prefix):].split("/")[0] for key in keys if "/" in key[len(prefix):]})
+    files = []
+    for profile in profiles:
+        world_prefix = f"{prefix}{profile}/"
+        data = await client.get_object(world_prefix + MANIFEST_NAME)
+        if data is not None:
+            entries = json.loads(data).get("files", {})
+        else:
+            # A first sync cut short never uploaded its manifest, the files it did upload are still worth having
+            entries = {key[len(world_prefix):]: {} for key in keys if key.startswith(world_prefix)}
+        for path in sorted(path for path in entries if IsWorldFile(path)):
+            files.append(BackupFile(
+                path=f"{profile}/{path}",
+                mtime=entries[path].get("mtime_ns", time.time_ns()) / 1e9,
+                mode=0o644,
+                read=functools.partial(client.stream_object, world_prefix + path)))
+    return files
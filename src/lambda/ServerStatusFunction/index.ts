@@ -1,5 +1,9 @@
 import { Context, APIGatewayProxyResult, APIGatewayEvent } from "aws-lambda";
 import { DescribeInstancesCommand, EC2Client } from "@aws-sdk/client-ec2";
+import { Sha256 } from "@aws-crypto/sha256-js";
+import { defaultProvider } from "@aws-sdk/credential-provider-node";
+import { HttpRequest } from "@smithy/protocol-http";
+import { SignatureV4 } from "@smithy/signature-v4";
 
 export type InstanceStatus =
 	| "pending"
@@ -9,6 +13,48 @@ export type InstanceStatus =
 	| "stopping"
 	| "stopped";
 
+export interface ServerStatus {
+	state: "starting" | "running" | "stopping" | "stopped";
+	playersOnline: number | null;
+	playersMax: number | null;
+	version: string;
+	motd: string;
+	lastSeen: number | null;
+	// Only known when the monitor probes the server with the Query protocol
+	players: string[] | null;
+}
+
+// Seconds since the instance booted, see src/ec2/scripts/boot_timeline.py
+export interface ServerBootTimeline {
+	spawned: number | null;
+	firstAccept: number | null;
+	firstStatus: number | null;
+	done: number | null;
+	reportedStartup: number | null;
+}
+
+export interface BootTimeline {
+	version: number;
+	instanceId: string;
+	instanceType: string | null;
+	bootedAt: number;
+	serviceStart: number | null;
+	monitorStart: number;
+	servers: Record<string, ServerBootTimeline>;
+}
+
+// Published by src/ec2/scripts/status_snapshot.py while the instance is running
+export interface StatusSnapshot {
+	version: number;
+	instanceId: string;
+	updated: number;
+	ipAddress: string | null;
+	publicDNS: string | null;
+	servers: Record<string, ServerStatus>;
+	// Published once every server is up, or stopped before it was
+	bootTimeline: BootTimeline | null;
+}
+
 export interface Instance {
 	instanceId: string;
 	name: string;
@@ -16,6 +62,10 @@ export interface Instance {
 	status: InstanceStatus;
 	ipAddress: string | undefined;
 	publicDNS: string | undefined;
+	// Only present while the instance is publishing status snapshots
+	servers?: Record<string, ServerStatus>;
+	statusUpdated?: number;
+	bootTimeline?: BootTimeline;
 }
 
 export interface Response {
@@ -24,6 +74,89 @@ export interface Response {
 	instances: Instance[];
 }
 
+// The monitor publishes at least once a minute, an older snapshot was left behind by a stopped instance
+const STATUS_TTL_SECONDS = Number(process.env.STATUS_TTL_SECONDS ?? "150");
+// Snapshots are also cached in memory between invocations of a warm lambda
+const SNAPSHOT_CACHE_SECONDS = Number(process.env.SNAPSHOT_CACHE_SECONDS ?? "5");
+
+const ec2Client = new EC2Client({ region: process.env.AWS_REGION });
+// The snapshot is one small object, a GET signed like the SDK clients sign is all the S3 access needed
+const s3Signer = new SignatureV4({
+	credentials: defaultProvider(),
+	region: process.env.AWS_REGION ?? "",
+	service: "s3",
+	sha256: Sha256,
+	// S3 signs the path as sent, without encoding it a second time
+	uriEscapePath: false,
+});
+const snapshotCache = new Map<
+	string,
+	{ fetched: number; snapshot: StatusSnapshot | undefined }
+>();
+// Instance names and descriptions only change on redeploy, they are cached for the life of the lambda
+const instanceTags = new Map<string, { name: string; description: string }>();
+
+// Returns the body of an object, or undefined if it does not exist
+async function getObject(
+	bucket: string,
+	key: string,
+): Promise<string | undefined> {
+	const hostname = `${bucket}.s3.${process.env.AWS_REGION}.amazonaws.com`;
+	const request = await s3Signer.sign(
+		new HttpRequest({
+			method: "GET",
+			protocol: "https:",
+			hostname,
+			path: `/${key}`,
+			headers: { host: hostname },
+		}),
+	);
+	// fetch sets the host header itself
+	const { host, ...headers } = request.headers;
+	const response = await fetch(`https://${hostname}${request.path}`, {
+		headers,
+	});
+	// Without list access to the bucket, S3 reports a missing object as access denied
+	if (response.status === 404 || response.status === 403) {
+		return undefined;
+	}
+	if (!response.ok) {
+		throw new Error(
+			`S3 GET ${key} failed with status ${response.status}: ${await response.text()}`,
+		);
+	}
+	return await response.text();
+}
+
+async function getStatusSnapshot(
+	instanceId: string,
+): Promise<StatusSnapshot | undefined> {
+	const bucket = process.env.STATUS_BUCKET;
+	// The id becomes part of the object key
+	if (!bucket || !/^i-[0-9a-f]+$/.test(instanceId)) {
+		return undefined;
+	}
+
+	const now = Date.now() / 1000;
+	const cached = snapshotCache.get(instanceId);
+	if (cached && now - cached.fetched < SNAPSHOT_CACHE_SECONDS) {
+		return cached.snapshot;
+	}
+
+	let snapshot: StatusSnapshot | undefined;
+	try {
+		// NOTE: Ensure that this matches SnapshotKey in src/ec2/scripts/status_snapshot.py
+		const body = await getObject(bucket, `status/${instanceId}.json`);
+		snapshot =
+			body === undefined ? undefined : (JSON.parse(body) as StatusSnapshot);
+	} catch (error) {
+		console.error("Error reading status snapshot:", error);
+		snapshot = undefined;
+	}
+	snapshotCache.set(instanceId, { fetched: now, snapshot });
+	return snapshot;
+}
+
 export const handler = async (
 	event: APIGatewayEvent,
 	context: Context,
@@ -52,9 +185,39 @@ export const handler = async (
 	}
 
 	try {
-		const ec2Client = new EC2Client({
-			region: process.env.AWS_REGION,
-		});
+		// A fresh snapshot with a server that has not stopped means the instance is running,
+		// so EC2 does not need to be asked
+		const snapshot = await getStatusSnapshot(instanceID);
+		const tags = instanceTags.get(instanceID);
+		if (
+			snapshot &&
+			tags &&
+			Date.now() / 1000 - snapshot.updated < STATUS_TTL_SECONDS &&
+			Object.values(snapshot.servers).some(
+				(server) => server.state !== "stopped",
+			)
+		) {
+			return {
+				statusCode: 200,
+				body: JSON.stringify({
+					success: true,
+					message: "Successfully retrieved instance status",
+					instances: [
+						{
+							instanceId: instanceID,
+							name: tags.name,
+							description: tags.description,
+							status: "running",
+							ipAddress: snapshot.ipAddress || undefined,
+							publicDNS: snapshot.publicDNS || undefined,
+							servers: snapshot.servers,
+							statusUpdated: snapshot.updated,
+							bootTimeline: snapshot.bootTimeline ?? undefined,
+						},
+					],
+				} satisfies Response),
+			};
+		}
 
 		const describeCommand = new DescribeInstancesCommand({
 			InstanceIds: [instanceID],
@@ -74,6 +237,15 @@ export const handler = async (
 			};
 		}
 
+		const name =
+			instance.Tags?.find((tag) => tag.Key === "Name")?.Value ||
+			"Unnamed";
+		const description =
+			instance.Tags?.find((tag) => tag.Key === "Description")?.Value ||
+			"No description";
+		instanceTags.set(instanceID, { name, description });
+		const status = (instance.State?.Name as InstanceStatus) || "Unknown";
+
 		return {
 			statusCode: 200,
 			body: JSON.stringify({
@@ -82,18 +254,19 @@ export const handler = async (
 				instances: [
 					{
 						instanceId: instance.InstanceId || "Unknown",
-						name:
-							instance.Tags?.find((tag) => tag.Key === "Name")
-								?.Value || "Unnamed",
-						description:
-							instance.Tags?.find(
-								(tag) => tag.Key === "Description",
-							)?.Value || "No description",
-						status:
-							(instance.State?.Name as InstanceStatus) ||
-							"Unknown",
+						name,
+						description,
+						status,
 						ipAddress: instance.PublicIpAddress || undefined,
 						publicDNS: instance.PublicDnsName || undefined,
+						// A running instance may not have published yet, the last snapshot is still useful
+						...(status === "running" && snapshot
+							? {
+									servers: snapshot.servers,
+									statusUpdated: snapshot.updated,
+									bootTimeline: snapshot.bootTimeline ?? undefined,
+								}
+							: {}),
 					},
 				],
 			} satisfies Response),
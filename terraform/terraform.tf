@@ -63,6 +63,18 @@ variable "EBSSize" {
   description = "The size of the EBS volume attached to the EC2 instance in GB."
 }
 
+variable "WorldRamDisk" {
+  type        = bool
+  description = "Whether to run each world from RAM when it fits in a quarter of the instance's memory, syncing it back to the EBS volume every few minutes and before the instance stops."
+  default     = false
+}
+
+variable "WakeProxy" {
+  type        = bool
+  description = "Whether to answer status pings on the server port while the server is starting, so players see it as starting instead of offline."
+  default     = false
+}
+
 variable "EnableAuth" {
   type        = bool
   description = "Whether to setup Cognito for authentication. If false, the API will be open to the public and anyone can access it."
@@ -261,6 +273,21 @@ resource "aws_iam_role_policy" "LambdaEC2AccessRolePolicy" {
   policy = data.aws_iam_policy_document.LambdaEC2AccessPolicyDocument.json
 }
 
+# Allow the lambdas to read the status snapshots published by the instance
+data "aws_iam_policy_document" "LambdaStatusSnapshotPolicyDocument" {
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:GetObject"]
+    resources = ["${aws_s3_bucket.MinecraftData.arn}/status/*"]
+  }
+}
+
+resource "aws_iam_role_policy" "LambdaStatusSnapshotRolePolicy" {
+  name   = "LambdaStatusSnapshotRolePolicy"
+  role   = aws_iam_role.LambdaExecutionRole.id
+  policy = data.aws_iam_policy_document.LambdaStatusSnapshotPolicyDocument.json
+}
+
 # Create the assume role policy for EC2 to allow it to assume the role and access S3
 data "aws_iam_policy_document" "EC2AssumeRolePolicy" {
   statement {
@@ -349,6 +376,15 @@ resource "aws_s3_object" "MinecraftStopScriptObject" {
   etag   = filemd5("../src/ec2/scripts/stop-server.py")
 }
 
+# Upload the python modules imported by the stop script to S3
+resource "aws_s3_object" "MinecraftScriptModuleObjects" {
+  for_each = setsubtract(fileset("../src/ec2/scripts", "*.py"), ["stop-server.py"])
+  bucket   = aws_s3_bucket.MinecraftData.id
+  source   = "../src/ec2/scripts/${each.value}"
+  key      = "scripts/${each.value}"
+  etag     = filemd5("../src/ec2/scripts/${each.value}")
+}
+
 # Upload the Minecraft server services to S3
 resource "aws_s3_object" "MinecraftStartServerServiceObject" {
   bucket = aws_s3_bucket.MinecraftData.id
@@ -357,18 +393,20 @@ resource "aws_s3_object" "MinecraftStartServerServiceObject" {
   etag   = filemd5("../src/ec2/services/start-minecraft.service")
 }
 
-# Zip the server profile and upload to S3
-data "archive_file" "MinecraftServerProfileArchive" {
-  type        = "zip"
-  source_dir  = "../server"
-  output_path = "../build/minecraft_server_profiles/DefaultMinecraftProfile.zip"
+# Upload the server profile to S3. deploy.py packages ../server as a reproducible zip named by its hash
+# and records the name and hashes in a manifest, so the archive is only uploaded when its contents change.
+locals {
+  MinecraftServerProfileArchive = jsondecode(file("../build/minecraft_server_profiles/DefaultMinecraftProfile.json"))
 }
 
 resource "aws_s3_object" "MinecraftServerProfile" {
   bucket = aws_s3_bucket.MinecraftData.id
-  source = data.archive_file.MinecraftServerProfileArchive.output_path
+  source = "../build/minecraft_server_profiles/${local.MinecraftServerProfileArchive.file}"
   key    = "profiles/DefaultMinecraftProfile.zip"
-  etag   = filemd5(data.archive_file.MinecraftServerProfileArchive.output_path)
+  etag   = local.MinecraftServerProfileArchive.md5
+  metadata = {
+    "sha256" = local.MinecraftServerProfileArchive.sha256
+  }
 }
 
 # ------------------------------------------------------
@@ -381,6 +419,20 @@ variable "LambdaEnv" {
   }
 }
 
+# The AWS SDK packages the functions share, the function bundles leave them out. See BuildLambdaLayer in ../deploy.py
+data "archive_file" "LambdaDependenciesLayerCode" {
+  type        = "zip"
+  source_dir  = "../build/lambda_layer"
+  output_path = "../build/lambda_functions/dependencies_layer.zip"
+}
+
+resource "aws_lambda_layer_version" "LambdaDependenciesLayer" {
+  layer_name          = "MinecraftLambdaDependencies"
+  filename            = data.archive_file.LambdaDependenciesLayerCode.output_path
+  source_code_hash    = data.archive_file.LambdaDependenciesLayerCode.output_base64sha256
+  compatible_runtimes = ["nodejs24.x"]
+}
+
 data "archive_file" "ListInstancesFunctionCode" {
   type        = "zip"
   source_dir  = "../src/lambda/ListInstancesFunction/dist"
@@ -407,6 +459,7 @@ resource "aws_lambda_function" "ListInstancesFunction" {
 
   filename         = data.archive_file.ListInstancesFunctionCode.output_path
   source_code_hash = data.archive_file.ListInstancesFunctionCode.output_base64sha256
+  layers           = [aws_lambda_layer_version.LambdaDependenciesLayer.arn]
 
   environment {
     variables = var.LambdaEnv
@@ -428,9 +481,13 @@ resource "aws_lambda_function" "ServerStatusFunction" {
 
   filename         = data.archive_file.ServerStatusFunctionCode.output_path
   source_code_hash = data.archive_file.ServerStatusFunctionCode.output_base64sha256
+  layers           = [aws_lambda_layer_version.LambdaDependenciesLayer.arn]
 
   environment {
-    variables = var.LambdaEnv
+    # Status snapshots are read from the data bucket, see ../src/ec2/scripts/status_snapshot.py
+    variables = merge(var.LambdaEnv, {
+      STATUS_BUCKET = aws_s3_bucket.MinecraftData.bucket
+    })
   }
 
   logging_config {
@@ -449,6 +506,7 @@ resource "aws_lambda_function" "StartServerFunction" {
 
   filename         = data.archive_file.StartServerFunctionCode.output_path
   source_code_hash = data.archive_file.StartServerFunctionCode.output_base64sha256
+  layers           = [aws_lambda_layer_version.LambdaDependenciesLayer.arn]
 
   environment {
     variables = var.LambdaEnv
@@ -656,12 +714,18 @@ resource "aws_instance" "MinecraftServerInstance" {
   associate_public_ip_address = true
   security_groups             = [aws_security_group.MinecraftServerSecurityGroup.id]
 
-  user_data = templatefile(
+  # Compressed to stay below the 16 KB user data limit with the bootstrap scripts embedded, cloud-init
+  # decompresses it before running it
+  user_data_base64 = base64gzip(templatefile(
     "user_data.sh",
     {
-      s3_bucket = aws_s3_bucket.MinecraftData.bucket,
+      s3_bucket         = aws_s3_bucket.MinecraftData.bucket,
+      world_ram_disk    = var.WorldRamDisk ? "1" : "0",
+      wake_proxy        = var.WakeProxy ? "1" : "0",
+      aws_client_script = file("../src/ec2/scripts/aws_client.py"),
+      bootstrap_script  = file("../src/ec2/scripts/bootstrap.py"),
     }
-  )
+  ))
 
   tags = {
     # Used to identify instances that are part of the Minecraft server infrastructure
@@ -0,0 +1,109 @@
+"""
+Tests for the idle scheduler in ./src/ec2/scripts/idle_scheduler.py, driven by its simulated clock.
+
+Usage:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "ec2", "scripts"))
+
+from idle_scheduler import IdlePolicy, IdleScheduler, SimulatedClock, simulate  # noqa: E402
+
+POLICY = IdlePolicy(min_interval=15, player_interval=120, max_interval=900, backoff=2, idle_samples=3,
+                    idle_window=60, startup_grace=180)
+
+
+class IdleSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimulatedClock()
+        self.scheduler = IdleScheduler(POLICY, self.clock)
+
+    def probe(self, players: int | None) -> float:
+        """
+        Waits for the next probe and records its result.
+
+        Returns:
+            float: The gap that was waited before the probe.
+        """
+        interval = self.scheduler.next_interval()
+        self.clock.advance(interval)
+        self.scheduler.record(players)
+        return interval
+
+    def test_first_probe_waits_for_startup_grace(self):
+        self.clock.advance(30)
+        self.assertEqual(self.scheduler.next_interval(), 150)
+
+    def test_empty_server_is_idle_after_the_window(self):
+        self.assertEqual(self.probe(0), 180)
+        self.assertFalse(self.scheduler.is_idle())
+        # The remaining samples are spread across the idle window rather than packed at min_interval
+        self.assertEqual(self.probe(0), 30)
+        self.assertFalse(self.scheduler.is_idle())
+        self.assertEqual(self.probe(0), 30)
+        self.assertTrue(self.scheduler.is_idle())
+        self.assertEqual(self.clock.monotonic(), 180 + POLICY.idle_window)
+
+    def test_busy_server_backs_off_with_more_players(self):
+        self.probe(1)
+        self.assertEqual(self.scheduler.next_interval(), 120)
+        self.probe(2)
+        self.assertEqual(self.scheduler.next_interval(), 240)
+        for _ in range(5):
+            self.probe(6)
+        self.assertEqual(self.scheduler.next_interval(), POLICY.max_interval)
+        self.assertFalse(self.scheduler.is_idle())
+
+    def test_busy_server_is_probed_less_than_a_fixed_interval(self):
+        fixed = IdlePolicy(min_interval=180, player_interval=180, max_interval=180, idle_samples=1, idle_window=0,
+                           startup_grace=180)
+        hours = 4 * 60 * 60
+
+        def players_at(now: float) -> int:
+            return 3 if now < hours else 0
+
+        adaptive_result = simulate(POLICY, players_at, duration=2 * hours)
+        fixed_result = simulate(fixed, players_at, duration=2 * hours)
+        self.assertLess(adaptive_result.probes, fixed_result.probes)
+        self.assertIsNotNone(adaptive_result.stopped_at)
+        self.assertGreaterEqual(adaptive_result.stopped_at, hours + POLICY.idle_window)
+
+    def test_players_leaving_shortens_the_gap(self):
+        for _ in range(4):
+            self.probe(4)
+        self.assertEqual(self.scheduler.next_interval(), 900)
+        self.probe(2)
+        self.assertEqual(self.scheduler.next_interval(), 240)
+        self.probe(1)
+        self.assertEqual(self.scheduler.next_interval(), 120)
+        self.probe(0)
+        self.assertEqual(self.scheduler.next_interval(), 30)
+        self.probe(0)
+        self.probe(0)
+        self.assertTrue(self.scheduler.is_idle())
+
+    def test_reconnect_resets_the_idle_streak(self):
+        self.probe(1)
+        self.probe(0)
+        self.probe(0)
+        self.probe(1)
+        self.assertEqual(self.scheduler.zero_samples, 0)
+        self.probe(0)
+        self.probe(0)
+        self.assertFalse(self.scheduler.is_idle())
+        self.probe(0)
+        self.assertTrue(self.scheduler.is_idle())
+
+    def test_failed_probe_retries_soon_without_counting(self):
+        self.probe(0)
+        self.probe(None)
+        self.assertEqual(self.scheduler.zero_samples, 1)
+        self.assertEqual(self.scheduler.next_interval(), POLICY.min_interval)
+
+
+if __name__ == "__main__":
+    unittest.main()